@@ -8,6 +8,7 @@ from db_models.new_users import Base as NewUsers
 from db_models.documents import Base as DocumentTableBase
 from db_models.projects import Base as ProjectBase
 from db_models.reports import Base as ReportTableBase
+from db_models.jobs import Base as JobTableBase
 from db_models.relationships import *
 from alembic import context
 import os
@@ -45,6 +46,7 @@ target_metadata = [
     ProjectBase.metadata,
     ReportTableBase.metadata,
     DocumentTableBase.metadata,
+    JobTableBase.metadata,
 ]
 
 # other values from the config, defined by the needs of env.py,
@@ -0,0 +1,67 @@
+"""document catalog columns
+
+Revision ID: 3b8f2c1d9e47
+Revises: 725184128027
+Create Date: 2026-10-19 09:12:31.402117
+
+"""
+from typing import Sequence, Union
+import sqlalchemy_utils
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8f2c1d9e47'
+down_revision: Union[str, None] = '725184128027'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.alter_column('documents_table', 'project_id',
+    existing_type=sqlalchemy_utils.types.uuid.UUIDType(binary=False),
+    nullable=True)
+    op.add_column('documents_table', sa.Column('user_id', sqlalchemy_utils.types.uuid.UUIDType(binary=False), nullable=True))
+    op.add_column('documents_table', sa.Column('temp_project_id', sqlalchemy_utils.types.uuid.UUIDType(binary=False), nullable=True))
+    op.add_column('documents_table', sa.Column('bucket', sa.String(length=255), nullable=True))
+    op.add_column('documents_table', sa.Column('file_size', sa.BigInteger(), nullable=True))
+    op.add_column('documents_table', sa.Column('content_type', sa.String(length=255), nullable=True))
+    op.add_column('documents_table', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.add_column('documents_table', sa.Column('etag', sa.String(length=255), nullable=True))
+    op.add_column('documents_table', sa.Column('ingestion_status', sa.Enum('pending', 'ingesting', 'ingested', 'failed', name='ingestionstatus'), server_default='pending', nullable=False))
+    op.add_column('documents_table', sa.Column('parse_status', sa.Enum('pending', 'parsed', 'failed', 'not_applicable', name='parsestatus'), server_default='pending', nullable=False))
+    op.add_column('documents_table', sa.Column('index_version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('documents_table', sa.Column('created_at', sa.TIMESTAMP(), nullable=True))
+    op.add_column('documents_table', sa.Column('updated_at', sa.TIMESTAMP(), nullable=True))
+    # Rows written before the catalog are already in the knowledge base
+    op.execute(
+        "UPDATE documents_table SET ingestion_status='ingested', "
+        "parse_status='not_applicable'"
+    )
+    op.create_foreign_key('fk_documents_table_user_id', 'documents_table', 'users', ['user_id'], ['id'], ondelete='CASCADE')
+    op.create_index(op.f('ix_documents_table_user_id'), 'documents_table', ['user_id'], unique=False)
+    op.create_index(op.f('ix_documents_table_temp_project_id'), 'documents_table', ['temp_project_id'], unique=False)
+    op.create_index(op.f('ix_documents_table_content_hash'), 'documents_table', ['content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_documents_table_content_hash'), table_name='documents_table')
+    op.drop_index(op.f('ix_documents_table_temp_project_id'), table_name='documents_table')
+    op.drop_index(op.f('ix_documents_table_user_id'), table_name='documents_table')
+    op.drop_constraint('fk_documents_table_user_id', 'documents_table', type_='foreignkey')
+    op.drop_column('documents_table', 'updated_at')
+    op.drop_column('documents_table', 'created_at')
+    op.drop_column('documents_table', 'index_version')
+    op.drop_column('documents_table', 'parse_status')
+    op.drop_column('documents_table', 'ingestion_status')
+    op.drop_column('documents_table', 'etag')
+    op.drop_column('documents_table', 'content_hash')
+    op.drop_column('documents_table', 'content_type')
+    op.drop_column('documents_table', 'file_size')
+    op.drop_column('documents_table', 'bucket')
+    op.drop_column('documents_table', 'temp_project_id')
+    op.drop_column('documents_table', 'user_id')
+    op.alter_column('documents_table', 'project_id',
+    existing_type=sqlalchemy_utils.types.uuid.UUIDType(binary=False),
+    nullable=False)
@@ -0,0 +1,28 @@
+"""job dedupe key
+
+Revision ID: 4d2a9f6c1b38
+Revises: e51d0b6a8c92
+Create Date: 2026-10-19 16:22:31.904415
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d2a9f6c1b38'
+down_revision: Union[str, None] = 'e51d0b6a8c92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('jobs_table', sa.Column('dedupe_key', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_jobs_table_dedupe_key'), 'jobs_table', ['dedupe_key'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_jobs_table_dedupe_key'), table_name='jobs_table')
+    op.drop_column('jobs_table', 'dedupe_key')
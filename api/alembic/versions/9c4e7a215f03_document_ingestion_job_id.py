@@ -0,0 +1,28 @@
+"""document ingestion job id
+
+Revision ID: 9c4e7a215f03
+Revises: 3b8f2c1d9e47
+Create Date: 2026-10-19 11:40:05.118930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4e7a215f03'
+down_revision: Union[str, None] = '3b8f2c1d9e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('documents_table', sa.Column('ingestion_job_id', sa.String(length=255), nullable=True))
+    op.create_index(op.f('ix_documents_table_ingestion_job_id'), 'documents_table', ['ingestion_job_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_documents_table_ingestion_job_id'), table_name='documents_table')
+    op.drop_column('documents_table', 'ingestion_job_id')
@@ -0,0 +1,48 @@
+"""jobs table
+
+Revision ID: e51d0b6a8c92
+Revises: 9c4e7a215f03
+Create Date: 2026-10-19 13:05:47.630214
+
+"""
+from typing import Sequence, Union
+import sqlalchemy_utils
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e51d0b6a8c92'
+down_revision: Union[str, None] = '9c4e7a215f03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('jobs_table',
+    sa.Column('id', sqlalchemy_utils.types.uuid.UUIDType(binary=False), nullable=False),
+    sa.Column('user_id', sqlalchemy_utils.types.uuid.UUIDType(binary=False), nullable=True),
+    sa.Column('kind', sa.String(length=64), nullable=False),
+    sa.Column('status', sa.Enum('queued', 'running', 'succeeded', 'failed', name='jobstatus'), nullable=False),
+    sa.Column('progress', sa.Integer(), nullable=False),
+    sa.Column('message', sa.Text(), nullable=True),
+    sa.Column('payload', sa.JSON(), nullable=True),
+    sa.Column('result', sa.JSON(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+    sa.Column('started_at', sa.TIMESTAMP(), nullable=True),
+    sa.Column('finished_at', sa.TIMESTAMP(), nullable=True),
+    sa.Column('heartbeat_at', sa.TIMESTAMP(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_jobs_table_id'), 'jobs_table', ['id'], unique=False)
+    op.create_index(op.f('ix_jobs_table_user_id'), 'jobs_table', ['user_id'], unique=False)
+    op.create_index(op.f('ix_jobs_table_status'), 'jobs_table', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_jobs_table_status'), table_name='jobs_table')
+    op.drop_index(op.f('ix_jobs_table_user_id'), table_name='jobs_table')
+    op.drop_index(op.f('ix_jobs_table_id'), table_name='jobs_table')
+    op.drop_table('jobs_table')
@@ -1,15 +1,36 @@
+import os
+import json
 import time
-from typing import List
+import hashlib
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
 from enum import Enum
 from pydantic import BaseModel
 import logging
 from fastapi.responses import JSONResponse
 from api.apis.api_get_current_user import get_current_user
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
 from db_models.documents import DocumentTable
 from db_models.reports import ReportTable
 from db_models.projects import Project
-from db.db_session import get_db
+from db.db_session import SessionLocal, get_db
+from utils.document_catalog import link_documents_to_project
+from utils.job_queue import count_active_jobs, enqueue_job, find_job, job_to_dict
+from utils.kb_search import presign_citations
+from utils.deadline import research_deadline
+from utils.cancellation import (
+    ClientDisconnected,
+    RunCheckpoint,
+    run_checkpointed,
+    run_while_connected,
+)
+from utils.single_flight import SingleFlightConflict, single_flight
+from utils.admission import (
+    ADMISSION_MAX_QUEUE_PER_USER,
+    ADMISSION_PER_USER,
+    AdmissionRejected,
+    admission,
+)
 from sqlalchemy.orm import Session
 from api.services.deep_research.deep_research import deep_research
 from api.services.researcher.researcher import generate_report
@@ -56,6 +77,245 @@ class InstructionRequest(BaseModel):
     uploaded_files: List[UploadedFileData]
     researchType: str
     workflow: WorkflowEnum = WorkflowEnum.general
+    run_in_background: bool = False  # enqueue and poll /api/jobs/{id} instead of waiting
+    # Time budget for the run; the best report available is returned when it runs out
+    deadline_seconds: Optional[float] = None
+
+
+# ------------------------------------------------------------------------
+# SUBMISSION
+# ------------------------------------------------------------------------
+# Results of requests sent with an Idempotency-Key are replayed this long
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+
+# Identical submissions (double clicks, client retries) share one run
+research_flights = single_flight("research_create")
+
+
+def _submission_key(
+    query: InstructionRequest, user_id, idempotency_key: Optional[str]
+) -> Tuple[str, str]:
+    """(key, fingerprint) of a submission. Without an Idempotency-Key the
+    key is the request itself: user, temp project, instruction and flags."""
+    body = json.dumps(
+        query.model_dump(mode="json", exclude={"deadline_seconds"}), sort_keys=True
+    )
+    fingerprint = hashlib.sha256(f"{user_id}:{body}".encode()).hexdigest()
+    if idempotency_key:
+        key = hashlib.sha256(f"{user_id}:idem:{idempotency_key}".encode()).hexdigest()
+        return key, fingerprint
+    return fingerprint, fingerprint
+
+
+def _admission_kind(query: InstructionRequest) -> str:
+    return "deep_research" if query.researchType == "deep" else "research"
+
+
+def _project_to_dict(project: Project) -> dict:
+    return {
+        "id": str(project.id),
+        "name": project.name,
+        "temp_project_id": (
+            str(project.temp_project_id) if project.temp_project_id else None
+        ),
+        "user_id": str(project.user_id),
+        "created_at": (
+            project.created_at.isoformat() if project.created_at else None
+        ),
+        "updated_at": (
+            project.updated_at.isoformat() if project.updated_at else None
+        ),
+    }
+
+
+def _create_project(db: Session, query: InstructionRequest, user_id) -> Project:
+    # Create project with retry logic
+    max_retries = 3
+    for attempt in range(max_retries):
+        try:
+            project = Project(
+                name=query.instruction,
+                temp_project_id=query.temp_project_id,
+                user_id=user_id,
+                workflow=query.workflow,
+            )
+            db.add(project)
+            db.commit()
+            db.refresh(project)
+            break
+        except Exception as e:
+            if attempt == max_retries - 1:
+                raise
+            db.rollback()
+            time.sleep(1)  # Wait before retrying
+
+    # Uploads are catalogued under the temp project id; attach them to the
+    # project and only add rows for files the catalog never saw.
+    link_documents_to_project(db, user_id, query.temp_project_id, project.id)
+
+    if query.file_search:
+        known_paths = {
+            path
+            for (path,) in db.query(DocumentTable.file_path).filter(
+                DocumentTable.project_id == project.id
+            )
+        }
+        for file in query.uploaded_files:
+            if file.file_path in known_paths:
+                continue
+            document = DocumentTable(
+                project_id=project.id,
+                file_name=file.file_name,
+                file_path=file.file_path,
+            )
+            db.add(document)
+        db.commit()
+    return project
+
+
+async def _enqueue_research(
+    query: InstructionRequest,
+    user_id,
+    dedupe_key: str,
+    fingerprint: str,
+    idempotent: bool,
+) -> dict:
+    # Shared by every caller of the flight, so it has its own session
+    # instead of the request's
+    db = SessionLocal()
+    try:
+        # A retry of a queued submission gets the job that is already there
+        job = find_job(
+            db,
+            "research_report",
+            dedupe_key,
+            user_id=user_id,
+            created_after=(
+                datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+                if idempotent
+                else None
+            ),
+        )
+        if job is not None:
+            known = (job.payload or {}).get("fingerprint")
+            if known is not None and known != fingerprint:
+                # The Idempotency-Key was reused for a different request
+                raise SingleFlightConflict(
+                    f"Key {dedupe_key!r} was used for a different request"
+                )
+            project = (
+                db.query(Project).filter(Project.id == job.payload["project_id"]).first()
+            )
+        else:
+            # Jobs wait for their turn in admission control when they run; this
+            # only bounds how many one user can have outstanding
+            kind = _admission_kind(query)
+            active = count_active_jobs(db, "research_report", user_id)
+            if active >= ADMISSION_PER_USER + ADMISSION_MAX_QUEUE_PER_USER:
+                raise AdmissionRejected(
+                    "Too many research jobs in progress", admission.retry_after(kind)
+                )
+            project = _create_project(db, query, user_id)
+            job = enqueue_job(
+                db,
+                "research_report",
+                {
+                    "instruction": query.instruction,
+                    "report_type": int(query.report_type),
+                    "file_search": query.file_search,
+                    "web_search": query.web_search,
+                    "temp_project_id": query.temp_project_id,
+                    "user_id": str(user_id),
+                    "project_id": str(project.id),
+                    "research_type": query.researchType,
+                    "deadline_seconds": query.deadline_seconds,
+                    "fingerprint": fingerprint,
+                },
+                user_id=user_id,
+                dedupe_key=dedupe_key,
+            )
+        return {"job": job_to_dict(job), "project": _project_to_dict(project)}
+    finally:
+        db.close()
+
+
+async def _run_research(query: InstructionRequest, user_id) -> dict:
+    # Shared by every caller of the flight, so it has its own session
+    # instead of the request's
+    db = SessionLocal()
+    try:
+        # Wait for a slot before any rows are written; a request that is
+        # turned away leaves nothing behind
+        async with admission.admit(user_id, _admission_kind(query)):
+            return await _run_admitted(db, query, user_id)
+    finally:
+        db.close()
+
+
+async def _run_admitted(db: Session, query: InstructionRequest, user_id) -> dict:
+    project = _create_project(db, query, user_id)
+
+    def save_partial(checkpoint: RunCheckpoint):
+        db.add(
+            ReportTable(
+                project_id=project.id,
+                query=query.instruction,
+                response=checkpoint.report,
+                sections=checkpoint.sections,
+                research=query.researchType,
+            )
+        )
+        db.commit()
+
+    # Run research
+    deadline = research_deadline(query.researchType, query.deadline_seconds)
+    research = deep_research if query.researchType == "deep" else generate_report
+    result = await run_checkpointed(
+        research(
+            query.instruction,
+            int(query.report_type),
+            query.file_search,
+            query.web_search,
+            query.temp_project_id,
+            user_id,
+            deadline=deadline,
+        ),
+        on_cancel=save_partial,
+    )
+
+    if result is None:
+        raise HTTPException(
+            status_code=500, detail="Research failed to generate results"
+        )
+
+    # Save report with retry logic
+    max_retries = 3
+    for attempt in range(max_retries):
+        try:
+            report = ReportTable(
+                project_id=project.id,
+                query=query.instruction,
+                response=result.get("report", ""),
+                sections=result.get("sections", []),
+                research=query.researchType,
+            )
+            db.add(report)
+            db.commit()
+            break
+        except Exception as e:
+            if attempt == max_retries - 1:
+                raise HTTPException(
+                    status_code=500,
+                    detail="Failed to save report after multiple attempts",
+                )
+            db.rollback()
+            time.sleep(1)
+
+    return {
+        "report": result.get("report", ""),
+        "sections": result.get("sections", []),
+        "project": _project_to_dict(project),
+    }
 
 
 # ------------------------------------------------------------------------
@@ -67,122 +327,77 @@ create_research_deep_router = APIRouter()
 @create_research_deep_router.post("/api/deep-researcher-langgraph/create")
 async def deep_research_tool(
     query: InstructionRequest,
+    request: Request,
     current_user=Depends(get_current_user),
     db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
 ):
     try:
         user_id = current_user.id
+        key, fingerprint = _submission_key(query, user_id, idempotency_key)
+        keep_for = IDEMPOTENCY_TTL_SECONDS if idempotency_key else 0.0
 
-        # Create project with retry logic
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                project = Project(
-                    name=query.instruction,
-                    temp_project_id=query.temp_project_id,
-                    user_id=user_id,
-                    workflow=query.workflow,
-                )
-                db.add(project)
-                db.commit()
-                db.refresh(project)
-                break
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    raise
-                db.rollback()
-                time.sleep(1)  # Wait before retrying
-
-        if query.file_search:
-            files = query.uploaded_files
-            for file in files:
-                document = DocumentTable(
-                    project_id=project.id,
-                    file_name=file.file_name,
-                    file_path=file.file_path,
-                )
-                db.add(document)
-            db.commit()
-
-        # Run research
-        if query.researchType == "deep":
-            result = await deep_research(
-                query.instruction,
-                int(query.report_type),
-                query.file_search,
-                query.web_search,
-                query.temp_project_id,
-                user_id,
-            )
-        else:
-            result = await generate_report(
-                query.instruction,
-                int(query.report_type),
-                query.file_search,
-                query.web_search,
-                query.temp_project_id,
-                user_id,
+        if query.run_in_background:
+            queued = await research_flights.do(
+                key,
+                lambda: _enqueue_research(
+                    query, user_id, key, fingerprint, idempotency_key is not None
+                ),
+                keep_for=keep_for,
+                fingerprint=fingerprint,
             )
-
-        if result is None:
-            raise HTTPException(
-                status_code=500, detail="Research failed to generate results"
+            return JSONResponse(
+                content={
+                    "message": "Research queued",
+                    "data": {
+                        "job": queued["job"],
+                        "researchType": query.researchType,
+                        "project": queued["project"],
+                    },
+                },
+                status_code=202,
             )
 
-        # Save report with retry logic
-        for attempt in range(max_retries):
-            try:
-                report = ReportTable(
-                    project_id=project.id,
-                    query=query.instruction,
-                    response=result.get("report", ""),
-                    sections=result.get("sections", []),
-                    research=query.researchType,
-                )
-                db.add(report)
-                db.commit()
-                break
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    raise HTTPException(
-                        status_code=500,
-                        detail="Failed to save report after multiple attempts",
-                    )
-                db.rollback()
-                time.sleep(1)
+        # Duplicates attach to the run already in flight; the run is
+        # cancelled once every client waiting for it has gone
+        result = await run_while_connected(
+            request,
+            research_flights.do(
+                key,
+                lambda: _run_research(query, user_id),
+                keep_for=keep_for,
+                fingerprint=fingerprint,
+            ),
+            what=f"{query.researchType} research for {query.temp_project_id}",
+        )
 
         return JSONResponse(
             content={
                 "message": "Research generated successfully",
                 "data": {
-                    "report": result.get("report", ""),
-                    "sections": result.get("sections", []),
+                    "report": result["report"],
+                    "sections": presign_citations(result["sections"]),
                     "researchType": query.researchType,
-                    "project": {
-                        "id": str(project.id),
-                        "name": project.name,
-                        "temp_project_id": (
-                            str(project.temp_project_id)
-                            if project.temp_project_id
-                            else None
-                        ),
-                        "user_id": str(project.user_id),
-                        "created_at": (
-                            project.created_at.isoformat()
-                            if project.created_at
-                            else None
-                        ),
-                        "updated_at": (
-                            project.updated_at.isoformat()
-                            if project.updated_at
-                            else None
-                        ),
-                    },
+                    "project": result["project"],
                 },
             },
             status_code=200,
         )
 
+    except ClientDisconnected:
+        # Nobody is listening; 499 is what proxies log for this
+        return Response(status_code=499)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except SingleFlightConflict as e:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used for a different request",
+        )
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
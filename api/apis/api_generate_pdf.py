@@ -1,5 +1,4 @@
 import os
-import asyncio
 from datetime import datetime
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
@@ -7,6 +6,7 @@ from fastapi.responses import JSONResponse
 
 # Import the new OpenAI client interface
 from openai import OpenAI
+from utils.executors import run_in
 
 pdf_report_router = APIRouter()
 
@@ -219,8 +219,9 @@ Markdown content:
         print(
             "[generate_enhanced_html] Sending detailed prompt to OpenAI GPT-4o mini..."
         )
-        # Run the synchronous OpenAI call in a separate thread
-        response = await asyncio.to_thread(
+        # Run the synchronous OpenAI call on the LLM pool
+        response = await run_in(
+            "llm",
             lambda: client.chat.completions.create(
                 messages=[
                     {
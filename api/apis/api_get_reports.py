@@ -5,6 +5,7 @@ from db_models.reports import ReportTable
 from db.db_session import get_db
 from sqlalchemy.orm import Session
 from sqlalchemy import asc
+from utils.kb_search import presign_citations
 from dotenv import load_dotenv, find_dotenv
 
 env_path = find_dotenv()  # walks up until it finds .env
@@ -40,7 +41,7 @@ def get_reports_sorted_by_updated_at(
                 "query": str(report.query),
                 "response": str(report.response),
                 "updated_at": str(report.updated_at),
-                "sections": report.sections,
+                "sections": presign_citations(report.sections),
                 "research": str(report.research),
             }
             for report in reports
@@ -107,8 +107,12 @@ async def get_ai_response(data: str, websocket: WebSocket) -> AsyncGenerator[str
         stream=True,
     )
 
-    async for chunk in response:
-        if chunk.choices:
-            await websocket.send_json(
-                {"type": "report", "output": chunk.choices[0].delta.content or ""}
-            )
+    try:
+        async for chunk in response:
+            if chunk.choices:
+                await websocket.send_json(
+                    {"type": "report", "output": chunk.choices[0].delta.content or ""}
+                )
+    finally:
+        # Also on cancellation: stop generating tokens nobody will read
+        await response.close()
@@ -0,0 +1,61 @@
+from fastapi.responses import JSONResponse
+from api.apis.api_get_current_user import get_current_user
+from fastapi import APIRouter, Depends, HTTPException
+from db_models.jobs import JobTable, JobStatus
+from db.db_session import get_db
+from sqlalchemy.orm import Session
+from utils.job_queue import job_to_dict
+from utils.kb_search import presign_citations
+
+
+jobs_router = APIRouter()
+
+
+def _get_owned_job(job_id: str, current_user, db: Session) -> JobTable:
+    job = db.query(JobTable).filter(JobTable.id == job_id).first()
+    if not job or str(job.user_id) != str(current_user.id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@jobs_router.get("/api/jobs/{job_id}")
+def get_job_status(
+    job_id: str,
+    current_user=Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    job = _get_owned_job(job_id, current_user, db)
+    return JSONResponse(
+        content={"message": "Job fetched successfully", "data": job_to_dict(job)},
+        status_code=200,
+    )
+
+
+@jobs_router.get("/api/jobs/{job_id}/result")
+def get_job_result(
+    job_id: str,
+    current_user=Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    job = _get_owned_job(job_id, current_user, db)
+    if job.status in (JobStatus.queued, JobStatus.running):
+        # Not finished yet; the client should keep polling
+        return JSONResponse(
+            content={"message": "Job is still running", "data": job_to_dict(job)},
+            status_code=202,
+        )
+    if job.status == JobStatus.failed:
+        raise HTTPException(status_code=500, detail=job.error or "Job failed")
+    data = job_to_dict(job, include_result=True)
+    if isinstance(data["result"], dict) and data["result"].get("sections"):
+        data["result"] = {
+            **data["result"],
+            "sections": presign_citations(data["result"]["sections"]),
+        }
+    return JSONResponse(
+        content={
+            "message": "Job result fetched successfully",
+            "data": data,
+        },
+        status_code=200,
+    )
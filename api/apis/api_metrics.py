@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+from api.apis.api_get_current_user import get_current_user
+from utils.metrics import collect_metrics
+
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/api/metrics")
+def get_metrics(current_user=Depends(get_current_user)):
+    return JSONResponse(
+        content={"message": "Metrics fetched successfully", "data": collect_metrics()},
+        status_code=200,
+    )
@@ -1,11 +1,11 @@
-import time
-from typing import List
+import asyncio
+from typing import List, Optional
 from enum import Enum
 from pydantic import BaseModel
 import logging
 from fastapi.responses import JSONResponse
 from api.apis.api_get_current_user import get_current_user
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from db_models.reports import ReportTable
 from db_models.projects import Project
 from db.db_session import get_db
@@ -13,6 +13,21 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 from api.services.deep_research.deep_research import deep_research
 from api.services.researcher.researcher import generate_report
+from utils.job_queue import count_active_jobs, enqueue_job, job_to_dict
+from utils.kb_search import presign_citations
+from utils.deadline import remaining, research_deadline
+from utils.cancellation import (
+    ClientDisconnected,
+    RunCheckpoint,
+    run_checkpointed,
+    run_while_connected,
+)
+from utils.admission import (
+    ADMISSION_MAX_QUEUE_PER_USER,
+    ADMISSION_PER_USER,
+    AdmissionRejected,
+    admission,
+)
 from dotenv import load_dotenv, find_dotenv
 
 env_path = find_dotenv()  # walks up until it finds .env
@@ -56,11 +71,15 @@ class InstructionRequest(BaseModel):
     uploaded_files: List[UploadedFileData]
     researchType: str
     workflow: WorkflowEnum = WorkflowEnum.general
+    run_in_background: bool = False  # enqueue and poll /api/jobs/{id} instead of waiting
+    # Time budget for the run; the best report available is returned when it runs out
+    deadline_seconds: Optional[float] = None
 
 
 @update_deep_researcher_router.post("/api/deep-researcher-langgraph/update")
 async def deep_research_tool_update(
     query: InstructionRequest,
+    request: Request,
     current_user=Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
@@ -78,34 +97,90 @@ async def deep_research_tool_update(
                 content={"message": "Project not found", "data": None}, status_code=404
             )
 
-        # Run research with proper state handling
+        kind = "deep_research" if query.researchType == "deep" else "research"
+        if query.run_in_background:
+            # Jobs wait for their turn in admission control when they run;
+            # this only bounds how many one user can have outstanding
+            active = count_active_jobs(db, "research_report", user_id)
+            if active >= ADMISSION_PER_USER + ADMISSION_MAX_QUEUE_PER_USER:
+                raise AdmissionRejected(
+                    "Too many research jobs in progress", admission.retry_after(kind)
+                )
+            job = enqueue_job(
+                db,
+                "research_report",
+                {
+                    "instruction": query.instruction,
+                    "report_type": int(query.report_type),
+                    "file_search": query.file_search,
+                    "web_search": query.web_search,
+                    "temp_project_id": query.temp_project_id,
+                    "user_id": str(user_id),
+                    "project_id": str(project.id),
+                    "research_type": query.researchType,
+                    "deadline_seconds": query.deadline_seconds,
+                    "update": True,
+                },
+                user_id=user_id,
+            )
+            return JSONResponse(
+                content={
+                    "message": "Research update queued",
+                    "data": {
+                        "job": job_to_dict(job),
+                        "research": query.researchType,
+                        "project": {"id": str(project.id), "name": project.name},
+                    },
+                },
+                status_code=202,
+            )
+
+        def save_partial(checkpoint: RunCheckpoint):
+            db.add(
+                ReportTable(
+                    project_id=query.project_id,
+                    query=query.instruction,
+                    response=checkpoint.report,
+                    sections=checkpoint.sections,
+                    research=query.researchType,
+                )
+            )
+            db.commit()
+
+        # Run research with proper state handling; retries share one deadline
+        # and the run is cancelled if the client goes away
         result = None
-        for attempt in range(MAX_RETRIES):
-            try:
-                if query.researchType == "deep":
-                    result = await deep_research(
-                        query.instruction,
-                        int(query.report_type),
-                        query.file_search,
-                        query.web_search,
-                        query.temp_project_id,
-                        user_id,
-                    )
-                else:
-                    result = await generate_report(
-                        query.instruction,
-                        int(query.report_type),
-                        query.file_search,
-                        query.web_search,
-                        query.temp_project_id,
-                        user_id,
+        deadline = research_deadline(query.researchType, query.deadline_seconds)
+        research = deep_research if query.researchType == "deep" else generate_report
+        # The slot is held across retries; the client waits here when the
+        # process is busy and gets a 429 when it is overloaded
+        async with admission.admit(user_id, kind):
+            for attempt in range(MAX_RETRIES):
+                try:
+                    result = await run_while_connected(
+                        request,
+                        run_checkpointed(
+                            research(
+                                query.instruction,
+                                int(query.report_type),
+                                query.file_search,
+                                query.web_search,
+                                query.temp_project_id,
+                                user_id,
+                                deadline=deadline,
+                            ),
+                            on_cancel=save_partial,
+                        ),
+                        what=f"{query.researchType} research update for project {query.project_id}",
                     )
-                break
-            except Exception as e:
-                if attempt == MAX_RETRIES - 1:
+                    break
+                except ClientDisconnected:
                     raise
-                time.sleep(RETRY_DELAY)
-                continue
+                except Exception as e:
+                    if attempt == MAX_RETRIES - 1 or remaining(deadline) < RETRY_DELAY:
+                        raise
+                    await asyncio.sleep(RETRY_DELAY)
+                    continue
 
         if result is None:
             raise HTTPException(
@@ -150,7 +225,7 @@ async def deep_research_tool_update(
                         status_code=500,
                         detail=f"Failed to save report after {MAX_RETRIES} attempts",
                     )
-                time.sleep(RETRY_DELAY)
+                await asyncio.sleep(RETRY_DELAY)
                 continue
 
         return JSONResponse(
@@ -158,7 +233,7 @@ async def deep_research_tool_update(
                 "message": "Research updated successfully",
                 "data": {
                     "report": final_report,
-                    "sections": sections,
+                    "sections": presign_citations(sections),
                     "research": query.researchType,
                     "project": {
                         "id": str(project.id),
@@ -187,6 +262,15 @@ async def deep_research_tool_update(
 
     except HTTPException:
         raise  # Re-raise HTTP exceptions
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ClientDisconnected:
+        # Nobody is listening; 499 is what proxies log for this
+        return Response(status_code=499)
     except Exception as e:
         db.rollback()
         logger.error(f"Error in deep_research_tool_update: {str(e)}", exc_info=True)
@@ -1,27 +1,112 @@
 import os
-import uuid
-import time
 import json
-from typing import List
+import asyncio
+import hashlib
+import logging
+from typing import List, Optional
 from fastapi.responses import JSONResponse
 from api.apis.api_get_current_user import get_current_user
 from fastapi import APIRouter, Depends, File, Form, UploadFile, HTTPException
-import botocore
-from utils.aws_utils import AwsUtlis
-from utils.excel_utils import build_or_load_excel_index
+from db.db_session import SessionLocal
+from utils.storage import get_storage, StorageError
+from utils.job_queue import enqueue_job
+from utils.document_catalog import upsert_document, find_document_by_hash
+from utils.ingestion import ingestion_coordinator
+from utils.executors import run_in
 from dotenv import load_dotenv, find_dotenv
 
 env_path = find_dotenv()  # walks up until it finds .env
 loaded = load_dotenv(env_path)
 
+logger = logging.getLogger(__name__)
+
 deer_research_upload_files_router = APIRouter()
 
-KNOWLEDGE_BASE_ID = os.getenv("KNOWLEDGE_BASE_ID")
-DATA_SOURCE_ID = os.getenv("DATA_SOURCE_ID")
 BUCKET_NAME = os.getenv("BUCKET_NAME", "deep-research-docs")
 
-bedrock_client = AwsUtlis.get_bedrock_agent()
-s3_client = AwsUtlis.get_s3_client()
+# Files above the storage multipart threshold are sent as concurrent part uploads
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _hash_fileobj(fileobj) -> str:
+    """sha256 of a spooled upload, leaving the file positioned at the start."""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def _find_duplicate(user_id: str, temp_project_id: str, content_hash: str) -> Optional[str]:
+    """Path of an already catalogued file with the same content, if any.
+
+    Runs on a worker thread, so it uses its own session rather than the
+    request's (the uploads of one request look up concurrently).
+    """
+    db = SessionLocal()
+    try:
+        existing = find_document_by_hash(db, user_id, temp_project_id, content_hash)
+        return existing.file_path if existing else None
+    finally:
+        db.close()
+
+
+def _record_upload(**fields) -> str:
+    """Catalog an uploaded object in its own session; returns the row id."""
+    db = SessionLocal()
+    try:
+        return str(upsert_document(db, **fields).id)
+    finally:
+        db.close()
+
+
+def _enqueue_excel_index(user_id: str, temp_project_id: str) -> str:
+    db = SessionLocal()
+    try:
+        job = enqueue_job(
+            db,
+            "excel_index",
+            {"user_id": str(user_id), "project_id": temp_project_id},
+            user_id=user_id,
+        )
+        return str(job.id)
+    finally:
+        db.close()
+
+
+async def _store_file(
+    file: UploadFile, key: str, user_id: str, temp_project_id: str, content_hash: str
+) -> dict:
+    """Upload one file plus its KB metadata sidecar; returns the object's head."""
+    storage = get_storage()
+    await storage.upload_fileobj(
+        file.file,
+        BUCKET_NAME,
+        key,
+        content_type=file.content_type or "application/octet-stream",
+        metadata={
+            "user_id": str(user_id),
+            "project_id": str(temp_project_id),
+            "sha256": content_hash,
+        },
+    )
+
+    # Optionally, upload additional metadata as a separate JSON object.
+    metadata_dict = {
+        "metadataAttributes": {
+            "user_id": str(user_id),
+            "project_id": str(temp_project_id),
+        }
+    }
+    await storage.write(
+        BUCKET_NAME,
+        f"{key}.metadata.json",
+        json.dumps(metadata_dict).encode(),
+        content_type="application/json",
+    )
+    return await storage.head(BUCKET_NAME, key) or {}
 
 
 @deer_research_upload_files_router.post("/api/upload-deep-research")
@@ -31,85 +116,101 @@ async def upload_files(
     current_user=Depends(get_current_user),
 ):
     user_id = current_user.id
-    results = []
+    semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    seen_hashes: dict[str, str] = {}  # identical files within this request
 
-    # Upload every file into the same file bucket (BUCKET_NAME)
-    for file in files:
+    async def _upload(file: UploadFile):
         key = f"{user_id}/{temp_project_id}/{file.filename}"
-        try:
-            s3_client.upload_fileobj(
-                file.file,
-                BUCKET_NAME,
-                key,
-                ExtraArgs={
-                    "Metadata": {
-                        "user_id": str(user_id),
-                        "project_id": str(temp_project_id),
-                    }
-                },
-            )
-
-            # Optionally, upload additional metadata as a separate JSON object.
-            metadata_dict = {
-                "metadataAttributes": {
-                    "user_id": str(user_id),
-                    "project_id": str(temp_project_id),
-                }
-            }
-            metadata_content = json.dumps(metadata_dict)
-            metadata_key = f"{key}.metadata.json"
-            s3_client.put_object(
-                Bucket=BUCKET_NAME,
-                Key=metadata_key,
-                Body=metadata_content,
-                ContentType="application/json",
+        async with semaphore:
+            content_hash = await run_in("cpu", _hash_fileobj, file.file)
+            existing = await asyncio.to_thread(
+                _find_duplicate, user_id, temp_project_id, content_hash
             )
-        except botocore.exceptions.ClientError as e:
-            raise HTTPException(
-                status_code=500, detail=f"Upload to S3 failed for file: {file.filename}"
+            duplicate_of = existing or seen_hashes.get(content_hash)
+            if duplicate_of:
+                logger.debug(
+                    "Skipping duplicate upload %s (%s)", file.filename, duplicate_of
+                )
+                return file, duplicate_of, None
+            seen_hashes[content_hash] = key
+            head = await _store_file(file, key, user_id, temp_project_id, content_hash)
+            # Record the object in the document catalog
+            document_id = await asyncio.to_thread(
+                _record_upload,
+                user_id=user_id,
+                temp_project_id=temp_project_id,
+                bucket=BUCKET_NAME,
+                file_path=key,
+                file_name=file.filename,
+                file_size=head.get("ContentLength"),
+                content_type=file.content_type or head.get("ContentType"),
+                content_hash=content_hash,
+                etag=head.get("ETag", "").strip('"'),
             )
+            return file, key, document_id
+
+    # Upload every file into the same file bucket (BUCKET_NAME), off the event loop
+    outcomes = await asyncio.gather(
+        *[_upload(file) for file in files], return_exceptions=True
+    )
+
+    results = []
+    stored_keys = []
+    stored_doc_ids = []
+    failures = []
+    for file, outcome in zip(files, outcomes):
+        if isinstance(outcome, StorageError):
+            failures.append((file.filename, outcome))
+            continue
+        if isinstance(outcome, BaseException):
+            raise outcome
+        file, key, document_id = outcome
+        duplicate = document_id is None
+        if not duplicate:
+            stored_keys.append(key)
+            stored_doc_ids.append(document_id)
         results.append(
-            {"file_name": file.filename, "file_path": key, "bucket": BUCKET_NAME}
+            {
+                "file_name": file.filename,
+                "file_path": key,
+                "bucket": BUCKET_NAME,
+                "duplicate": duplicate,
+            }
         )
 
-        # Close prev ingestion jobs
-        AwsUtlis.close_previous_ingestion_jobs()
-
-        # Start non-Excel ingestion job with retries if needed.
-        max_retries = 3
-        for attempt in range(1, max_retries + 1):
-            try:
-                bedrock_client.start_ingestion_job(
-                    knowledgeBaseId=KNOWLEDGE_BASE_ID,
-                    dataSourceId=DATA_SOURCE_ID,
-                    clientToken=str(uuid.uuid4()),
-                    description="starting ingestion",
-                )
-                break  # Exit retry loop if successful.
-            except botocore.exceptions.ClientError as e:
-                print(f"Ingestion job attempt {attempt} failed for key: {key}")
-                print("Error details:", e.response)
-                if attempt == max_retries:
-                    print(
-                        f"Max retries reached for key: {key}. Moving on to next file."
-                    )
-                else:
-                    time.sleep(1)
+    # One ingestion job for the whole upload (debounced across requests)
+    ingestion_coordinator.schedule(stored_doc_ids, user_id, temp_project_id)
 
     # After all files are uploaded, check if any Excel files were submitted.
     excel_file_uploaded = any(
-        file.filename.lower().endswith((".xls", ".xlsx")) for file in files
+        key.lower().endswith((".xls", ".xlsx")) for key in stored_keys
     )
+    excel_job_id = None
     if excel_file_uploaded:
-        # Call the index builder function to process Excel files from the file bucket
-        # and upload the resulting index into the separate index bucket.
-        index = build_or_load_excel_index(user_id, temp_project_id)
-        if index is None:
-            print("[DEBUG] No Excel index was created.")
-        else:
-            print("[DEBUG] Excel index successfully built and uploaded.")
+        # Index the Excel files from the file bucket in the background; the
+        # job uploads the resulting index into the separate index bucket.
+        excel_job_id = await asyncio.to_thread(
+            _enqueue_excel_index, user_id, temp_project_id
+        )
+
+    if failures:
+        # The files that did upload are catalogued and queued above
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "message": "Upload to S3 failed: "
+                + "; ".join(f"{name}: {e}" for name, e in failures),
+                "failed": [name for name, _ in failures],
+                "data": results,
+                "excel_index_job_id": excel_job_id,
+            },
+        )
 
     return JSONResponse(
-        content={"message": "Files uploaded successfully", "data": results},
+        content={
+            "message": "Files uploaded successfully",
+            "data": results,
+            "excel_index_job_id": excel_job_id,
+        },
         status_code=200,
     )
@@ -2,13 +2,16 @@ import os
 from fastapi.responses import JSONResponse
 from api.apis.api_get_current_user import get_current_user
 from fastapi import APIRouter, Depends, File, Form, UploadFile, HTTPException
-from utils.aws_utils import AwsUtlis
+from sqlalchemy.orm import Session
+from db.db_session import get_db
+from utils.storage import get_storage
+from utils.document_catalog import upsert_document
+from utils.job_queue import enqueue_job
+from db_models.documents import ParseStatus
 from dotenv import load_dotenv, find_dotenv
 
 OUTLINE_BUCKET_NAME = os.getenv("OUTLINE_BUCKET_NAME", "outline-helper")
 
-s3_client = AwsUtlis.get_s3_client()
-
 env_path = find_dotenv()  # walks up until it finds .env
 loaded = load_dotenv(env_path)
 
@@ -21,32 +24,60 @@ async def upload_files(
     files: UploadFile = File(...),
     temp_project_id: str = Form(...),
     current_user=Depends(get_current_user),
+    db: Session = Depends(get_db),
 ):
     user_id = current_user.id
     key = f"{user_id}/{temp_project_id}/{files.filename}"
 
     try:
         # Upload the file to S3
-        s3_client.upload_fileobj(
+        storage = get_storage()
+        await storage.upload_fileobj(
             files.file,
             OUTLINE_BUCKET_NAME,
             key,
-            ExtraArgs={
-                "Metadata": {
-                    "user_id": str(user_id),
-                    "project_id": str(temp_project_id),
-                }
+            metadata={
+                "user_id": str(user_id),
+                "project_id": str(temp_project_id),
             },
         )
+        head = await storage.head(OUTLINE_BUCKET_NAME, key) or {}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload to S3 failed: {str(e)}")
 
+    # Record the outline in the document catalog
+    is_pdf = key.lower().endswith(".pdf")
+    etag = head.get("ETag", "").strip('"')
+    document = upsert_document(
+        db,
+        user_id=user_id,
+        temp_project_id=temp_project_id,
+        bucket=OUTLINE_BUCKET_NAME,
+        file_path=key,
+        file_name=files.filename,
+        file_size=head.get("ContentLength"),
+        content_type=files.content_type or head.get("ContentType"),
+        etag=etag,
+        parse_status=ParseStatus.pending if is_pdf else ParseStatus.not_applicable,
+    )
+
+    # Parse once now; research runs read the stored artifact
+    parse_job = None
+    if is_pdf:
+        parse_job = enqueue_job(
+            db,
+            "outline_parse",
+            {"document_id": str(document.id), "file_path": key, "etag": etag},
+            user_id=user_id,
+        )
+
     return JSONResponse(
         content={
             "message": "File uploaded successfully",
             "file_name": files.filename,
             "file_path": key,
             "bucket": OUTLINE_BUCKET_NAME,
+            "parse_job_id": str(parse_job.id) if parse_job else None,
         },
         status_code=200,
     )
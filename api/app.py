@@ -19,6 +19,13 @@ from api.apis.api_get_project_list import project_list_router
 from api.apis.api_get_reports import reports_router
 from api.apis.api_upload_outline_file import upload_outline_file_router
 from apis.api_kb_search import aws_kb_router
+from api.apis.api_jobs import jobs_router
+from api.apis.api_metrics import metrics_router
+from utils.job_queue import job_worker_pool
+from utils.executors import shutdown_executors
+from utils.graph_registry import graph_registry
+from utils.ingestion import ingestion_coordinator
+import api.services.research_jobs  # registers background job handlers
 
 
 import logging
@@ -41,6 +48,21 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def start_job_workers():
+    # Compile the report graphs before the first request needs them
+    graph_registry.warm()
+    job_worker_pool.start()
+    # Uploads batched in memory before a restart would otherwise stay pending
+    await ingestion_coordinator.recover()
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_worker_pool.stop()
+    shutdown_executors()
+
+
 @app.exception_handler(ValidationError)
 async def validation_exception_handler(request: Request, exc: ValidationError):
     return JSONResponse(
@@ -71,6 +93,8 @@ app.include_router(deer_research_upload_files_router)
 app.include_router(project_list_router)
 app.include_router(reports_router)
 app.include_router(upload_outline_file_router)
+app.include_router(jobs_router)
+app.include_router(metrics_router)
 
 if __name__ == "__main__":
     uvicorn.run("api.app:app", host="0.0.0.0", port=8000, reload=True, loop="asyncio")
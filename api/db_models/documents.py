@@ -1,17 +1,56 @@
-from sqlalchemy import Column, Integer, String, Text,  ForeignKey
+from sqlalchemy import (
+    Column,
+    Integer,
+    BigInteger,
+    String,
+    Text,
+    TIMESTAMP,
+    ForeignKey,
+    func,
+    Enum as SQLAEnum,
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy_utils import UUIDType
 from sqlalchemy.ext.declarative import declarative_base
 import uuid
+import enum
 from .projects import Project
+from .users import User
 Base = declarative_base()
 
 
+class IngestionStatus(enum.Enum):
+    pending = "pending"
+    ingesting = "ingesting"
+    ingested = "ingested"
+    failed = "failed"
+
+
+class ParseStatus(enum.Enum):
+    pending = "pending"
+    parsed = "parsed"
+    failed = "failed"
+    not_applicable = "not_applicable"
+
+
 class DocumentTable(Base):
     __tablename__ = "documents_table"
 
     id = Column(UUIDType(binary=False), primary_key=True, index=True, default=uuid.uuid4)
-    project_id = Column(UUIDType(binary=False), ForeignKey(Project.id, ondelete='CASCADE'), nullable=False)
+    # Filled in once the research project is created; uploads happen before that
+    project_id = Column(UUIDType(binary=False), ForeignKey(Project.id, ondelete='CASCADE'), nullable=True)
+    user_id = Column(UUIDType(binary=False), ForeignKey(User.id, ondelete='CASCADE'), nullable=True, index=True)
+    temp_project_id = Column(UUIDType(binary=False), nullable=True, index=True)
     file_name = Column(Text, nullable=False)
     file_path = Column(Text, nullable=False)  # Store the path where the document is saved
-
+    bucket = Column(String(255), nullable=True)
+    file_size = Column(BigInteger, nullable=True)
+    content_type = Column(String(255), nullable=True)
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 hex digest
+    etag = Column(String(255), nullable=True)
+    ingestion_status = Column(SQLAEnum(IngestionStatus), nullable=False, default=IngestionStatus.pending)
+    ingestion_job_id = Column(String(255), nullable=True, index=True)  # Bedrock KB ingestion job
+    parse_status = Column(SQLAEnum(ParseStatus), nullable=False, default=ParseStatus.pending)
+    index_version = Column(Integer, nullable=False, default=0)  # 0 = not indexed yet
+    created_at = Column(TIMESTAMP, default=func.current_timestamp())
+    updated_at = Column(TIMESTAMP, default=func.current_timestamp(), onupdate=func.current_timestamp())
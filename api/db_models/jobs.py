@@ -0,0 +1,34 @@
+from sqlalchemy import Column, Integer, String, Text, JSON, TIMESTAMP, func, Enum as SQLAEnum
+from sqlalchemy_utils import UUIDType
+from sqlalchemy.ext.declarative import declarative_base
+import uuid
+import enum
+
+Base = declarative_base()
+
+
+class JobStatus(enum.Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+class JobTable(Base):
+    __tablename__ = "jobs_table"
+
+    id = Column(UUIDType(binary=False), primary_key=True, index=True, default=uuid.uuid4)
+    user_id = Column(UUIDType(binary=False), nullable=True, index=True)
+    kind = Column(String(64), nullable=False)
+    status = Column(SQLAEnum(JobStatus), nullable=False, default=JobStatus.queued, index=True)
+    progress = Column(Integer, nullable=False, default=0)  # 0-100
+    message = Column(Text, nullable=True)
+    payload = Column(JSON, nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    dedupe_key = Column(String(64), nullable=True, index=True)  # repeated submissions reuse the job
+    created_at = Column(TIMESTAMP, default=func.current_timestamp())
+    started_at = Column(TIMESTAMP, nullable=True)
+    finished_at = Column(TIMESTAMP, nullable=True)
+    heartbeat_at = Column(TIMESTAMP, nullable=True)  # refreshed while a worker holds the job
@@ -1,23 +1,29 @@
 import logging
-from api.services.deep_research.stats import ReportState
+from typing import List
+
+from api.services.deep_research.stats import ReportState, SectionState
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
 
-def node_compile_final(state: ReportState) -> ReportState:
-    """Compile all sections into a single markdown report."""
-    logger.debug("Entering node_compile_final with %d sections", len(state.outline))
+def compile_sections(sections: List[SectionState]) -> str:
+    """Join sections into one markdown report."""
     report_lines = []
-    for idx, section in enumerate(state.outline, start=1):
+    for idx, section in enumerate(sections, start=1):
         logger.debug("Adding section %d: %s", idx, section.title)
         header = f"## {idx}. {section.title}\n"
         content = (
             section.content.strip() if section.content else "*No content generated.*"
         )
         report_lines.append(f"{header}\n{content}\n")
+    return "\n".join(report_lines)
 
-    state.final_report = "\n".join(report_lines)
+
+def node_compile_final(state: ReportState) -> ReportState:
+    """Compile all sections into a single markdown report."""
+    logger.debug("Entering node_compile_final with %d sections", len(state.outline))
+    state.final_report = compile_sections(state.outline)
     logger.debug(
         "Final report compiled successfully (length: %d chars)", len(state.final_report)
     )
@@ -1,12 +1,16 @@
 import os
 import logging
-from typing import List, Union
+from typing import List, Optional, Union
 
 # Configure root logger for debug output
 logger = logging.getLogger(__name__)
 
 from utils.excel_utils import has_excel_files
-from api.services.deep_research.graph_node import report_graph_compiled
+from utils.ingestion import ingestion_tracker
+from utils.local_documents import load_unindexed_document_chunks
+from utils.graph_registry import graph_registry
+from utils.deadline import deadline_scope, remaining, research_deadline
+import api.services.deep_research.graph_node  # registers the report graphs
 from api.services.deep_research.stats import (
     SearchResult,
     Citation,
@@ -18,6 +22,13 @@ from api.services.deep_research.stats import (
 )
 
 
+# How long a run waits for uploaded files to finish KB ingestion before
+# falling back to parsing the pending files directly
+INGESTION_WAIT_SECONDS = float(os.getenv("INGESTION_WAIT_SECONDS", "60"))
+# ...but never more than this share of the run's time budget
+INGESTION_WAIT_SHARE = 0.1
+
+
 # -----------------------------------------------------------------------------
 # HELPERS
 # -----------------------------------------------------------------------------
@@ -68,7 +79,7 @@ def citation_to_dict(citation: Citation) -> dict:
             "chunk_text": citation.chunk_text,
             "page": citation.page,
             "file_name": citation.file_name,
-            "url": citation.url,
+            "source_uri": citation.source_uri,
         }
     elif isinstance(citation, WebCitation):
         return {
@@ -100,19 +111,45 @@ async def deep_research(
     web_search: bool,
     project_id: str,
     user_id: str,
+    deadline: Optional[float] = None,
 ):
     """Execute full research workflow with error handling."""
-    # start with a fresh list each run
+    # Every node and outbound call below sees the deadline
+    with deadline_scope(deadline or research_deadline("deep")) as deadline:
+        return await _deep_research(
+            instruction, report_type, file_search, web_search, project_id, user_id, deadline
+        )
 
+
+async def _deep_research(
+    instruction: str,
+    report_type: int,
+    file_search: bool,
+    web_search: bool,
+    project_id: str,
+    user_id: str,
+    deadline: float,
+):
     logger.debug("=== Starting deep_research workflow ===")
 
     try:
         # determine if Excel search is available
-        excel_flag = has_excel_files(user_id, project_id)
+        excel_flag = await has_excel_files(user_id, project_id)
         logger.debug(
             f"Excel available: {excel_flag}, file_search: {file_search}, web_search: {web_search}"
         )
 
+        local_chunks = []
+        if file_search:
+            ready = await ingestion_tracker.wait_until_ready(
+                user_id,
+                project_id,
+                min(INGESTION_WAIT_SECONDS, INGESTION_WAIT_SHARE * remaining(deadline)),
+            )
+            if not ready:
+                logger.debug("KB ingestion still running; parsing pending files locally")
+                local_chunks = await load_unindexed_document_chunks(user_id, project_id)
+
         # build the initial state payload
         input_data = {
             "topic": instruction,
@@ -122,6 +159,8 @@ async def deep_research(
             "file_search": file_search,
             "web_research": web_search,  # <-- renamed from `web_search` to `web_research`
             "excel_search": excel_flag,
+            "local_chunks": local_chunks,
+            "deadline": deadline,
             "config": ReportConfig(
                 web_research=web_search,  # <-- matches the ReportConfig field name
                 file_search=file_search,
@@ -132,8 +171,8 @@ async def deep_research(
             ),
         }
 
-        logger.debug(f"Invoking report graph with input: {input_data}")
-        graph_result = await report_graph_compiled.ainvoke(input_data)
+        logger.debug("Invoking report graph for topic: %s", input_data.get("topic"))
+        graph_result = await graph_registry.get("deep_research").ainvoke(input_data)
         validate_report_state(graph_result)
 
         # Map raw dict back into ReportState if necessary
@@ -150,6 +189,7 @@ async def deep_research(
                 outline=graph_result.get("outline", []),
                 current_section_idx=graph_result.get("current_section_idx", 0),
                 final_report=graph_result.get("final_report", ""),
+                deadline=deadline,
             )
         else:
             report_state = graph_result
@@ -5,10 +5,16 @@ from api.services.deep_research.stats import ReportState
 from api.services.deep_research.outline_node import node_generate_outline
 from api.services.deep_research.process_node import node_process_section
 from api.services.deep_research.compile_node import node_compile_final
+from api.services.deep_research.section_graph_node import create_section_subgraph
+from utils.graph_registry import graph_registry
+from utils.deadline import budget_low
 
 # Configure module‐level logger
 logger = logging.getLogger(__name__)
 
+# Time left for compiling the report once the section loop stops
+COMPILE_RESERVE_SECONDS = 10
+
 
 def init_sections(state: ReportState) -> ReportState:
     """Initialize section index to zero."""
@@ -23,31 +29,46 @@ def should_continue(state: ReportState) -> str:
         state.current_section_idx,
         len(state.outline),
     )
-    if state.current_section_idx < len(state.outline):
-        return "process_section"
-    return "compile_final"
+    if state.current_section_idx >= len(state.outline):
+        return "compile_final"
+    # Out of time: compile the sections written so far
+    if budget_low(COMPILE_RESERVE_SECONDS, state.deadline):
+        logger.warning(
+            "Deadline reached after %d of %d sections; compiling",
+            state.current_section_idx,
+            len(state.outline),
+        )
+        return "compile_final"
+    return "process_section"
 
 
 # -----------------------------------------------------------------------------
-logger.debug("Building main report graph")
-report_graph = StateGraph(state_schema=ReportState)
+def build_report_graph():
+    logger.debug("Building main report graph")
+    report_graph = StateGraph(state_schema=ReportState)
+
+    # Add nodes
+    report_graph.add_node("gen_outline", node_generate_outline)
+    report_graph.add_node("init_sections", init_sections)
+    report_graph.add_node("process_section", node_process_section)
+    report_graph.add_node("compile_final", node_compile_final)
+
+    # Wire up edges
+    report_graph.add_edge(START, "gen_outline")
+    report_graph.add_edge("gen_outline", "init_sections")
+    report_graph.add_edge("init_sections", "process_section")
 
-# Add nodes
-report_graph.add_node("gen_outline", node_generate_outline)
-report_graph.add_node("init_sections", init_sections)
-report_graph.add_node("process_section", node_process_section)
-report_graph.add_node("compile_final", node_compile_final)
+    # Conditional looping edge
+    report_graph.add_conditional_edges("process_section", should_continue)
 
-# Wire up edges
-report_graph.add_edge(START, "gen_outline")
-report_graph.add_edge("gen_outline", "init_sections")
-report_graph.add_edge("init_sections", "process_section")
+    report_graph.add_edge("compile_final", END)
 
-# Conditional looping edge
-report_graph.add_conditional_edges("process_section", should_continue)
+    # Compile to executable graph
+    compiled = report_graph.compile()
+    logger.debug("Report graph compiled")
+    return compiled
 
-report_graph.add_edge("compile_final", END)
 
-# Compile to executable graph
-report_graph_compiled = report_graph.compile()
-logger.debug("Report graph compiled")
+# Compiled once per process (warmed at startup) and shared by all requests
+graph_registry.register("deep_research", build_report_graph)
+graph_registry.register("deep_research_section", create_section_subgraph)
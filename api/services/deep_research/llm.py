@@ -1,12 +1,14 @@
 import os
 import openai
 from langchain_openai import ChatOpenAI
+from utils.model_router import model_router
 
 # ------------------------------------------------------------------------
 # LLM Setup
 # ------------------------------------------------------------------------
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 openai.api_key = OPENAI_API_KEY
+OPENAI_STRONG_MODEL = os.getenv("OPENAI_STRONG_MODEL", "gpt-4o")
 
 print("[DEBUG] Initializing ChatOpenAI with model o4-mini")
 gpt_4 = ChatOpenAI(
@@ -15,3 +17,30 @@ gpt_4 = ChatOpenAI(
     api_key=OPENAI_API_KEY,
     model_kwargs={"parallel_tool_calls": False},
 )
+
+
+def _chat_openai(model: str) -> ChatOpenAI:
+    return ChatOpenAI(
+        model=model,
+        temperature=0.0,
+        api_key=OPENAI_API_KEY,
+        model_kwargs={"parallel_tool_calls": False},
+    )
+
+
+# ------------------------------------------------------------------------
+# Routed models and per-node routes (overridable through MODEL_ROUTES)
+# ------------------------------------------------------------------------
+model_router.register_model("gpt-4o-mini", lambda: gpt_4, kind="langchain")
+model_router.register_model(
+    "gpt-4o", lambda: _chat_openai(OPENAI_STRONG_MODEL), kind="langchain"
+)
+# Query generation is short structured output and stays on the small model;
+# section content is written by the stronger model and falls back to the
+# small one while its recent p95 exceeds the budget.
+model_router.configure("deep_research.section_queries", ["gpt-4o-mini"])
+model_router.configure(
+    "deep_research.section_content",
+    ["gpt-4o", "gpt-4o-mini"],
+    p95_budget_seconds=float(os.getenv("SECTION_CONTENT_P95_BUDGET_SECONDS", "60")),
+)
@@ -14,18 +14,31 @@ from api.services.deep_research.stats import (
     WebCitation,
     ExcelCitation,
 )
-from services.deep_research.llm import gpt_4
-from langchain_core.messages import SystemMessage, HumanMessage
+import services.deep_research.llm  # registers the routed models
+from utils.model_router import model_router
 from utils.excel_utils import extract_excel_index
-from utils.websearch_utils import tavily_search
-from utils.kb_search import query_kb, get_presigned_url_from_source_uri
+from utils.search_orchestrator import web_search
+from utils.kb_search import retrieve_kb
+from utils.job_queue import report_progress
+from utils.executors import run_in
+from utils.graph_registry import graph_registry
+from utils.prompt_cache import CachedPrompt, record_langchain_usage
+from services.deep_research.prompts import SECTION_CONTENT_FOCUS
+from utils.local_documents import search_local_chunks
+from utils.deadline import budget_low, within_deadline
+from utils.cancellation import checkpoint_partial, checkpointing
+from api.services.deep_research.compile_node import compile_sections
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
 # Constants
 KNOWLEDGE_BASE_ID = os.getenv("KNOWLEDGE_BASE_ID", "my-knowledge-base")
-MODEL_ARN = os.getenv("MODEL_ARN", "arn:aws:bedrock:my-model")
+KB_RESULTS_PER_QUERY = int(os.getenv("KB_RESULTS_PER_QUERY", "5"))
+# Sections are not retried with less than this left before the deadline
+SECTION_RETRY_MIN_SECONDS = float(os.getenv("SECTION_RETRY_MIN_SECONDS", "180"))
+# Evidence kept as the section text when the deadline cuts generation short
+DEADLINE_EVIDENCE_CHARS = 3000
 
 # Token trimming
 try:
@@ -64,10 +77,10 @@ async def node_process_section(state: ReportState) -> ReportState:
         report_state=state,
     )
 
-    from api.services.deep_research.section_graph_node import section_subgraph_compiled
-
     # Process section subgraph
-    processed = await section_subgraph_compiled.ainvoke(section_state)
+    processed = await graph_registry.get("deep_research_section").ainvoke(
+        section_state
+    )
     if isinstance(processed, dict):
         processed_state = convert_to_section_state(state, processed)
     else:
@@ -81,9 +94,14 @@ async def node_process_section(state: ReportState) -> ReportState:
         success, feedback = evaluate_section(processed_state)
         if success:
             break
+        if budget_low(SECTION_RETRY_MIN_SECONDS, state.deadline):
+            logger.debug("Not retrying %s: deadline close", processed_state.title)
+            break
         logger.debug("Retry %d for section: %s", attempt, processed_state.title)
         # Re-run subgraph on updated state
-        processed = await section_subgraph_compiled.ainvoke(processed_state)
+        processed = await graph_registry.get("deep_research_section").ainvoke(
+            processed_state
+        )
         if isinstance(processed, dict):
             processed_state = convert_to_section_state(state, processed)
         processed_state = await generate_section_content(state, processed_state)
@@ -92,6 +110,12 @@ async def node_process_section(state: ReportState) -> ReportState:
     current_state.content = processed_state.content
     current_state.citations = processed_state.citations
     state.current_section_idx += 1
+    if checkpointing():
+        checkpoint_partial(compile_sections(state.outline[: state.current_section_idx]))
+    report_progress(
+        5 + 90 * state.current_section_idx / max(len(state.outline), 1),
+        f"Finished section {state.current_section_idx}/{len(state.outline)}",
+    )
     return state
 
 
@@ -149,27 +173,46 @@ async def generate_section_content(
         logger.error("Token trimming failed: %s", e)
         context_llm = context_text[:8000]
 
-    structured_llm = gpt_4.with_structured_output(
-        SectionContent, method="function_calling"
+    # Topic, outline, report-type focus and requirements are shared by all
+    # sections of the report and go first
+    outline_text = "\n".join(
+        f"{i + 1}. {s.title}: {s.description}" for i, s in enumerate(state.outline)
     )
+    prompt = CachedPrompt(
+        name="deep_research.section_content",
+        system="You are a senior financial analyst.",
+        shared=(
+            f"Report Topic: {state.topic}\n\n"
+            f"Report outline:\n{outline_text}\n\n"
+            f"{SECTION_CONTENT_FOCUS[state.report_type]}\n\n"
+            "Requirements: 1) 300-500 words narrative..."
+        ),
+        specific=(
+            f"Title: {title}\n"
+            f"Description: {section_state.description}\n"
+            f"Context: {context_llm}"
+        ),
+    )
+    async def _generate():
+        async with model_router.route("deep_research.section_content") as route:
+            structured_llm = route.llm.with_structured_output(
+                SectionContent, method="function_calling", include_raw=True
+            )
+            result = await structured_llm.ainvoke(prompt.for_langchain())
+            route.add_langchain_usage(result["raw"])
+        return result
 
     # Invoke LLM
     try:
-        section_content = await structured_llm.ainvoke(
-            [
-                SystemMessage(
-                    content=f"You are a senior financial analyst. Report Topic: {state.topic}"
-                ),
-                HumanMessage(
-                    content=(
-                        f"Title: {title}\n"
-                        f"Description: {section_state.description}\n"
-                        f"Context: {context_llm}\n"
-                        "Requirements: 1) 300-500 words narrative..."
-                    )
-                ),
-            ]
-        )
+        result = await within_deadline(_generate(), what=f"content for {title}")
+        if result is None:
+            # Out of time: the section shows the evidence that was found
+            section_state.content += context_text[:DEADLINE_EVIDENCE_CHARS]
+            return section_state
+        record_langchain_usage(prompt.name, result["raw"])
+        if result["parsing_error"] is not None:
+            raise result["parsing_error"]
+        section_content = result["parsed"]
         logger.debug("LLM generated content for section: %s", title)
 
         # Append content
@@ -255,7 +298,7 @@ async def parallel_excel_search(
     if not report_state.config.excel_search:
         return SearchResult(citations=[], context_text="", original_queries=queries)
 
-    index = extract_excel_index(report_state.user_id, report_state.project_id)
+    index = await extract_excel_index(report_state.user_id, report_state.project_id)
     if not index:
         return SearchResult(citations=[], context_text="", original_queries=queries)
 
@@ -267,7 +310,7 @@ async def parallel_excel_search(
         return q, eng.query(q)
 
     results = await asyncio.gather(
-        *[asyncio.to_thread(_search, q) for q in queries], return_exceptions=True
+        *[run_in("search", _search, q) for q in queries], return_exceptions=True
     )
 
     for r in results:
@@ -305,28 +348,36 @@ async def parallel_web_search(
     citations: List[WebCitation] = []
     context_parts: List[str] = []
 
+    config = report_state.config
+    providers = [
+        name
+        for name, enabled in (
+            ("tavily", config.use_tavily),
+            ("serpapi", config.use_serpapi),
+            ("perplexity", config.use_perplexity),
+        )
+        if enabled
+    ]
     results = await asyncio.gather(
-        *[asyncio.to_thread(tavily_search, q, True, 3) for q in queries],
+        *[web_search(q, providers, max_results=3, full_content=True) for q in queries],
         return_exceptions=True,
     )
 
-    for q, res in zip(queries, results):
-        if isinstance(res, Exception):
-            logger.error("Web search error for '%s': %s", q, res)
+    for q, hits in zip(queries, results):
+        if isinstance(hits, Exception):
+            logger.error("Web search error for '%s': %s", q, hits)
             continue
-        hits = res.get("results", [])
         for item in hits:
             # build your citation
             cit = WebCitation(
                 title=item.get("title", ""),
                 url=item.get("url", ""),
-                snippet=item.get("content", ""),  # still keep snippet
+                snippet=item.get("snippet", ""),  # still keep snippet
             )
             citations.append(cit)
 
-            # now use the _full_ raw_content for context
-            raw = item.get("raw_content") or item.get("content", "")
-            context_parts.append(f"Web Q '{q}':\n{raw}")
+            # now use the full page content for context
+            context_parts.append(f"Web Q '{q}':\n{item.get('content', '')}")
 
     return SearchResult(
         citations=citations,
@@ -343,40 +394,56 @@ async def parallel_kb_query(
     context_parts = []
 
     def _kb(q: str):
-        return q, query_kb(
+        return q, retrieve_kb(
             q,
             KNOWLEDGE_BASE_ID,
             report_state.user_id,
             report_state.project_id,
-            MODEL_ARN,
+            KB_RESULTS_PER_QUERY,
         )
 
     results = await asyncio.gather(
-        *[asyncio.to_thread(_kb, q) for q in queries], return_exceptions=True
+        *[run_in("search", _kb, q) for q in queries], return_exceptions=True
     )
 
+    # Raw chunks go straight into the section writer; no per-query generation
     for r in results:
         if isinstance(r, Exception):
             logger.error("KB search error: %s", r)
             continue
-        q, resp = r
-        text = resp.get("output", {}).get("text", "")
-        context_parts.append(f"KB Q '{q}': {text}")
-        for cobj in resp.get("citations", []):
-            for ref in cobj.get("retrievedReferences", []):
-                metadata = ref.get("metadata", {})
-                citations.append(
-                    KBCitation(
-                        chunk_text=ref.get("content", {}).get("text", ""),
-                        page=metadata.get("x-amz-bedrock-kb-document-page-number"),
-                        file_name=os.path.basename(
-                            metadata.get("x-amz-bedrock-kb-source-uri", "")
-                        ),
-                        url=get_presigned_url_from_source_uri(
-                            metadata.get("x-amz-bedrock-kb-source-uri", "")
-                        ),
-                    )
+        q, chunks = r
+        if not chunks:
+            continue
+        context_parts.append(
+            f"KB Q '{q}': " + "\n\n".join(c["text"] for c in chunks)
+        )
+        for c in chunks:
+            citations.append(
+                KBCitation(
+                    chunk_text=c["text"],
+                    page=c["page"],
+                    file_name=c["file_name"],
+                    source_uri=c["source_uri"],
                 )
+            )
+
+    # Files still being ingested are searched from their locally parsed text
+    for q in queries:
+        hits = search_local_chunks(report_state.local_chunks, q)
+        if not hits:
+            continue
+        context_parts.append(
+            f"File Q '{q}': " + "\n\n".join(h["text"] for h in hits)
+        )
+        for h in hits:
+            citations.append(
+                KBCitation(
+                    chunk_text=h["text"],
+                    page=h["page"],
+                    file_name=h["file_name"],
+                    source_uri=h["source_uri"],
+                )
+            )
 
     return SearchResult(
         citations=citations,
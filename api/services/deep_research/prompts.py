@@ -146,6 +146,13 @@ Ensure your analysis focuses on market size, segmentation, competitive landscape
 """,
 ]
 
+# Report-type focus for section content, shared by every section of a report
+SECTION_CONTENT_FOCUS = [
+    "Ensure the analysis reflects deep insights into company management, business models, industry standing, financial performance, corporate actions, and news. Leverage the following tags for focus: Investment Research, Target Screening, Corporate Due Diligence, Competitive Research.",
+    "Ensure your analysis delves into financial health, key performance ratios, trend analysis, and valuation techniques. Leverage insights from the following tags: Financial Analysis, Ratio and Trend Analysis, Portfolio Monitoring, Valuation.",
+    "Ensure your analysis focuses on market size, segmentation, competitive landscape, and trend analysis. Leverage insights from the following tags: Market Research, Business Consulting, Strategy, Marketing.",
+]
+
 FINAL_SECTION_WRITER_INSTRUCTIONS = [
     """You are an expert financial and industry analyst. Compile the final sections of the industry report by synthesizing and polishing the content from all completed sections. Produce a comprehensive narrative report of at least 3000 words that includes thorough analysis, detailed examples, and extended insights.
 Context from Completed Sections:
@@ -6,10 +6,12 @@ from typing import List, Any
 import tiktoken
 from pydantic import Field, create_model
 from langgraph.graph import StateGraph, START, END
-from langchain_core.messages import SystemMessage, HumanMessage
 
 from api.services.deep_research.stats import SectionState
-from services.deep_research.llm import gpt_4
+from utils.prompt_cache import CachedPrompt, record_langchain_usage
+import services.deep_research.llm  # registers the routed models
+from utils.model_router import model_router
+from utils.deadline import budget_low
 from services.deep_research.prompts import (
     REPORT_PLANNER_QUERY_WRITER_INSTRUCTIONS,
     QUERY_PROMPT_FOR_ITERATION,
@@ -32,6 +34,11 @@ MAX_TOKENS = 40000
 KNOWLEDGE_BASE_ID = os.getenv("KNOWLEDGE_BASE_ID", "my-knowledge-base")
 MODEL_ARN = os.getenv("MODEL_ARN", "arn:aws:bedrock:my-model")
 
+# Queries per source, and fewer once the run is close to its deadline
+QUERIES_PER_SOURCE = 5
+LOW_BUDGET_QUERIES_PER_SOURCE = 2
+LOW_BUDGET_SECONDS = float(os.getenv("DEEP_RESEARCH_LOW_BUDGET_SECONDS", "300"))
+
 
 def trim_to_tokens(text: str, max_tokens: int = MAX_TOKENS) -> str:
     """Safely truncate text by token count."""
@@ -73,11 +80,8 @@ async def node_section_data_needs(state: SectionState) -> SectionState:
 
     DynamicQueries = create_model("DynamicQueries", **fields)
 
-    # Format base prompt with topic only
-    base = REPORT_PLANNER_QUERY_WRITER_INSTRUCTIONS[state.report_type]
-    prompt = base.format(topic=state.report_state.topic)
-
-    # Append iteration-specific instructions, formatting its placeholders
+    # Topic and report-type instructions are the same for every section of a
+    # report, so they form the cached prefix; the section's iteration follows
     iteration_tmpl = QUERY_PROMPT_FOR_ITERATION[state.report_type]
     iteration = iteration_tmpl.format(
         section_title=state.title,
@@ -89,29 +93,41 @@ async def node_section_data_needs(state: SectionState) -> SectionState:
         feedback=getattr(state, "feedback", "No specific feedback"),
         tags="",
     )
-    prompt += "\n" + iteration
-
-    prompt = trim_to_tokens(prompt)
+    prompt = CachedPrompt(
+        name="deep_research.section_queries",
+        system="Generate structured queries for this section.",
+        shared=REPORT_PLANNER_QUERY_WRITER_INSTRUCTIONS[state.report_type].format(
+            topic=state.report_state.topic
+        ),
+        specific=trim_to_tokens(iteration),
+    )
 
     # Invoke LLM for query generation
-    structured_llm = gpt_4.with_structured_output(
-        DynamicQueries, method="function_calling"
-    )
     try:
-        queries_obj = await structured_llm.ainvoke(
-            [
-                SystemMessage(content="Generate structured queries for this section."),
-                HumanMessage(content=prompt),
-            ]
+        async with model_router.route("deep_research.section_queries") as route:
+            structured_llm = route.llm.with_structured_output(
+                DynamicQueries, method="function_calling", include_raw=True
+            )
+            result = await structured_llm.ainvoke(prompt.for_langchain())
+            route.add_langchain_usage(result["raw"])
+        record_langchain_usage(prompt.name, result["raw"])
+        if result["parsing_error"] is not None:
+            raise result["parsing_error"]
+        queries_obj = result["parsed"]
+
+        # Collect a few queries per source
+        deadline = getattr(state.report_state, "deadline", None)
+        limit = (
+            LOW_BUDGET_QUERIES_PER_SOURCE
+            if budget_low(LOW_BUDGET_SECONDS, deadline)
+            else QUERIES_PER_SOURCE
         )
-
-        # Collect up to 5 per source
         if state.web_research:
-            state.web_queries = (getattr(queries_obj, "web_queries", []) or [])[:5]
+            state.web_queries = (getattr(queries_obj, "web_queries", []) or [])[:limit]
         if state.kb_search:
-            state.kb_queries = (getattr(queries_obj, "kb_queries", []) or [])[:5]
+            state.kb_queries = (getattr(queries_obj, "kb_queries", []) or [])[:limit]
         if state.excel_search:
-            state.excel_queries = (getattr(queries_obj, "excel_queries", []) or [])[:5]
+            state.excel_queries = (getattr(queries_obj, "excel_queries", []) or [])[:limit]
 
     except Exception as e:
         logger.error("Query generation failed for '%s': %s", state.title, e)
@@ -220,5 +236,3 @@ def create_section_subgraph():
     logger.debug("Section subgraph compiled")
     return sub.compile()
 
-
-section_subgraph_compiled = create_section_subgraph()
@@ -73,10 +73,11 @@ class ReportConfig:
     web_research: bool = True
     file_search: bool = True
     excel_search: bool = False
+    # Web search providers, tried in the order tavily, serpapi, perplexity
     use_perplexity: bool = True
     perplexity_api_key: Optional[str] = None
-    use_tavily: bool = False
-    use_serpapi: bool = False
+    use_tavily: bool = True
+    use_serpapi: bool = True
     retain_temp_files: bool = False
 
 
@@ -90,7 +91,7 @@ class KBCitation(Citation):
     chunk_text: str
     page: Optional[int]
     file_name: str
-    url: str
+    source_uri: str  # s3:// URI; presigned when the report is read
 
 
 @dataclass
@@ -155,3 +156,6 @@ class ReportState:
     outline: List[SectionState] = field(default_factory=list)
     current_section_idx: int = 0
     final_report: str = ""
+    # Chunks from files still being ingested into the KB (local fallback)
+    local_chunks: List[Dict[str, Any]] = field(default_factory=list)
+    deadline: Optional[float] = None  # epoch seconds, see utils.deadline
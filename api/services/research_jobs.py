@@ -0,0 +1,123 @@
+"""Background job handlers for report generation, Excel indexing and
+outline parsing."""
+
+import asyncio
+import logging
+from typing import Any, Dict
+
+from sqlalchemy import func
+from db.db_session import SessionLocal
+from db_models.projects import Project
+from db_models.reports import ReportTable
+from utils.excel_utils import build_or_load_excel_index
+from utils.pdf_parser import get_parsed_pdf
+from utils.document_catalog import set_parse_status
+from db_models.documents import ParseStatus
+from utils.job_queue import JobContext, register_job_handler
+from utils.deadline import research_deadline
+from utils.admission import admission
+from api.services.deep_research.deep_research import deep_research
+from api.services.researcher.researcher import generate_report
+
+logger = logging.getLogger(__name__)
+
+
+def save_report(
+    project_id: str,
+    instruction: str,
+    research_type: str,
+    result: Dict[str, Any],
+    touch_project: bool = False,
+) -> str:
+    db = SessionLocal()
+    try:
+        report = ReportTable(
+            project_id=project_id,
+            query=instruction,
+            response=result.get("report", ""),
+            sections=result.get("sections", []),
+            research=research_type,
+        )
+        db.add(report)
+        if touch_project:
+            db.query(Project).filter(Project.id == project_id).update(
+                {Project.updated_at: func.now()}, synchronize_session=False
+            )
+        db.commit()
+        db.refresh(report)
+        return str(report.id)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@register_job_handler("research_report")
+async def run_research_report_job(payload: Dict[str, Any], ctx: JobContext):
+    """Run deep or classic research for a project and store the report."""
+    research = deep_research if payload["research_type"] == "deep" else generate_report
+    kind = "deep_research" if payload["research_type"] == "deep" else "research"
+    ctx.set_progress(1, "Waiting for capacity")
+    # Already accepted, so the job waits for its fair turn instead of being
+    # turned away
+    async with admission.admit(payload["user_id"], kind, shed=False):
+        ctx.set_progress(2, "Research started")
+        # The budget starts when the job gets its slot, not when it was queued
+        result = await research(
+            payload["instruction"],
+            int(payload["report_type"]),
+            payload["file_search"],
+            payload["web_search"],
+            payload["temp_project_id"],
+            payload["user_id"],
+            deadline=research_deadline(
+                payload["research_type"], payload.get("deadline_seconds")
+            ),
+        )
+    if result is None or result.get("status") == "error":
+        raise RuntimeError(
+            (result or {}).get("message", "Research failed to generate results")
+        )
+
+    ctx.set_progress(99, "Saving report")
+    report_id = await asyncio.to_thread(
+        save_report,
+        payload["project_id"],
+        payload["instruction"],
+        payload["research_type"],
+        result,
+        payload.get("update", False),
+    )
+    return {
+        "report_id": report_id,
+        "project_id": payload["project_id"],
+        "report": result.get("report", ""),
+        "sections": result.get("sections", []),
+        "researchType": payload["research_type"],
+    }
+
+
+@register_job_handler("excel_index")
+async def run_excel_index_job(payload: Dict[str, Any], ctx: JobContext):
+    """Build (or refresh) the Excel index for an uploaded project."""
+    ctx.set_progress(5, "Building Excel index")
+    index = await build_or_load_excel_index(payload["user_id"], payload["project_id"])
+    return {"indexed": index is not None}
+
+
+@register_job_handler("outline_parse")
+async def run_outline_parse_job(payload: Dict[str, Any], ctx: JobContext):
+    """Parse an uploaded outline PDF once and store the artifact for later runs."""
+    ctx.set_progress(5, "Parsing outline")
+    try:
+        artifact = await get_parsed_pdf(payload["file_path"], payload.get("etag"))
+    except Exception:
+        await asyncio.to_thread(
+            set_parse_status, [payload["document_id"]], ParseStatus.failed
+        )
+        raise
+    await asyncio.to_thread(
+        set_parse_status, [payload["document_id"]], ParseStatus.parsed
+    )
+    return {"sections": len(artifact["sections"])}
@@ -5,6 +5,7 @@ from api.services.researcher.stats import (
 )
 from langgraph.graph import START, END, StateGraph
 from api.services.researcher.config import Configuration
+from utils.graph_registry import graph_registry
 from api.services.researcher.process_node import (
     formulate_plan,
     formulate_questions,
@@ -41,3 +42,7 @@ def build_document_graph():
     document_graph = builder.compile()
     print("[DEBUG] Exiting build_document_graph")
     return document_graph
+
+
+# Compiled once per process and shared by all requests
+graph_registry.register("researcher", build_document_graph)
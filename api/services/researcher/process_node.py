@@ -1,21 +1,28 @@
 import asyncio
 import os
 import nest_asyncio
-import json
-from typing import List, Any
+from typing import Any
 import re
 from api.services.researcher.stats import (
     ReportState,
-    Citation,
-    KBCitation,
-    WebCitation,
+    CitationRecord,
+    SectionQuestions,
+    serialize_citations,
 )
-from utils.kb_search import get_presigned_url_from_source_uri, query_kb
-from utils.websearch_utils import call_tavily_api
-from utils.pdf_parser import extract_pdf_from_s3, parse_pdf_structure
+from utils.kb_search import retrieve_kb
+from utils.search_orchestrator import web_search
+from utils.pdf_parser import load_outline_sections, load_default_outline_sections
 from langchain_core.runnables import RunnableConfig
-from utils.bedrock_llm import ClaudeWrapper, DeepSeekWrapper, trim_fenced, unwrap_boxed
+from utils.bedrock_llm import trim_fenced, unwrap_boxed
+from utils.model_router import model_router
+from utils.structured_output import StructuredOutputError
+from utils.prompt_cache import CachedPrompt
 from api.services.researcher.prompts import OUTLINE_PROMPT
+from utils.job_queue import report_progress
+from utils.local_documents import search_local_chunks
+from utils.executors import run_in
+from utils.deadline import budget_low, within_deadline
+from utils.cancellation import checkpoint_partial, checkpointing
 from dotenv import load_dotenv, find_dotenv
 
 env_path = find_dotenv()  # walks up until it finds .env
@@ -25,16 +32,56 @@ nest_asyncio.apply()
 
 
 KNOWLEDGE_BASE_ID = os.getenv("KNOWLEDGE_BASE_ID")
-MODEL_ARN = os.getenv("MODEL_ARN")
+KB_RESULTS_PER_QUERY = int(os.getenv("KB_RESULTS_PER_QUERY", "5"))
 
 
 
-print("[DEBUG] Initializing deepseek with model deepseek.r1-v1:0")
-deepseek = DeepSeekWrapper(temperature=0.0)
-haiku = ClaudeWrapper(temperature=0.0)
+# Models per node (preferred first); override with MODEL_ROUTES. The R1
+# outline falls back to Haiku while its recent p95 exceeds the budget.
+model_router.configure(
+    "researcher.outline", ["deepseek-r1", "claude-haiku"], p95_budget_seconds=90
+)
+model_router.configure("researcher.questions", ["claude-haiku"])
+model_router.configure("researcher.write_section", ["claude-haiku"])
+
+WRITER_SYSTEM_PROMPT = (
+    "You are a professional report writer. "
+    "When drafting a Markdown section, do not include any internal thoughts, reasoning steps, or planning—only return the completed section."
+    "You are a seasoned market‑research analyst."
+    "You are an expert in financial due diligence and market analysis."
+)
+WRITER_INSTRUCTIONS = (
+    "Use `##` for the section title and `###` for each sub-point. "
+    "Include each sub-point only when evidence exists; omit any without data. if the section must include data that u don't have, hallucinate or research on your own little but don't send X in place of data"
+    "Render numeric data as Markdown tables when appropriate; otherwise write concise paragraphs. "
+    "Do not output any reasoning steps, internal thoughts, or process details—only the completed section. "
+    "Ensure the section is fully generated and not cut off."
+)
+
+# Sections whose questions / text are generated at the same time in one run
+SECTION_CONCURRENCY = int(os.getenv("RESEARCHER_SECTION_CONCURRENCY", "6"))
 
-# global collector
-CITATIONS: List[Citation] = []
+# Deadline handling: research stops this long before the deadline so the
+# sections can still be written, and below LOW_BUDGET_SECONDS the run asks
+# fewer questions and answers them from the knowledge base only
+WRITE_RESERVE_SECONDS = float(os.getenv("RESEARCHER_WRITE_RESERVE_SECONDS", "90"))
+LOW_BUDGET_SECONDS = float(os.getenv("RESEARCHER_LOW_BUDGET_SECONDS", "240"))
+QUESTIONS_PER_SECTION = 5
+LOW_BUDGET_QUESTIONS_PER_SECTION = 2
+
+
+async def _ask_llm_retry(node: str, msgs, schema=None):
+    for attempt in range(6):
+        try:
+            async with model_router.route(node) as route:
+                llm = route.llm.with_structured_output(schema) if schema else route.llm
+                return await llm.ainvoke(msgs)
+        except RuntimeError as e:
+            # No point backing off past the deadline
+            if "ThrottlingException" not in str(e) or budget_low(2**attempt):
+                raise
+            await asyncio.sleep(2**attempt)
+    raise RuntimeError(f"{node}: throttling persisted after retries.")
 
 
 # ------------------------------------------------------------------------
@@ -42,19 +89,16 @@ CITATIONS: List[Citation] = []
 # ------------------------------------------------------------------------
 async def formulate_plan(state: ReportState, config: RunnableConfig):
     print("[DEBUG] Entering formulate_plan with state:", state)
+    report_progress(5, "Building outline")
 
-    # 1. User-specific PDF extraction
-    pdf_text = await extract_pdf_from_s3(state["user_id"], state["project_id"])
-    print(f"[DEBUG] PDF text length (user): {len(pdf_text) if pdf_text else 0}")
-    pdf_sections = parse_pdf_structure(pdf_text) if pdf_text else []
+    # 1. User-specific PDF outline (parsed once at upload, then cached)
+    pdf_sections = await load_outline_sections(state["user_id"], state["project_id"])
+    print(f"[DEBUG] PDF sections (user): {len(pdf_sections)}")
 
-    # 2. Default outline PDF extraction if no user PDF sections
+    # 2. Default outline if no user PDF sections (loaded once per process)
     if not pdf_sections:
-        default_text = await extract_pdf_from_s3("default", "outline")
-        print(
-            f"[DEBUG] PDF text length (default): {len(default_text) if default_text else 0}"
-        )
-        pdf_sections = parse_pdf_structure(default_text) if default_text else []
+        pdf_sections = await load_default_outline_sections()
+        print(f"[DEBUG] PDF sections (default): {len(pdf_sections)}")
 
     # CASE: PDF sections exist (from user or default)
     if pdf_sections:
@@ -84,8 +128,15 @@ async def formulate_plan(state: ReportState, config: RunnableConfig):
     ]
 
     try:
-        outline_text = await deepseek.ainvoke(messages)
-        return {"outline": outline_text}
+        outline_text = await within_deadline(
+            _ask_llm_retry("researcher.outline", messages),
+            reserve=WRITE_RESERVE_SECONDS,
+            what="outline generation",
+        )
+        if outline_text is None and headings:
+            # Out of time: the report template headings are the outline
+            outline_text = headings_text
+        return {"outline": outline_text or "Failed to generate outline"}
     except Exception as e:
         print(f"[ERROR] Outline generation failed: {e}")
         return {"outline": "Failed to generate outline"}
@@ -97,6 +148,7 @@ async def formulate_questions(state: ReportState, config: RunnableConfig):
       • `questions` – flat list used downstream
       • `questions_by_section` – for debugging / future use
     """
+    report_progress(20, "Formulating questions")
     outline = state["outline"].strip()
     if not outline:
         return {"questions": [], "questions_by_section": []}
@@ -106,56 +158,56 @@ async def formulate_questions(state: ReportState, config: RunnableConfig):
 
     all_qs: list[str] = []
     by_section: list[dict[str, Any]] = []
+    semaphore = asyncio.Semaphore(SECTION_CONCURRENCY)
+    per_section = (
+        LOW_BUDGET_QUESTIONS_PER_SECTION
+        if budget_low(LOW_BUDGET_SECONDS + WRITE_RESERVE_SECONDS, state.get("deadline"))
+        else QUESTIONS_PER_SECTION
+    )
 
-    async def _ask_llm(prompt_msgs):
-        for attempt in range(6):
-            try:
-                return await haiku.ainvoke(prompt_msgs)
-            except RuntimeError as e:
-                if "ThrottlingException" not in str(e):
-                    raise
-                await asyncio.sleep(2**attempt)
-        raise RuntimeError("deepseek throttling persisted after retries.")
-
-    for block in blocks:
+    async def _section_questions(block: str):
         lines = block.splitlines()
         header = lines[0].strip()
         rest_lines = lines[1:]
         sub_outline = "\n".join(rest_lines).strip()
 
-        # now build a prompt that includes only the sub‑outline
-        prompt = (
-            f"You’re a senior market‑research analyst.\n"
-            f"Report Topic: {state['topic']}\n\n"
-            f"Section Title: {header}\n"
-            f"Sub‑points to cover:\n{sub_outline}\n\n"
-            "Draft exactly five concise, open‑ended questions that begin with “What” or “How”, and include the report topic's essence"
-            "and that will elicit the specific facts, metrics, or insights needed to fully flesh out each sub‑point above. "
-            "Return only a JSON array of strings."
+        # Topic and instructions first so every section shares the cached prefix
+        prompt = CachedPrompt(
+            name="researcher.questions",
+            system="You are a market‑research expert.",
+            shared=(
+                f"You’re a senior market‑research analyst.\n"
+                f"Report Topic: {state['topic']}\n\n"
+                f"Report outline:\n{outline}\n\n"
+                "Draft exactly five concise, open‑ended questions that begin with “What” or “How”, and include the report topic's essence"
+                "and that will elicit the specific facts, metrics, or insights needed to fully flesh out each sub‑point of the section below. "
+                "Return the questions as a list of strings."
+            ),
+            specific=f"Section Title: {header}\nSub‑points to cover:\n{sub_outline}",
         )
 
-        msgs = [
-            {"role": "system", "content": "You are a market‑research expert."},
-            {"role": "user", "content": prompt},
-        ]
-        raw = await _ask_llm(msgs)
-        cleaned = trim_fenced(unwrap_boxed(raw))
-        cleaned = re.sub(r"^```(?:json)?\n|\n```$", "", cleaned)
         try:
-            qs = json.loads(cleaned)
-            if not isinstance(qs, list):
-                raise ValueError
-        except Exception:
+            async with semaphore:
+                with prompt.scope():
+                    result = await within_deadline(
+                        _ask_llm_retry(
+                            "researcher.questions", prompt.for_bedrock(), SectionQuestions
+                        ),
+                        reserve=WRITE_RESERVE_SECONDS,
+                        what=f"questions for {header}",
+                    )
+            # Out of time: research the section title itself
+            qs = result.questions[:per_section] if result else [header]
+        except StructuredOutputError as e:
+            print(f"[ERROR] Question generation failed for {header}: {e}")
             qs = []
-            for line in cleaned.splitlines():
-                text = line.strip()  # remove leading/trailing whitespace
-                text = text.lstrip("•")  # remove bullet if it’s at the start
-                text = text.strip('"')  # remove surrounding quotes
-                if text:
-                    qs.append(text)
-                if len(qs) == 5:
-                    break
 
+        return header, qs
+
+    # One LLM call per section, run concurrently; gather keeps outline order
+    for header, qs in await asyncio.gather(
+        *[_section_questions(block) for block in blocks]
+    ):
         all_qs.extend(qs)
         by_section.append({"section": header, "questions": qs})
 
@@ -164,73 +216,58 @@ async def formulate_questions(state: ReportState, config: RunnableConfig):
 
 async def answer_questions(state: ReportState, config: RunnableConfig):
     """Collect context snippets and structured citations for each question."""
+    report_progress(35, "Researching questions")
     questions: list[str] = state.get("questions", [])
 
     answers: list[tuple[str, str]] = []
-    citations: list[dict[str, Any]] = []
+    citations: list[CitationRecord] = []
+    # Short on time: answer from the knowledge base and local chunks only
+    use_web = state.get("web_search") and not budget_low(
+        LOW_BUDGET_SECONDS, state.get("deadline")
+    )
 
     async def _gather_ctx(q: str):
         # Kick off KB and web searches concurrently
         kb_task = (
-            asyncio.to_thread(
-                query_kb,
+            run_in(
+                "search",
+                retrieve_kb,
                 q,
                 KNOWLEDGE_BASE_ID,
                 state["user_id"],
                 state["project_id"],
-                MODEL_ARN,
+                KB_RESULTS_PER_QUERY,
             )
             if state.get("file_search")
-            else asyncio.sleep(0, result={})
-        )
-        web_task = (
-            asyncio.to_thread(call_tavily_api, q)
-            if state.get("web_search")
             else asyncio.sleep(0, result=[])
         )
-        kb_resp, web_resp = await asyncio.gather(kb_task, web_task)
+        web_task = web_search(q) if use_web else asyncio.sleep(0, result=[])
+        kb_chunks, web_resp = await asyncio.gather(
+            within_deadline(kb_task, [], WRITE_RESERVE_SECONDS, f"KB search for {q!r}"),
+            within_deadline(web_task, [], WRITE_RESERVE_SECONDS, f"web search for {q!r}"),
+        )
+        kb_chunks = kb_chunks or []
 
-        # Extract plain text answer
-        file_ctx = (
-            kb_resp.get("output", {}).get("text", "")
-            if isinstance(kb_resp, dict)
-            else ""
+        # Files still being ingested are searched from their locally parsed text
+        local_hits = (
+            search_local_chunks(state.get("local_chunks") or [], q)
+            if state.get("file_search")
+            else []
         )
+        # Retrieved chunks are passed as-is; write_report does the synthesis
+        file_ctx = "\n\n".join(c["text"] for c in kb_chunks + local_hits)
         hits = web_resp or []
         answer_text = "\n\n".join(
             [file_ctx]
             + [
-                f"{h.get('title','')}\n{h.get('answer') or h.get('snippet','')}"
+                f"{h.get('title','')}\n{h.get('content') or h.get('snippet','')}"
                 for h in hits
             ]
         ).strip()
 
-        # Build structured citations
-        local_cits: list[Citation] = []
-        # KB citations
-        if isinstance(kb_resp, dict):
-            for ref in kb_resp.get("retrievedReferences", []):
-                cit = KBCitation(
-                    chunk_text=ref.get("content", {}).get("text", ""),
-                    page=ref.get("metadata", {}).get(
-                        "x-amz-bedrock-kb-document-page-number"
-                    ),
-                    file_name=os.path.basename(
-                        ref.get("metadata", {}).get("x-amz-bedrock-kb-source-uri", "")
-                    ),
-                    url=get_presigned_url_from_source_uri(
-                        ref.get("metadata", {}).get("x-amz-bedrock-kb-source-uri", "")
-                    ),
-                )
-                local_cits.append(cit)
-        # Web citations
-        for h in hits:
-            cit = WebCitation(
-                title=h.get("title", ""),
-                url=h.get("url", ""),
-                snippet=h.get("answer") or h.get("snippet", ""),
-            )
-            local_cits.append(cit)
+        # KB citations, including files that are not ingested yet, then web
+        local_cits = [CitationRecord.kb(q, c) for c in kb_chunks + local_hits]
+        local_cits += [CitationRecord.web(q, h) for h in hits]
 
         return q, answer_text, local_cits
 
@@ -239,35 +276,16 @@ async def answer_questions(state: ReportState, config: RunnableConfig):
         *[asyncio.create_task(_gather_ctx(q)) for q in questions]
     )
 
-    # Serialize answers and citations
     for q, ans, local_cits in gathered:
         answers.append((q, ans))
-        for c in local_cits:
-            if isinstance(c, KBCitation):
-                CITATIONS.append(
-                    {
-                        "type": "kb",
-                        "chunk_text": c.chunk_text,
-                        "page": c.page,
-                        "file_name": c.file_name,
-                        "url": c.url,
-                    }
-                )
-            else:
-                CITATIONS.append(
-                    {
-                        "type": "web",
-                        "title": c.title,
-                        "url": c.url,
-                        "snippet": c.snippet,
-                    }
-                )
+        citations.extend(local_cits)
 
     return {"answers": answers, "citations": citations}
 
 
 async def write_report(state: ReportState, config: RunnableConfig):
     """Compose the final report section‑by‑section, inserting citations list."""
+    report_progress(65, "Writing report")
     answers = state.get("answers", [])
     citations = state.get("citations", [])
     if not answers:
@@ -280,20 +298,12 @@ async def write_report(state: ReportState, config: RunnableConfig):
         b.strip() for b in re.split(r"(?m)^\s*(?=\d+\.\s+)", outline) if b.strip()
     ]
 
-    citation_map = {c["question"]: c["links"] for c in citations}
-    report_parts = []
-
-    async def _ask_llm_retry(msgs):
-        for attempt in range(6):
-            try:
-                return await haiku.ainvoke(msgs)
-            except RuntimeError as e:
-                if "ThrottlingException" not in str(e):
-                    raise
-                await asyncio.sleep(2**attempt)
-        raise RuntimeError("deepseek throttling persisted after retries.")
+    citation_map: dict[str, list[CitationRecord]] = {}
+    for c in citations:
+        citation_map.setdefault(c.question, []).append(c)
+    semaphore = asyncio.Semaphore(SECTION_CONCURRENCY)
 
-    for block in section_blocks:
+    async def _write_section(block: str) -> str:
         title, *rest = block.splitlines()
         subs = [r.strip("-• ") for r in rest if r.strip()]
         sub_set = [title] + subs
@@ -303,34 +313,52 @@ async def write_report(state: ReportState, config: RunnableConfig):
             if any(s.lower() in q.lower() for s in sub_set)
         ]
         qa_text = "\n".join(f"**{q}**:\n{a}" for q, a, _ in relevant_qas)
-        prompt = (
-            f"Please draft only the final Markdown content for section **{title}** as follows:\n\n"
-            f"## {title}\n\n"
-            "Use `##` for the section title and `###` for each sub-point. "
-            "Include each sub-point only when evidence exists; omit any without data. if the section must include data that u don't have, hallucinate or research on your own little but don't send X in place of data"
-            "Render numeric data as Markdown tables when appropriate; otherwise write concise paragraphs. "
-            "Do not output any reasoning steps, internal thoughts, or process details—only the completed section. "
-            "Ensure the section is fully generated and not cut off.\n\n"
-            "### Sub‑points\n" + "\n".join(f"- {s}" for s in subs) + "\n\n"
-            "Return the content in pure Markdown."
+        # Writing rules, topic and outline are identical for every section
+        # and go first
+        prompt = CachedPrompt(
+            name="researcher.write_section",
+            system=WRITER_SYSTEM_PROMPT,
+            shared=(
+                f"{WRITER_INSTRUCTIONS}\n\n"
+                f"Report Topic: {state.get('topic', '')}\n\n"
+                f"Report outline:\n{outline}"
+            ),
+            specific=(
+                f"Please draft only the final Markdown content for section **{title}** as follows:\n\n"
+                f"## {title}\n\n"
+                "### Sub‑points\n" + "\n".join(f"- {s}" for s in subs) + "\n\n"
+                "### Evidence\n"
+                "Base the section on these research findings:\n\n"
+                f"{qa_text or 'No findings were gathered for this section.'}\n\n"
+                "Return the content in pure Markdown."
+            ),
         )
+        async with semaphore:
+            with prompt.scope():
+                raw = await within_deadline(
+                    _ask_llm_retry("researcher.write_section", prompt.for_bedrock()),
+                    what=f"writing {title}",
+                )
+        if raw is None:
+            # Out of time: return the evidence gathered for the section
+            return f"## {title}\n\n{qa_text}".strip()
+        return trim_fenced(unwrap_boxed(raw)).strip()
+
+    report_parts: list[str] = [""] * len(section_blocks)
+
+    async def _write_part(idx: int, block: str) -> None:
+        report_parts[idx] = await _write_section(block)
+        if checkpointing():
+            # Sections written so far, kept if the client goes away
+            checkpoint_partial(
+                "\n\n".join(p for p in report_parts if p),
+                serialize_citations(citations),
+            )
 
-        msgs = [
-            {
-                "role": "system",
-                "content": (
-                    "You are a professional report writer. "
-                    "When drafting a Markdown section, do not include any internal thoughts, reasoning steps, or planning—only return the completed section."
-                    "You are a seasoned market‑research analyst."
-                    "You are an expert in financial due diligence and market analysis."
-                ),
-            },
-            {"role": "user", "content": prompt},
-        ]
-        raw = await _ask_llm_retry(msgs)
-        section_txt = trim_fenced(unwrap_boxed(raw)).strip()
-        report_parts.append(f"{section_txt}")
-
+    # Sections are written concurrently and joined in outline order
+    await asyncio.gather(
+        *[_write_part(idx, block) for idx, block in enumerate(section_blocks)]
+    )
     full_report = "\n\n".join(report_parts)
     return {"report": full_report, "citations": citations}
 
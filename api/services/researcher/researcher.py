@@ -1,9 +1,14 @@
+import os
 import nest_asyncio
-from typing import List
-from api.services.researcher.stats import Citation
-from api.services.researcher.graph_node import build_document_graph
+from typing import Optional
+from api.services.researcher.stats import serialize_citations
+from utils.graph_registry import graph_registry
+import api.services.researcher.graph_node  # registers the researcher graph
 from fastapi import HTTPException
 from api.services.researcher.prompts import TEMPLATE_HEADING
+from utils.ingestion import ingestion_tracker
+from utils.local_documents import load_unindexed_document_chunks
+from utils.deadline import deadline_scope, remaining, research_deadline
 
 from dotenv import load_dotenv, find_dotenv
 
@@ -12,9 +17,11 @@ loaded = load_dotenv(env_path)
 
 nest_asyncio.apply()
 
-
-# global collector
-CITATIONS: List[Citation] = []
+# How long a run waits for uploaded files to finish KB ingestion before
+# falling back to parsing the pending files directly
+INGESTION_WAIT_SECONDS = float(os.getenv("INGESTION_WAIT_SECONDS", "60"))
+# ...but never more than this share of the run's time budget
+INGESTION_WAIT_SHARE = 0.1
 
 
 async def generate_structured_report(
@@ -24,6 +31,7 @@ async def generate_structured_report(
     web_search: bool,
     project_id: str,
     user_id: str,
+    deadline: Optional[float] = None,
 ):
     print(
         "[DEBUG] Entering generate_structured_report with query:",
@@ -37,11 +45,20 @@ async def generate_structured_report(
         index_name = f"d{project_id}".lower()
         print(f"[generate_structured_report] Using index name: {index_name}")
 
-        document_graph = build_document_graph()
-        print("[generate_structured_report] Document graph built successfully.")
+        document_graph = graph_registry.get("researcher")
 
         headings = TEMPLATE_HEADING[report_type]["heading"]
 
+        local_chunks = []
+        ingestion_wait = INGESTION_WAIT_SECONDS
+        if deadline is not None:
+            ingestion_wait = min(ingestion_wait, INGESTION_WAIT_SHARE * remaining(deadline))
+        if file_search and not await ingestion_tracker.wait_until_ready(
+            user_id, project_id, ingestion_wait
+        ):
+            print("[DEBUG] KB ingestion still running; parsing pending files locally")
+            local_chunks = await load_unindexed_document_chunks(user_id, project_id)
+
         input_state = {
             "topic": instruction,
             "headings": headings,
@@ -50,10 +67,16 @@ async def generate_structured_report(
             "project_id": project_id,
             "file_search": file_search,
             "web_search": web_search,
+            "local_chunks": local_chunks,
+            "deadline": deadline,
         }
 
         print(
-            "[generate_structured_report] Input state for document graph:", input_state
+            "[generate_structured_report] Running document graph with",
+            len(headings),
+            "headings and",
+            len(local_chunks),
+            "local chunks",
         )
 
         # Run the graph
@@ -63,13 +86,20 @@ async def generate_structured_report(
                 "[ERROR] The state graph returned None. Check the graph flow and node return values."
             )
 
-        print("[DEBUG] Final state received from document graph:", final_state)
+        print(
+            "[DEBUG] Document graph finished with",
+            len(final_state.get("citations") or []) if final_state else 0,
+            "citations",
+        )
 
         # Access the final report directly from the merged state
         report = final_state.get("report")
         if not report:
             raise ValueError("Report not found in final state.")
-        return {"report": report}
+        return {
+            "report": report,
+            "citations": serialize_citations(final_state.get("citations") or []),
+        }
     except Exception as e:
         print("[DEBUG] Exception in generate_structured_report:", e)
         return None
@@ -82,6 +112,7 @@ async def generate_report(
     web_search: bool,
     project_id: str,
     user_id: str,
+    deadline: Optional[float] = None,
 ):
     print("[DEBUG] Entering generate_report endpoint")
 
@@ -93,9 +124,17 @@ async def generate_report(
         print("[generate_report] Step 4: Deal validation successful.")
         print("[generate_report] Step 5: Generating structured report...")
 
-        report_content = await generate_structured_report(
-            instruction, report_type, file_search, web_search, project_id, user_id
-        )
+        # Every node and outbound call below sees the deadline
+        with deadline_scope(deadline or research_deadline("classic")) as deadline:
+            report_content = await generate_structured_report(
+                instruction,
+                report_type,
+                file_search,
+                web_search,
+                project_id,
+                user_id,
+                deadline,
+            )
         if not report_content:
             print("[generate_report] Step 5.1: Report generation failed.")
             raise HTTPException(status_code=404, detail="Failed to generate report.")
@@ -107,7 +146,7 @@ async def generate_report(
         return {
             "message": "Report generated and saved successfully",
             "report": report_content.get("report", ""),
-            "sections": CITATIONS,
+            "sections": report_content.get("citations", []),
         }
     except Exception as e:
         print(f"[generate_report] Error encountered: {str(e)}")
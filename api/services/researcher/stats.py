@@ -1,3 +1,4 @@
+import os
 from typing import List, TypedDict, Any, Optional, Tuple
 from pydantic import BaseModel
 from dataclasses import dataclass
@@ -14,11 +15,13 @@ class ReportStateInput(TypedDict):
     project_id: str
     file_search: bool
     web_search: bool
+    local_chunks: List[dict[str, Any]]
+    deadline: Optional[float]  # epoch seconds, see utils.deadline
 
 
 class ReportStateOutput(TypedDict):
     report: str
-    citations: List[dict[str, Any]]
+    citations: List["CitationRecord"]
 
 
 class ReportState(TypedDict):
@@ -30,12 +33,20 @@ class ReportState(TypedDict):
     outline: str
     questions: List[Tuple[str, str]]
     questions_by_section: List[dict[str, Any]]
-    citations: List[dict[str, Any]]
+    citations: List["CitationRecord"]  # collected per run by answer_questions
     answers: List[Tuple[str, str]]
     previous_questions: List[Tuple[str, str]]
     report: str
     web_search: bool
     file_search: bool
+    local_chunks: List[dict[str, Any]]  # files still being ingested into the KB
+    deadline: Optional[float]  # epoch seconds, see utils.deadline
+
+
+class SectionQuestions(BaseModel):
+    """Research questions for one report section."""
+
+    questions: List[str]
 
 
 class InstructionRequest(BaseModel):
@@ -46,21 +57,76 @@ class InstructionRequest(BaseModel):
     project_id: str
 
 
-@dataclass
-class Citation:
-    pass
+# Excerpts are clipped when a citation is recorded so per-run state stays small
+MAX_CITATION_CHARS = int(os.getenv("MAX_CITATION_CHARS", "1000"))
+# Upper bound on citations returned with one report
+MAX_REPORT_CITATIONS = int(os.getenv("MAX_REPORT_CITATIONS", "200"))
+
+
+@dataclass(frozen=True, slots=True)
+class CitationRecord:
+    """One source behind an answer, kept in ``ReportState['citations']``."""
+
+    kind: str  # "kb" or "web"
+    question: str
+    name: str  # KB file name or web page title
+    ref: str  # s3:// source URI (presigned when the report is read) or web URL
+    excerpt: str
+    page: Optional[int] = None
+
+    @classmethod
+    def kb(cls, question: str, chunk: dict[str, Any]) -> "CitationRecord":
+        return cls(
+            kind="kb",
+            question=question,
+            name=chunk.get("file_name", ""),
+            ref=chunk.get("source_uri", ""),
+            excerpt=(chunk.get("text") or "")[:MAX_CITATION_CHARS],
+            page=chunk.get("page"),
+        )
 
+    @classmethod
+    def web(cls, question: str, hit: dict[str, Any]) -> "CitationRecord":
+        return cls(
+            kind="web",
+            question=question,
+            name=hit.get("title", ""),
+            ref=hit.get("url", ""),
+            excerpt=(hit.get("answer") or hit.get("snippet") or "")[
+                :MAX_CITATION_CHARS
+            ],
+        )
 
-@dataclass
-class KBCitation(Citation):
-    chunk_text: str
-    page: Optional[int]
-    file_name: str
-    url: str
+    def to_dict(self) -> dict[str, Any]:
+        if self.kind == "kb":
+            return {
+                "type": "kb",
+                "chunk_text": self.excerpt,
+                "page": self.page,
+                "file_name": self.name,
+                "source_uri": self.ref,
+            }
+        return {
+            "type": "web",
+            "title": self.name,
+            "url": self.ref,
+            "snippet": self.excerpt,
+        }
 
 
-@dataclass
-class WebCitation(Citation):
-    title: str
-    url: str
-    snippet: str
+def serialize_citations(
+    records: List[CitationRecord], limit: int = MAX_REPORT_CITATIONS
+) -> List[dict[str, Any]]:
+    """Report citations in first-seen order, without duplicates and capped
+    at ``limit``."""
+    seen = set()
+    out: List[dict[str, Any]] = []
+    for rec in records:
+        key = (rec.kind, rec.ref, rec.page, rec.excerpt)
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append(rec.to_dict())
+        if len(out) >= limit:
+            break
+    return out
@@ -0,0 +1,309 @@
+"""Admission control and fair scheduling for research and chat runs.
+
+Every run asks ``admission.admit(user_id, kind)`` for a slot before it
+starts. Each kind has a cost (``ADMISSION_COSTS``); the process runs at most
+``ADMISSION_CAPACITY`` cost units at a time, and each user at most
+``ADMISSION_PER_USER`` runs at a time.
+
+Runs that do not fit wait in a queue ordered by start-time fair queuing: a
+user's next run is tagged ``max(virtual time, user's last finish tag) +
+cost / weight``, and the smallest tag that fits goes first. A user who
+queues ten deep reports therefore gets one turn in the rotation like
+everyone else, not ten in a row. Weights default to 1 and can be set per
+user in ``ADMISSION_USER_WEIGHTS`` (JSON object of user id to weight).
+
+Load is shed instead of queued without bound. A request is rejected with
+``AdmissionRejected``, which carries a ``retry_after`` estimate for
+429 / Retry-After, when:
+
+- the queue (total or the user's share) is full
+- it waited longer than its queue timeout
+- the models used more than ``ADMISSION_TOKENS_PER_MINUTE`` tokens in the
+  last minute (0 disables the token budget)
+
+Background jobs are admitted with ``shed=False``: they were accepted
+already, so they wait for their turn without a timeout.
+"""
+
+import os
+import json
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from utils.metrics import register_metrics_source
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", "16"))
+ADMISSION_PER_USER = int(os.getenv("ADMISSION_PER_USER", "2"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_MAX_QUEUE_PER_USER = int(os.getenv("ADMISSION_MAX_QUEUE_PER_USER", "4"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "20"))
+ADMISSION_TOKENS_PER_MINUTE = int(os.getenv("ADMISSION_TOKENS_PER_MINUTE", "0"))
+ADMISSION_COSTS = {"deep_research": 4, "research": 2, "chat": 1}
+# Retry-After before any run has finished
+DEFAULT_RUN_SECONDS = 60.0
+MAX_RETRY_AFTER_SECONDS = 300
+
+
+def _load_weights() -> Dict[str, float]:
+    raw = os.getenv("ADMISSION_USER_WEIGHTS")
+    if not raw:
+        return {}
+    try:
+        return {str(k): float(v) for k, v in json.loads(raw).items()}
+    except (ValueError, AttributeError) as e:
+        logger.error("Ignoring invalid ADMISSION_USER_WEIGHTS: %s", e)
+        return {}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("user", "kind", "cost", "start_tag", "finish_tag", "future", "granted")
+
+    def __init__(self, user: str, kind: str, cost: int, start_tag: float, finish_tag: float):
+        self.user = user
+        self.kind = kind
+        self.cost = cost
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.granted = False
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        capacity: int = ADMISSION_CAPACITY,
+        per_user: int = ADMISSION_PER_USER,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        max_queue_per_user: int = ADMISSION_MAX_QUEUE_PER_USER,
+        tokens_per_minute: int = ADMISSION_TOKENS_PER_MINUTE,
+    ):
+        self.capacity = capacity
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.tokens_per_minute = tokens_per_minute
+        self._weights = _load_weights()
+        # Scheduling state is only changed on the event loop; the lock keeps
+        # stats() (and note_tokens from worker threads) consistent
+        self._lock = threading.Lock()
+        self._running_cost = 0
+        self._running: Dict[str, int] = {}
+        self._queue: List[_Waiter] = []
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._tokens: Deque[Tuple[float, int]] = deque()
+        self._token_total = 0
+        self._run_seconds: Dict[str, Deque[float]] = {}
+        self._stats = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+            "rejected_tokens": 0,
+            "wait_seconds": 0.0,
+        }
+
+    # ――― token budget ―――
+    def note_tokens(self, tokens: int) -> None:
+        """Count model tokens towards the per-minute budget."""
+        if not tokens:
+            return
+        with self._lock:
+            self._tokens.append((time.monotonic(), tokens))
+            self._token_total += tokens
+
+    def _token_wait(self) -> float:
+        # Called with the lock held: seconds until usage is back under budget
+        if self.tokens_per_minute <= 0:
+            return 0.0
+        now = time.monotonic()
+        while self._tokens and now - self._tokens[0][0] > 60:
+            self._token_total -= self._tokens.popleft()[1]
+        if self._token_total < self.tokens_per_minute:
+            return 0.0
+        excess = self._token_total - self.tokens_per_minute
+        for at, tokens in self._tokens:
+            excess -= tokens
+            if excess < 0:
+                return 60 - (now - at)
+        return 60.0
+
+    # ――― scheduling ―――
+    def _fits(self, waiter: _Waiter) -> bool:
+        if self._running.get(waiter.user, 0) >= self.per_user:
+            return False
+        # A run costing more than the whole capacity still gets in alone
+        return (
+            self._running_cost + waiter.cost <= self.capacity
+            or self._running_cost == 0
+        )
+
+    def _dispatch(self) -> None:
+        # Called with the lock held
+        while True:
+            self._queue = [w for w in self._queue if not w.future.done()]
+            eligible = [w for w in self._queue if self._fits(w)]
+            if not eligible:
+                return
+            waiter = min(eligible, key=lambda w: w.finish_tag)
+            self._queue.remove(waiter)
+            self._virtual_time = max(self._virtual_time, waiter.start_tag)
+            self._running_cost += waiter.cost
+            self._running[waiter.user] = self._running.get(waiter.user, 0) + 1
+            waiter.granted = True
+            waiter.future.set_result(None)
+
+    def _release(self, waiter: _Waiter, seconds: Optional[float]) -> None:
+        with self._lock:
+            self._running_cost -= waiter.cost
+            self._running[waiter.user] -= 1
+            if not self._running[waiter.user]:
+                del self._running[waiter.user]
+            if seconds is not None:
+                self._run_seconds.setdefault(waiter.kind, deque(maxlen=50)).append(seconds)
+            self._dispatch()
+            self._forget_idle_users()
+
+    def _forget_idle_users(self) -> None:
+        # Called with the lock held. A user with nothing running or queued
+        # whose finish tag the virtual time has passed would get the same
+        # start tag without an entry; once the controller is idle every
+        # entry can go. Keeps _last_finish from growing with every user seen.
+        if not self._running and not self._queue:
+            self._last_finish.clear()
+            return
+        busy = set(self._running) | {w.user for w in self._queue}
+        for user in [
+            u
+            for u, tag in self._last_finish.items()
+            if tag <= self._virtual_time and u not in busy
+        ]:
+            del self._last_finish[user]
+
+    def _retry_after(self, kind: str) -> int:
+        # Called with the lock held: roughly when the queue ahead will drain
+        samples = self._run_seconds.get(kind)
+        typical = sum(samples) / len(samples) if samples else DEFAULT_RUN_SECONDS
+        queued_cost = sum(w.cost for w in self._queue)
+        rounds = 1 + queued_cost / max(self.capacity, 1)
+        return int(min(MAX_RETRY_AFTER_SECONDS, max(1, math.ceil(typical * rounds))))
+
+    def retry_after(self, kind: str) -> int:
+        """Suggested Retry-After (seconds) for a ``kind`` run turned away."""
+        with self._lock:
+            return self._retry_after(kind)
+
+    def _reject(self, reason: str, stat: str, retry_after: float) -> AdmissionRejected:
+        self._stats[stat] += 1
+        return AdmissionRejected(reason, int(max(1, math.ceil(retry_after))))
+
+    @asynccontextmanager
+    async def admit(
+        self,
+        user_id: Any,
+        kind: str,
+        timeout: Optional[float] = ADMISSION_QUEUE_TIMEOUT_SECONDS,
+        shed: bool = True,
+    ) -> AsyncIterator[None]:
+        """Hold a slot for one ``kind`` run of ``user_id`` while the block
+        runs; raises ``AdmissionRejected`` when ``shed`` and there is no
+        room (``timeout`` of None waits indefinitely)."""
+        user = str(user_id)
+        cost = ADMISSION_COSTS.get(kind, 1)
+        weight = self._weights.get(user, 1.0)
+
+        with self._lock:
+            if shed:
+                token_wait = self._token_wait()
+                if token_wait > 0:
+                    raise self._reject("Token budget exhausted", "rejected_tokens", token_wait)
+                queued_by_user = sum(1 for w in self._queue if w.user == user)
+                if (
+                    len(self._queue) >= self.max_queue
+                    or queued_by_user >= self.max_queue_per_user
+                ):
+                    raise self._reject(
+                        "Too many queued requests",
+                        "rejected_queue_full",
+                        self._retry_after(kind),
+                    )
+            start_tag = max(self._virtual_time, self._last_finish.get(user, 0.0))
+            finish_tag = start_tag + cost / weight
+            self._last_finish[user] = finish_tag
+            waiter = _Waiter(user, kind, cost, start_tag, finish_tag)
+            self._queue.append(waiter)
+            self._dispatch()
+            if not waiter.granted:
+                self._stats["queued"] += 1
+
+        enqueued = time.monotonic()
+        if not waiter.granted:
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(waiter.future),
+                    timeout if shed else None,
+                )
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                with self._lock:
+                    granted = waiter.granted
+                    if not granted:
+                        waiter.future.cancel()
+                        self._dispatch()
+                if isinstance(e, asyncio.CancelledError):
+                    if granted:
+                        # Granted just as the caller went away: give it back
+                        self._release(waiter, None)
+                    raise
+                if not granted:
+                    with self._lock:
+                        raise self._reject(
+                            "Timed out waiting for capacity",
+                            "rejected_timeout",
+                            self._retry_after(kind),
+                        ) from None
+
+        started = time.monotonic()
+        with self._lock:
+            self._stats["admitted"] += 1
+            self._stats["wait_seconds"] += started - enqueued
+        try:
+            yield
+        finally:
+            self._release(waiter, time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            admitted = self._stats["admitted"]
+            return {
+                **self._stats,
+                "wait_seconds": round(self._stats["wait_seconds"], 3),
+                "avg_wait_seconds": (
+                    round(self._stats["wait_seconds"] / admitted, 3) if admitted else 0.0
+                ),
+                "capacity": self.capacity,
+                "running_cost": self._running_cost,
+                "running_by_user": dict(self._running),
+                "queue_length": len(self._queue),
+                "tokens_last_minute": self._token_total,
+                "tokens_per_minute": self.tokens_per_minute,
+            }
+
+
+admission = AdmissionController()
+
+register_metrics_source("admission", admission.stats)
@@ -1,6 +1,9 @@
 import os
-import boto3, botocore
+import threading
+import boto3
 from botocore.config import Config
+from utils.metrics import register_metrics_source
+from utils.executors import EXECUTOR_SIZES
 
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
@@ -9,118 +12,137 @@ AWS_SESSION_TOKEN = os.getenv("AWS_SESSION_TOKEN")
 KNOWLEDGE_BASE_ID = os.getenv("KNOWLEDGE_BASE_ID")
 DATA_SOURCE_ID = os.getenv("DATA_SOURCE_ID")
 
+# Blocking AWS calls run on the executors in utils.executors; each client gets
+# one socket per worker thread that can use it, so the pool never caps the
+# executor. AWS_MAX_POOL_CONNECTIONS overrides this for every client.
+AWS_MAX_POOL_CONNECTIONS = os.getenv("AWS_MAX_POOL_CONNECTIONS")
+_DEFAULT_POOL_CONNECTIONS = min(32, (os.cpu_count() or 1) + 4)  # asyncio default executor
+SERVICE_POOL_CONNECTIONS = {
+    "bedrock-runtime": EXECUTOR_SIZES["llm"],
+    "bedrock-agent-runtime": EXECUTOR_SIZES["search"],
+    "s3": EXECUTOR_SIZES["storage"] + EXECUTOR_SIZES["cpu"],
+}
+AWS_MAX_ATTEMPTS = int(os.getenv("AWS_MAX_ATTEMPTS", "5"))
+AWS_CONNECT_TIMEOUT = float(os.getenv("AWS_CONNECT_TIMEOUT", "5"))
+AWS_READ_TIMEOUT = float(os.getenv("AWS_READ_TIMEOUT", "60"))
+# Model invocations stream long answers
+BEDROCK_READ_TIMEOUT = float(os.getenv("BEDROCK_READ_TIMEOUT", "300"))
+
 
 class AwsUtlis:
+    """Process-wide registry of boto3 clients.
+
+    Clients are created on first use and shared afterwards (boto3 clients
+    are thread-safe), each with a connection pool sized for our thread
+    fan-out, adaptive retries and TCP keep-alive.
+    """
+
+    _clients = {}
+    _pool_stats = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def pool_size(cls, service: str) -> int:
+        if AWS_MAX_POOL_CONNECTIONS:
+            return int(AWS_MAX_POOL_CONNECTIONS)
+        return max(
+            SERVICE_POOL_CONNECTIONS.get(service, 0), _DEFAULT_POOL_CONNECTIONS
+        )
+
+    @classmethod
+    def _client_config(cls, service: str) -> Config:
+        return Config(
+            region_name=AWS_REGION,
+            max_pool_connections=cls.pool_size(service),
+            retries={"max_attempts": AWS_MAX_ATTEMPTS, "mode": "adaptive"},
+            tcp_keepalive=True,
+            connect_timeout=AWS_CONNECT_TIMEOUT,
+            read_timeout=(
+                BEDROCK_READ_TIMEOUT if service == "bedrock-runtime" else AWS_READ_TIMEOUT
+            ),
+        )
+
+    @classmethod
+    def _track_pool_usage(cls, service: str, client) -> None:
+        pool_size = cls.pool_size(service)
+        stats = cls._pool_stats[service] = {
+            "max_pool_connections": pool_size,
+            "in_flight": 0,
+            "peak_in_flight": 0,
+            "saturated_requests": 0,
+            "requests": 0,
+            "errors": 0,
+        }
+
+        def before_send(**kwargs):
+            with cls._lock:
+                stats["requests"] += 1
+                stats["in_flight"] += 1
+                stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+                if stats["in_flight"] > pool_size:
+                    stats["saturated_requests"] += 1
+            # Returning a value here would replace the HTTP response
+
+        def response_received(exception=None, **kwargs):
+            with cls._lock:
+                stats["in_flight"] = max(0, stats["in_flight"] - 1)
+                if exception is not None:
+                    stats["errors"] += 1
+
+        client.meta.events.register("before-send", before_send)
+        client.meta.events.register("response-received", response_received)
+
+    @classmethod
+    def get_client(cls, service: str):
+        client = cls._clients.get(service)
+        if client is not None:
+            return client
+        with cls._lock:
+            client = cls._clients.get(service)
+            if client is None:
+                client = boto3.client(
+                    service,
+                    aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                    aws_session_token=AWS_SESSION_TOKEN,
+                    config=cls._client_config(service),
+                )
+                cls._track_pool_usage(service, client)
+                cls._clients[service] = client
+        return client
+
+    @classmethod
+    def pool_stats(cls):
+        with cls._lock:
+            return {service: dict(stats) for service, stats in cls._pool_stats.items()}
 
     @classmethod
     def get_s3_client(cls):
         """
-        Returns a boto3 client for AWS s3.
+        Returns the shared boto3 client for AWS s3.
         """
-        return boto3.client(
-            "s3",
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name=AWS_REGION,
-        )
+        return cls.get_client("s3")
 
     @classmethod
     def get_bedrock_agent(cls):
         """
-        Returns a boto3 client for bedrock-agent.
+        Returns the shared boto3 client for bedrock-agent.
         """
-        return boto3.client(
-            "bedrock-agent",
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name=AWS_REGION,
-        )
+        return cls.get_client("bedrock-agent")
 
     @classmethod
     def get_bedrock_agent_runtime(cls):
         """
-        Returns a boto3 client for bedrock-agent-runtime.
+        Returns the shared boto3 client for bedrock-agent-runtime.
         """
-        return boto3.client(
-            "bedrock-agent-runtime",
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name=AWS_REGION,
-        )
+        return cls.get_client("bedrock-agent-runtime")
 
     @classmethod
     def get_bedrock_runtime(cls):
         """
-        Returns a boto3 client for bedrock-runtime.
+        Returns the shared boto3 client for bedrock-runtime.
         """
-        return boto3.client(
-            "bedrock-runtime",
-            region_name=AWS_REGION,
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            aws_session_token=AWS_SESSION_TOKEN,
-            config=Config(retries={"max_attempts": 3}),
-        )
+        return cls.get_client("bedrock-runtime")
 
-    @classmethod
-    def close_previous_ingestion_jobs(cls):
-        """
-        List any ongoing ingestion jobs for the given knowledge base and data source,
-        and stop them using the correct AWS Bedrock API methods.
-        """
-        try:
-            print("[DEBUG] Checking for ongoing ingestion jobs...")
-
-            bedrock_client = cls.get_bedrock_agent()
-            # List ingestion jobs with pagination handling
-            paginator = bedrock_client.get_paginator("list_ingestion_jobs")
-            job_summaries = []
-
-            for page in paginator.paginate(
-                knowledgeBaseId=KNOWLEDGE_BASE_ID, dataSourceId=DATA_SOURCE_ID
-            ):
-                job_summaries.extend(page.get("ingestionJobSummaries", []))
-
-            # Process each job
-            jobs_stopped = 0
-            for job in job_summaries:
-                status = job.get("status", "").upper()
-                ingestion_job_id = job.get("ingestionJobId")
-
-                # Skip jobs that are already in terminal states
-                if status in ["COMPLETE", "STOPPED", "FAILED"]:
-                    continue
-
-                print(
-                    f"[DEBUG] Stopping ingestion job {ingestion_job_id} with status {status}"
-                )
-                try:
-                    bedrock_client.stop_ingestion_job(
-                        knowledgeBaseId=KNOWLEDGE_BASE_ID,
-                        dataSourceId=DATA_SOURCE_ID,
-                        ingestionJobId=ingestion_job_id,
-                    )
-                    jobs_stopped += 1
-                except botocore.exceptions.ClientError as e:
-                    error_code = e.response.get("Error", {}).get("Code")
-                    if error_code == "ResourceNotFoundException":
-                        print(f"[INFO] Job {ingestion_job_id} no longer exists")
-                    else:
-                        print(
-                            f"[WARNING] Failed to stop ingestion job {ingestion_job_id}: {str(e)}"
-                        )
-                except Exception as e:
-                    print(
-                        f"[WARNING] Unexpected error stopping job {ingestion_job_id}: {str(e)}"
-                    )
-
-            print(
-                f"[DEBUG] Stopped {jobs_stopped} ingestion jobs. Total jobs checked: {len(job_summaries)}"
-            )
-
-        except botocore.exceptions.ClientError as e:
-            print(f"[ERROR] AWS API error checking ingestion jobs: {str(e)}")
-        except Exception as e:
-            print(
-                f"[ERROR] Unexpected error in close_previous_ingestion_jobs: {str(e)}"
-            )
+
+register_metrics_source("aws_clients", AwsUtlis.pool_stats)
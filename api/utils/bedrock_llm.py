@@ -4,22 +4,30 @@
 ▸ Translates the first `system` message into the top‑level `system` field
   required by Bedrock’s Anthropic schema (only `user` and `assistant` are
   allowed inside the `messages` list).
-▸ Exposes   sync `invoke()`   |   async `ainvoke()`   |   `with_structured_output()`.
-▸ Prints token‑usage for debugging.
+▸ Exposes   sync `invoke()`   |   async `ainvoke()` / `astream()`   |   `with_structured_output()`.
+▸ Prints token‑usage for debugging and keeps running totals for /api/metrics.
 """
 
 from __future__ import annotations
 
-import asyncio
 import json
 import os
 import re
-from typing import Any, List, Mapping
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Dict, List, Mapping
 
-import boto3
-from botocore.config import Config
 from botocore.exceptions import ClientError
 from utils.aws_utils import AwsUtlis
+from utils.executors import EXECUTOR_SIZES, run_in
+from utils.metrics import register_metrics_source
+from utils.structured_output import StructuredCaller, json_instructions, tool_definition
+from utils.prompt_cache import (
+    bedrock_cache_points,
+    current_prompt_name,
+    record_prompt_usage,
+)
+from utils.model_router import model_router, note_model_usage
 
 # ───────────────── AWS / Bedrock config ─────────────────
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
@@ -33,8 +41,79 @@ DEFAULT_MODEL_ID = os.getenv(
     "us.anthropic.claude-3-haiku-20240307-v1:0",  # default to Claude 3 Haiku (on‑demand)
 )
 DEFAULT_PROFILE_ARN = os.getenv("BEDROCK_CLAUDE_PROFILE_ID")  # optional for provisioned
+STRONG_MODEL_ID = os.getenv(
+    "BEDROCK_CLAUDE_STRONG_MODEL_ID", "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
+)
 
-bedrock = AwsUtlis.get_bedrock_runtime()
+# Each open stream holds one "llm" worker thread for the whole generation;
+# streams beyond this limit wait without holding a thread
+BEDROCK_MAX_STREAMS = int(
+    os.getenv("BEDROCK_MAX_STREAMS", str(max(1, EXECUTOR_SIZES["llm"] // 2)))
+)
+_stream_slots = asyncio.Semaphore(BEDROCK_MAX_STREAMS)
+_STREAM_DONE = object()
+
+# ───────── usage accounting ─────────
+_usage_lock = threading.Lock()
+_usage_totals = {
+    "calls": 0,
+    "streams": 0,
+    "cancelled_streams": 0,
+    "input_tokens": 0,
+    "cache_read_tokens": 0,
+    "cache_write_tokens": 0,
+    "output_tokens": 0,
+    "first_tokens": 0,
+    "ttft_seconds": 0.0,
+}
+
+
+def _record_usage(usage: Mapping[str, Any], streamed: bool = False) -> None:
+    # input_tokens only counts the uncached part of the prompt
+    input_tokens = usage.get("input_tokens", 0) or 0
+    cache_read = usage.get("cache_read_input_tokens", 0) or 0
+    cache_write = usage.get("cache_creation_input_tokens", 0) or 0
+    output_tokens = usage.get("output_tokens", 0) or 0
+    print(
+        f"[Claude] tokens ⇒ prompt={input_tokens}  cached={cache_read}  "
+        f"completion={output_tokens}"
+    )
+    with _usage_lock:
+        _usage_totals["calls"] += 1
+        _usage_totals["input_tokens"] += input_tokens
+        _usage_totals["cache_read_tokens"] += cache_read
+        _usage_totals["cache_write_tokens"] += cache_write
+        _usage_totals["output_tokens"] += output_tokens
+        if streamed:
+            _usage_totals["streams"] += 1
+            if usage.get("cancelled"):
+                _usage_totals["cancelled_streams"] += 1
+            if usage.get("ttft_seconds") is not None:
+                _usage_totals["first_tokens"] += 1
+                _usage_totals["ttft_seconds"] += usage["ttft_seconds"]
+    note_model_usage(input_tokens + cache_read + cache_write, output_tokens)
+    prompt_name = current_prompt_name()
+    if prompt_name:
+        record_prompt_usage(
+            prompt_name, input_tokens + cache_read + cache_write, cache_read, cache_write
+        )
+
+
+def _usage_metrics() -> Dict[str, Any]:
+    with _usage_lock:
+        first_tokens = _usage_totals["first_tokens"]
+        return {
+            **_usage_totals,
+            "avg_ttft_seconds": (
+                round(_usage_totals["ttft_seconds"] / first_tokens, 4)
+                if first_tokens
+                else 0.0
+            ),
+            "max_streams": BEDROCK_MAX_STREAMS,
+        }
+
+
+register_metrics_source("bedrock_claude", _usage_metrics)
 
 # ───────── helper cleaning ─────────
 
@@ -50,6 +129,16 @@ def unwrap_boxed(text: str) -> str:
     return m.group(1).strip() if m else t
 
 
+def message_text(content: Any) -> str:
+    """Plain text of a message ``content`` given as a string or as a list of
+    Anthropic-style text blocks."""
+    if isinstance(content, list):
+        return "\n\n".join(
+            b.get("text", "") if isinstance(b, dict) else str(b) for b in content
+        )
+    return content
+
+
 def trim_fenced(text: str) -> str:
     t = text.strip()
     if t.startswith("```") and t.endswith("```"):
@@ -73,31 +162,17 @@ class ClaudeWrapper:
         self.max_tokens = max_tokens
         self.profile_arn = inference_profile_arn
 
-    # ――― internal call ―――
-    def _bedrock_call(self, payload: str):
-        try:
-            if self.profile_arn:
-                return bedrock.invoke_model_with_response_stream(
-                    inferenceId=self.profile_arn,
-                    contentType="application/json",
-                    accept="application/json",
-                    body=payload,
-                )
-            return bedrock.invoke_model(
-                modelId=self.model_id,
-                contentType="application/json",
-                accept="application/json",
-                body=payload,
-            )
-        except ClientError as e:
-            raise RuntimeError(f"Bedrock Claude invocation failed: {e}") from e
+    @property
+    def target_id(self) -> str:
+        # Inference-profile ARNs are accepted wherever a model ID is
+        return self.profile_arn or self.model_id
 
-    # ――― sync ―――
-    def invoke(self, messages: List[Mapping[str, str]]) -> str:
+    def _payload(self, messages: List[Mapping[str, str]]) -> str:
         # Extract optional system message
         system_msg = ""
         filtered: List[Mapping[str, str]] = []
-        for m in messages:
+        # Cache points only for models (and prefixes) Bedrock will cache
+        for m in bedrock_cache_points(messages, self.model_id):
             if m["role"] == "system" and not system_msg:
                 system_msg = m["content"]
             else:
@@ -106,7 +181,7 @@ class ClaudeWrapper:
                     raise ValueError("Invalid role for Bedrock Claude: " + m["role"])
                 filtered.append({"role": m["role"], "content": m["content"]})
 
-        payload = json.dumps(
+        return json.dumps(
             {
                 "anthropic_version": "bedrock-2023-05-31",
                 "system": system_msg,
@@ -116,24 +191,31 @@ class ClaudeWrapper:
             }
         )
 
-        resp = self._bedrock_call(payload)
+    def _invoke_data(self, payload: str) -> Dict[str, Any]:
+        try:
+            resp = AwsUtlis.get_bedrock_runtime().invoke_model(
+                modelId=self.target_id,
+                contentType="application/json",
+                accept="application/json",
+                body=payload,
+            )
+        except ClientError as e:
+            raise RuntimeError(f"Bedrock Claude invocation failed: {e}") from e
 
         body = resp.get("body") if isinstance(resp, dict) else resp
-        if hasattr(body, "iter_lines"):
-            chunks = [json.loads(chunk) for chunk in body.iter_lines()]
-            data = chunks[-1]
-        else:
-            if isinstance(body, (bytes, bytearray)):
-                body = body.decode("utf-8")
-            data = json.loads(body)
+        if hasattr(body, "read"):
+            body = body.read()
+        if isinstance(body, (bytes, bytearray)):
+            body = body.decode("utf-8")
+        data = json.loads(body)
 
         usage = data.get("usage")
         if usage and isinstance(usage, dict):
-            print(
-                f"[Claude] tokens ⇒ prompt={usage.get('prompt_tokens', 0)}  "
-                f"completion={usage.get('completion_tokens', 0)}"
-            )
+            _record_usage(usage)
+        return data
 
+    @staticmethod
+    def _content_text(data: Mapping[str, Any]) -> str | None:
         # Bedrock may return either the old "choices" schema *or* the new single-message schema
         if "choices" in data:
             content = data["choices"][0].get("message", {}).get("content")
@@ -144,27 +226,163 @@ class ClaudeWrapper:
             content = "".join(
                 p.get("text", "") if isinstance(p, dict) else str(p) for p in content
             )
+        return content
+
+    # ――― sync ―――
+    def invoke(self, messages: List[Mapping[str, str]]) -> str:
+        content = self._content_text(self._invoke_data(self._payload(messages)))
         if content is None:
             raise RuntimeError("Claude returned empty content.")
         return trim_fenced(unwrap_boxed(content))
 
+    # ――― streaming ―――
+    def _read_stream(
+        self,
+        payload: str,
+        loop: asyncio.AbstractEventLoop,
+        queue: asyncio.Queue,
+        cancelled: threading.Event,
+        usage: Dict[str, Any],
+    ) -> None:
+        """Runs on an "llm" worker: pushes text deltas onto ``queue`` until
+        the stream ends or the consumer sets ``cancelled``."""
+
+        def emit(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:  # event loop already closed
+                cancelled.set()
+
+        try:
+            resp = AwsUtlis.get_bedrock_runtime().invoke_model_with_response_stream(
+                modelId=self.target_id,
+                contentType="application/json",
+                accept="application/json",
+                body=payload,
+            )
+            stream = resp["body"]
+            try:
+                for event in stream:
+                    if cancelled.is_set():
+                        usage["cancelled"] = True
+                        break
+                    chunk = event.get("chunk")
+                    if not chunk:
+                        continue
+                    data = json.loads(chunk["bytes"])
+                    kind = data.get("type")
+                    if kind == "content_block_delta":
+                        text = data.get("delta", {}).get("text")
+                        if text:
+                            emit(text)
+                    elif kind == "message_start":
+                        start_usage = data.get("message", {}).get("usage", {})
+                        for key in (
+                            "input_tokens",
+                            "cache_read_input_tokens",
+                            "cache_creation_input_tokens",
+                        ):
+                            usage[key] = start_usage.get(key, 0)
+                    elif kind == "message_delta":
+                        usage["output_tokens"] = data.get("usage", {}).get(
+                            "output_tokens", 0
+                        )
+                        usage["stop_reason"] = data.get("delta", {}).get("stop_reason")
+            finally:
+                # Closing the connection stops Bedrock generating further tokens
+                stream.close()
+        except ClientError as e:
+            emit(RuntimeError(f"Bedrock Claude invocation failed: {e}"))
+        except Exception as e:
+            emit(e)
+        finally:
+            emit(_STREAM_DONE)
+
+    async def astream(
+        self,
+        messages: List[Mapping[str, str]],
+        usage: Dict[str, Any] | None = None,
+    ) -> AsyncIterator[str]:
+        """Yield text deltas as Bedrock produces them.
+
+        Closing the generator (or cancelling the task iterating it) stops the
+        generation. Token counts are written into ``usage`` when given.
+        """
+        payload = self._payload(messages)
+        usage = {} if usage is None else usage
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        async with _stream_slots:
+            started = loop.time()
+            reader = asyncio.ensure_future(
+                run_in("llm", self._read_stream, payload, loop, queue, cancelled, usage)
+            )
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is _STREAM_DONE:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    if "ttft_seconds" not in usage:
+                        usage["ttft_seconds"] = loop.time() - started
+                    yield item
+            finally:
+                cancelled.set()
+                # The reader stops at the next event; wait so the slot and the
+                # worker thread are released together
+                try:
+                    await asyncio.shield(reader)
+                except Exception:
+                    pass
+                _record_usage(usage, streamed=True)
+
     # ――― async ―――
     async def ainvoke(self, messages: List[Mapping[str, str]]) -> str:
-        return await asyncio.to_thread(self.invoke, messages)
+        # Streamed so that cancelling the caller also stops the generation
+        content = "".join([delta async for delta in self.astream(messages)])
+        if not content:
+            raise RuntimeError("Claude returned empty content.")
+        return trim_fenced(unwrap_boxed(content))
 
     # ――― structured output helper ―――
-    def with_structured_output(self, output_schema, method: str = "function_calling"):
-        class StructuredCaller:
-            def __init__(self, parent):
-                self._parent = parent
-
-            def invoke(self, msgs):
-                return self._parent.invoke(msgs)
-
-            async def ainvoke(self, msgs):
-                return await self._parent.ainvoke(msgs)
+    def _structured_reply(self, messages, output_schema, method: str) -> Any:
+        body = json.loads(self._payload(messages))
+        name, description, parameters = tool_definition(output_schema)
+        if method == "function_calling":
+            # Forced tool use: the reply arrives as already decoded tool input
+            body["tools"] = [
+                {"name": name, "description": description, "input_schema": parameters}
+            ]
+            body["tool_choice"] = {"type": "tool", "name": name}
+            data = self._invoke_data(json.dumps(body))
+            for block in data.get("content") or []:
+                if isinstance(block, dict) and block.get("type") == "tool_use":
+                    return block.get("input")
+            return self._content_text(data)
+
+        # JSON mode: schema in the system prompt, reply prefilled with "{"
+        if isinstance(body["system"], list):
+            body["system"].append(
+                {"type": "text", "text": json_instructions(output_schema).strip()}
+            )
+        else:
+            body["system"] = (body["system"] + json_instructions(output_schema)).strip()
+        body["messages"].append({"role": "assistant", "content": "{"})
+        content = self._content_text(self._invoke_data(json.dumps(body)))
+        return "{" + (content or "")
 
-        return StructuredCaller(self)
+    def with_structured_output(self, output_schema, method: str = "function_calling"):
+        """Callers whose ``invoke``/``ainvoke`` return a validated
+        ``output_schema`` instance (``method``: "function_calling" or
+        "json_mode")."""
+        return StructuredCaller(
+            output_schema,
+            lambda msgs: self._structured_reply(msgs, output_schema, method),
+            method,
+        )
 
 
 # ═════════════════════════════════════════════════════════════════════════════
@@ -197,7 +415,7 @@ class DeepSeekWrapper:
         last_user = next(
             (m for m in reversed(messages) if m["role"] == "user"), messages[-1]
         )
-        prompt_text = last_user["content"]
+        prompt_text = message_text(last_user["content"])
 
         payload = {
             "prompt": prompt_text,
@@ -208,7 +426,7 @@ class DeepSeekWrapper:
         }
 
         try:
-            resp = bedrock.invoke_model(
+            resp = AwsUtlis.get_bedrock_runtime().invoke_model(
                 modelId=self.model_id,
                 body=json.dumps(payload),
                 contentType="application/json",
@@ -225,6 +443,12 @@ class DeepSeekWrapper:
 
         # -----------------------------------------
 
+        usage = data.get("usage")
+        if isinstance(usage, dict):
+            note_model_usage(
+                usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+            )
+
         choices = data.get("choices")
         if not choices or not isinstance(choices, list):
             raise RuntimeError(f"No choices returned from DeepSeek:\n{data!r}")
@@ -237,20 +461,30 @@ class DeepSeekWrapper:
         return output
 
     async def ainvoke(self, messages):
-        # Run invoke in a background thread
-        return await asyncio.to_thread(self.invoke, messages)
+        # Run invoke on the LLM pool
+        return await run_in("llm", self.invoke, messages)
 
     def with_structured_output(self, output_schema, method="function_calling"):
-        class StructuredCaller:
-            def __init__(self, schema, method, parent):
-                self.schema = schema
-                self.method = method
-                self.parent = parent
+        """DeepSeek-R1 on Bedrock has no tool use, so the schema is always
+        requested in the prompt and the reply repaired/validated locally."""
+
+        def generate(messages):
+            # invoke() only sends the last user message
+            last_user = next(
+                (m for m in reversed(messages) if m["role"] == "user"), messages[-1]
+            )
+            prompt = message_text(last_user["content"]) + json_instructions(output_schema)
+            return self.invoke([{"role": "user", "content": prompt}])
 
-            def invoke(self, messages):
-                return self.parent.invoke(messages)
+        return StructuredCaller(output_schema, generate, "json_mode")
 
-            async def ainvoke(self, messages):
-                return await self.parent.ainvoke(messages)
 
-        return StructuredCaller(output_schema, method, self)
+# ═════════════════════════════════════════════════════════════════════════════
+#  Models available to graph-node routes (see utils.model_router)
+# ═════════════════════════════════════════════════════════════════════════════
+model_router.register_model("claude-haiku", lambda: ClaudeWrapper(temperature=0.0))
+model_router.register_model(
+    "claude-sonnet",
+    lambda: ClaudeWrapper(model_id=STRONG_MODEL_ID, temperature=0.0, inference_profile_arn=None),
+)
+model_router.register_model("deepseek-r1", lambda: DeepSeekWrapper(temperature=0.0))
@@ -0,0 +1,161 @@
+"""Stop research work once nobody is waiting for it.
+
+``run_while_connected(request, aw)`` runs the work of an HTTP request as a
+task and polls ``request.is_disconnected()``; when the client goes away
+(browser closed, proxy timeout) the task is cancelled and
+``ClientDisconnected`` is raised. The cancellation unwinds through the graph
+nodes: Claude streams are closed, aiohttp / httpx requests are aborted and
+executor calls still waiting in a pool's queue are dropped (calls already
+running on a thread finish on their own, bounded by their timeouts).
+
+With ``CHECKPOINT_ON_DISCONNECT`` enabled, work run through
+``run_checkpointed`` keeps the partial report that nodes record with
+``checkpoint_partial``; if the work is cancelled, its ``on_cancel`` callback
+gets the partial report to store.
+
+Cancelled runs, the time they had been running and the checkpoints stored
+are counted in the ``cancellations`` metrics source.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from utils.metrics import register_metrics_source
+
+logger = logging.getLogger(__name__)
+
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "1"))
+CHECKPOINT_ON_DISCONNECT = os.getenv("CHECKPOINT_ON_DISCONNECT", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+
+class ClientDisconnected(Exception):
+    """The client went away and its work was cancelled."""
+
+
+class RunCheckpoint:
+    """Latest partial result of a run."""
+
+    def __init__(self):
+        self.report = ""
+        self.sections: List[Dict[str, Any]] = []
+
+
+_checkpoint: contextvars.ContextVar[Optional[RunCheckpoint]] = contextvars.ContextVar(
+    "run_checkpoint", default=None
+)
+
+
+def checkpointing() -> bool:
+    """True when the current run keeps partial results."""
+    return _checkpoint.get() is not None
+
+
+def checkpoint_partial(report: str, sections: Optional[List[Dict[str, Any]]] = None):
+    """Record the report as far as it has been written (no-op unless the
+    run is checkpointed)."""
+    checkpoint = _checkpoint.get()
+    if checkpoint is not None:
+        checkpoint.report = report
+        checkpoint.sections = sections or []
+
+
+# ------------------------------------------------------------------------
+# ACCOUNTING
+# ------------------------------------------------------------------------
+_lock = threading.Lock()
+_stats: Dict[str, Dict[str, float]] = {}
+_checkpoints = {"saved": 0, "failed": 0}
+
+
+def note_reclaimed(source: str, seconds: float) -> None:
+    """Count a run from ``source`` (``http``, ``websocket``...) cancelled
+    after ``seconds``."""
+    with _lock:
+        stats = _stats.setdefault(source, {"cancelled": 0, "seconds_reclaimed": 0.0})
+        stats["cancelled"] += 1
+        stats["seconds_reclaimed"] += seconds
+
+
+def _note_checkpoint(ok: bool) -> None:
+    with _lock:
+        _checkpoints["saved" if ok else "failed"] += 1
+
+
+def _cancellation_metrics() -> Dict[str, Any]:
+    with _lock:
+        snapshot: Dict[str, Any] = {
+            source: {**stats, "seconds_reclaimed": round(stats["seconds_reclaimed"], 1)}
+            for source, stats in _stats.items()
+        }
+        snapshot["checkpoints"] = dict(_checkpoints)
+        return snapshot
+
+
+register_metrics_source("cancellations", _cancellation_metrics)
+
+
+# ------------------------------------------------------------------------
+# CHECKPOINTS
+# ------------------------------------------------------------------------
+async def run_checkpointed(
+    aw: Awaitable[Any], on_cancel: Callable[[RunCheckpoint], None]
+) -> Any:
+    """Await ``aw``; if it is cancelled, pass its partial result (if any) to
+    ``on_cancel`` before re-raising."""
+    if not CHECKPOINT_ON_DISCONNECT:
+        return await aw
+    checkpoint = RunCheckpoint()
+    # The task copies the context, so its nodes see the checkpoint
+    token = _checkpoint.set(checkpoint)
+    try:
+        task = asyncio.ensure_future(aw)
+    finally:
+        _checkpoint.reset(token)
+    try:
+        return await task
+    except asyncio.CancelledError:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        if checkpoint.report:
+            try:
+                on_cancel(checkpoint)
+                _note_checkpoint(ok=True)
+            except Exception as e:
+                logger.error("Saving a partial result failed: %s", e)
+                _note_checkpoint(ok=False)
+        raise
+
+
+# ------------------------------------------------------------------------
+# HTTP
+# ------------------------------------------------------------------------
+async def run_while_connected(request: Any, aw: Awaitable[Any], what: str = "request") -> Any:
+    """Await ``aw`` unless the client of ``request`` disconnects first."""
+    task = asyncio.ensure_future(aw)
+    started = time.monotonic()
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                break
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    elapsed = time.monotonic() - started
+    note_reclaimed("http", elapsed)
+    logger.info("Client disconnected; cancelled %s after %.1fs", what, elapsed)
+    raise ClientDisconnected(what)
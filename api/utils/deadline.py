@@ -0,0 +1,107 @@
+"""Per-request deadlines.
+
+The API layer (or the job handler) opens a ``deadline_scope`` for a research
+run. The deadline is an absolute wall-clock time, so it can be stored in
+graph state and job payloads; inside the scope it is also held in a context
+variable, which follows the run into graph nodes, asyncio tasks and
+executor threads (``run_in`` copies the context).
+
+Nodes use ``remaining`` / ``budget_low`` to decide how much work to do, and
+outbound calls use ``call_timeout`` and ``within_deadline`` so that nothing
+waits past the deadline.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Awaitable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+RESEARCH_DEADLINE_SECONDS = float(os.getenv("RESEARCH_DEADLINE_SECONDS", "600"))
+DEEP_RESEARCH_DEADLINE_SECONDS = float(os.getenv("DEEP_RESEARCH_DEADLINE_SECONDS", "1200"))
+MAX_DEADLINE_SECONDS = float(os.getenv("MAX_DEADLINE_SECONDS", "3600"))
+# Outbound calls are never given less than this, even with the budget spent
+MIN_CALL_TIMEOUT_SECONDS = 1.0
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "deadline", default=None
+)
+
+
+def resolve_deadline(seconds: Optional[float], default: float) -> float:
+    """Absolute deadline for a run of ``seconds`` (``default`` if not
+    given), capped at ``MAX_DEADLINE_SECONDS``."""
+    seconds = default if not seconds or seconds <= 0 else seconds
+    return time.time() + min(seconds, MAX_DEADLINE_SECONDS)
+
+
+def research_deadline(research_type: str, seconds: Optional[float] = None) -> float:
+    """Deadline for a research run requested with ``seconds`` (or the
+    default SLA of its research type)."""
+    default = (
+        DEEP_RESEARCH_DEADLINE_SECONDS
+        if research_type == "deep"
+        else RESEARCH_DEADLINE_SECONDS
+    )
+    return resolve_deadline(seconds, default)
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[float]) -> Iterator[Optional[float]]:
+    """Make ``deadline`` (epoch seconds) current; an earlier enclosing
+    deadline wins."""
+    outer = _deadline.get()
+    if outer is not None and (deadline is None or outer < deadline):
+        deadline = outer
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def current_deadline() -> Optional[float]:
+    return _deadline.get()
+
+
+def remaining(deadline: Optional[float] = None) -> Optional[float]:
+    """Seconds left until ``deadline`` (the current one by default); None
+    when there is no deadline."""
+    deadline = deadline if deadline is not None else _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.time())
+
+
+def budget_low(seconds: float, deadline: Optional[float] = None) -> bool:
+    """True when less than ``seconds`` are left."""
+    left = remaining(deadline)
+    return left is not None and left < seconds
+
+
+def call_timeout(default: float) -> float:
+    """Timeout for one outbound call: ``default``, shortened to the time
+    left."""
+    left = remaining()
+    if left is None:
+        return default
+    return max(MIN_CALL_TIMEOUT_SECONDS, min(default, left))
+
+
+async def within_deadline(
+    aw: Awaitable[Any], fallback: Any = None, reserve: float = 0.0, what: str = ""
+) -> Any:
+    """Await ``aw`` until the current deadline (minus ``reserve`` seconds)
+    and return ``fallback`` instead if it does not finish in time."""
+    left = remaining()
+    if left is None:
+        return await aw
+    try:
+        return await asyncio.wait_for(aw, max(0.0, left - reserve))
+    except asyncio.TimeoutError:
+        logger.warning("Deadline reached%s; degrading", f" during {what}" if what else "")
+        return fallback
@@ -1,7 +1,9 @@
 import os
 import re
-import asyncio
 from openai import OpenAI as ORouterClient
+from utils.executors import run_in
+from utils.structured_output import StructuredCaller, json_instructions, tool_definition
+from utils.model_router import note_model_usage
 from dotenv import load_dotenv, find_dotenv
 
 env_path = find_dotenv()  # walks up until it finds .env
@@ -52,6 +54,12 @@ def trim_fenced(text: str) -> str:
     return t
 
 
+def _note_usage(resp) -> None:
+    usage = getattr(resp, "usage", None)
+    if usage is not None:
+        note_model_usage(usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+
 class DeepSeekWrapper:
     def __init__(self, model: str, temperature: float, max_tokens: int = 40000):
         self.model = model
@@ -68,6 +76,8 @@ class DeepSeekWrapper:
             stop=None,
         )
 
+        _note_usage(resp)
+
         # --- new validation block ---
         choices = getattr(resp, "choices", None)
         if not choices:
@@ -81,21 +91,61 @@ class DeepSeekWrapper:
 
     async def ainvoke(self, messages):
         """
-        Asynchronous version: runs invoke() in background thread.
+        Asynchronous version: runs invoke() on the LLM pool.
         """
-        return await asyncio.to_thread(self.invoke, messages)
-
-    def with_structured_output(self, output_schema, method="function_calling"):
-        class StructuredCaller:
-            def __init__(self, schema, method, parent):
-                self.schema = schema
-                self.method = method
-                self.parent = parent
+        return await run_in("llm", self.invoke, messages)
 
-            def invoke(self, messages):
-                return self.parent.invoke(messages)
+    def _structured_reply(self, messages, output_schema, method):
+        formatted = [{"role": m["role"], "content": m["content"]} for m in messages]
+        name, description, parameters = tool_definition(output_schema)
+        kwargs = {}
+        if method == "function_calling":
+            kwargs["tools"] = [
+                {
+                    "type": "function",
+                    "function": {
+                        "name": name,
+                        "description": description,
+                        "parameters": parameters,
+                    },
+                }
+            ]
+            kwargs["tool_choice"] = {"type": "function", "function": {"name": name}}
+        elif method == "json_schema":
+            kwargs["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": name, "schema": parameters, "strict": True},
+            }
+        else:  # "json_mode"
+            kwargs["response_format"] = {"type": "json_object"}
+            formatted[-1] = {
+                **formatted[-1],
+                "content": formatted[-1]["content"] + json_instructions(output_schema),
+            }
 
-            async def ainvoke(self, messages):
-                return await self.parent.ainvoke(messages)
+        resp = client.chat.completions.create(
+            model=self.model,
+            messages=formatted,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            **kwargs,
+        )
+        _note_usage(resp)
+        choices = getattr(resp, "choices", None)
+        if not choices:
+            raise RuntimeError(f"No choices returned from OpenRouter:\n{resp!r}")
+        message = choices[0].message
+        # Tool arguments are JSON text; near-misses are repaired by the caller
+        if message.tool_calls:
+            return message.tool_calls[0].function.arguments
+        return message.content
 
-        return StructuredCaller(output_schema, method, self)
+    def with_structured_output(self, output_schema, method="function_calling"):
+        """Callers whose ``invoke``/``ainvoke`` return a validated
+        ``output_schema`` instance (``method``: "function_calling",
+        "json_schema" or "json_mode")."""
+        return StructuredCaller(
+            output_schema,
+            lambda msgs: self._structured_reply(msgs, output_schema, method),
+            method,
+        )
@@ -0,0 +1,431 @@
+"""Project document catalog backed by ``documents_table``.
+
+Upload handlers record every stored object here, and the research pipelines
+look files up through this module instead of listing S3 prefixes per report.
+Projects uploaded before the catalog existed have no rows; the first lookup
+lists their storage prefix once and catalogs what it finds.
+"""
+
+import uuid
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from db.db_session import SessionLocal
+from db_models.documents import DocumentTable, IngestionStatus, ParseStatus
+from utils.storage import get_storage, StorageError
+
+# KB metadata sidecars written next to each upload; not documents themselves
+SIDECAR_SUFFIX = ".metadata.json"
+
+logger = logging.getLogger(__name__)
+
+
+def _as_uuid(value: Any) -> Optional[uuid.UUID]:
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def document_to_dict(doc: DocumentTable) -> Dict[str, Any]:
+    return {
+        "id": str(doc.id),
+        "file_name": doc.file_name,
+        "file_path": doc.file_path,
+        "bucket": doc.bucket,
+        "user_id": str(doc.user_id) if doc.user_id else "",
+        "project_id": str(doc.temp_project_id) if doc.temp_project_id else "",
+        "file_size": doc.file_size,
+        "content_type": doc.content_type,
+        "content_hash": doc.content_hash,
+        "etag": doc.etag,
+        "ingestion_status": doc.ingestion_status.value if doc.ingestion_status else None,
+        "parse_status": doc.parse_status.value if doc.parse_status else None,
+        "index_version": doc.index_version or 0,
+        "ingestion_job_id": doc.ingestion_job_id,
+    }
+
+
+def upsert_document(
+    db: Session,
+    *,
+    user_id: str,
+    temp_project_id: str,
+    bucket: str,
+    file_path: str,
+    file_name: str,
+    file_size: Optional[int] = None,
+    content_type: Optional[str] = None,
+    content_hash: Optional[str] = None,
+    etag: Optional[str] = None,
+    parse_status: ParseStatus = ParseStatus.pending,
+) -> DocumentTable:
+    """Insert or refresh the catalog row for ``bucket/file_path``.
+
+    Re-uploading the same key resets ingestion and parse state so the new
+    object is picked up by the next ingestion / parsing pass.
+    """
+    doc = (
+        db.query(DocumentTable)
+        .filter(
+            DocumentTable.bucket == bucket,
+            DocumentTable.file_path == file_path,
+        )
+        .first()
+    )
+    if doc is None:
+        doc = DocumentTable(
+            user_id=_as_uuid(user_id),
+            temp_project_id=_as_uuid(temp_project_id),
+            bucket=bucket,
+            file_path=file_path,
+            file_name=file_name,
+        )
+        db.add(doc)
+
+    doc.file_name = file_name
+    doc.file_size = file_size
+    doc.content_type = content_type
+    doc.content_hash = content_hash
+    doc.etag = etag
+    doc.ingestion_status = IngestionStatus.pending
+    doc.ingestion_job_id = None
+    doc.parse_status = parse_status
+    doc.index_version = 0
+    db.commit()
+    db.refresh(doc)
+    return doc
+
+
+def find_document_by_hash(
+    db: Session, user_id: str, temp_project_id: str, content_hash: str
+) -> Optional[DocumentTable]:
+    """Existing catalog row with identical content in the same project, if any."""
+    user_uuid = _as_uuid(user_id)
+    temp_uuid = _as_uuid(temp_project_id)
+    if user_uuid is None or temp_uuid is None or not content_hash:
+        return None
+    return (
+        db.query(DocumentTable)
+        .filter(
+            DocumentTable.user_id == user_uuid,
+            DocumentTable.temp_project_id == temp_uuid,
+            DocumentTable.content_hash == content_hash,
+        )
+        .first()
+    )
+
+
+def link_documents_to_project(
+    db: Session, user_id: str, temp_project_id: str, project_id: Any
+) -> int:
+    """Attach catalog rows uploaded under ``temp_project_id`` to the real project."""
+    user_uuid = _as_uuid(user_id)
+    temp_uuid = _as_uuid(temp_project_id)
+    if user_uuid is None or temp_uuid is None:
+        return 0
+    updated = (
+        db.query(DocumentTable)
+        .filter(
+            DocumentTable.user_id == user_uuid,
+            DocumentTable.temp_project_id == temp_uuid,
+            DocumentTable.project_id.is_(None),
+        )
+        .update({DocumentTable.project_id: project_id}, synchronize_session=False)
+    )
+    db.commit()
+    return updated
+
+
+def list_project_documents(
+    user_id: str,
+    project_id: str,
+    bucket: Optional[str] = None,
+    extensions: Optional[Iterable[str]] = None,
+    db: Optional[Session] = None,
+) -> List[Dict[str, Any]]:
+    """Return catalog entries for a user's project, optionally filtered by
+    bucket and (case-insensitive) file extension."""
+    user_uuid = _as_uuid(user_id)
+    temp_uuid = _as_uuid(project_id)
+    if user_uuid is None or temp_uuid is None:
+        return []
+
+    suffixes = tuple(e.lower() for e in extensions) if extensions else None
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        query = db.query(DocumentTable).filter(
+            DocumentTable.user_id == user_uuid,
+            DocumentTable.temp_project_id == temp_uuid,
+        )
+        if bucket:
+            query = query.filter(DocumentTable.bucket == bucket)
+        docs = query.order_by(DocumentTable.created_at).all()
+        return [
+            document_to_dict(d)
+            for d in docs
+            if not suffixes or d.file_path.lower().endswith(suffixes)
+        ]
+    except Exception as e:
+        logger.error("Document catalog lookup failed: %s", e)
+        return []
+    finally:
+        if own_session:
+            db.close()
+
+
+def _has_documents(db: Session, user_uuid: uuid.UUID, temp_uuid: uuid.UUID) -> bool:
+    return (
+        db.query(DocumentTable.id)
+        .filter(
+            DocumentTable.user_id == user_uuid,
+            DocumentTable.temp_project_id == temp_uuid,
+        )
+        .first()
+        is not None
+    )
+
+
+def register_stored_documents(
+    user_id: str,
+    project_id: str,
+    bucket: str,
+    keys: Iterable[str],
+    db: Optional[Session] = None,
+) -> int:
+    """Catalog objects stored under a project before the catalog existed.
+
+    Only runs for projects with no catalog rows at all. The upload path of
+    the time sent these files to the knowledge base, so they are recorded as
+    ingested. Returns the number of rows added.
+    """
+    user_uuid = _as_uuid(user_id)
+    temp_uuid = _as_uuid(project_id)
+    if user_uuid is None or temp_uuid is None:
+        return 0
+
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        if _has_documents(db, user_uuid, temp_uuid):
+            return 0
+        added = 0
+        for key in keys:
+            if key.endswith("/") or key.endswith(SIDECAR_SUFFIX):
+                continue
+            is_pdf = key.lower().endswith(".pdf")
+            db.add(
+                DocumentTable(
+                    user_id=user_uuid,
+                    temp_project_id=temp_uuid,
+                    bucket=bucket,
+                    file_path=key,
+                    file_name=key.rsplit("/", 1)[-1],
+                    ingestion_status=IngestionStatus.ingested,
+                    parse_status=(
+                        ParseStatus.pending if is_pdf else ParseStatus.not_applicable
+                    ),
+                )
+            )
+            added += 1
+        db.commit()
+        if added:
+            logger.info(
+                "Cataloged %d stored documents for %s/%s", added, user_id, project_id
+            )
+        return added
+    except Exception as e:
+        db.rollback()
+        logger.error("Document catalog backfill failed: %s", e)
+        return 0
+    finally:
+        if own_session:
+            db.close()
+
+
+def _catalog_is_empty(user_id: str, project_id: str) -> bool:
+    user_uuid = _as_uuid(user_id)
+    temp_uuid = _as_uuid(project_id)
+    if user_uuid is None or temp_uuid is None:
+        return False
+    db = SessionLocal()
+    try:
+        return not _has_documents(db, user_uuid, temp_uuid)
+    except Exception as e:
+        logger.error("Document catalog lookup failed: %s", e)
+        return False
+    finally:
+        db.close()
+
+
+async def find_project_documents(
+    user_id: str,
+    project_id: str,
+    bucket: str,
+    extensions: Optional[Iterable[str]] = None,
+) -> List[Dict[str, Any]]:
+    """``list_project_documents`` for use on the event loop.
+
+    A project with no catalog rows at all was uploaded before the catalog:
+    its ``{user_id}/{project_id}/`` prefix is listed and cataloged once, so
+    its files are found from then on.
+    """
+    docs = await asyncio.to_thread(
+        list_project_documents, user_id, project_id, bucket=bucket, extensions=extensions
+    )
+    if docs or not await asyncio.to_thread(_catalog_is_empty, user_id, project_id):
+        return docs
+
+    try:
+        keys = await get_storage().list_keys(bucket, f"{user_id}/{project_id}/")
+    except StorageError as e:
+        logger.error("Listing stored documents failed: %s", e)
+        return []
+    if not keys:
+        return []
+    await asyncio.to_thread(register_stored_documents, user_id, project_id, bucket, keys)
+    return await asyncio.to_thread(
+        list_project_documents, user_id, project_id, bucket=bucket, extensions=extensions
+    )
+
+
+def project_index_version(
+    user_id: str, project_id: str, db: Optional[Session] = None
+) -> int:
+    """Highest index version among a project's documents (0 if none indexed)."""
+    user_uuid = _as_uuid(user_id)
+    temp_uuid = _as_uuid(project_id)
+    if user_uuid is None or temp_uuid is None:
+        return 0
+
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        version = (
+            db.query(func.max(DocumentTable.index_version))
+            .filter(
+                DocumentTable.user_id == user_uuid,
+                DocumentTable.temp_project_id == temp_uuid,
+            )
+            .scalar()
+        )
+        return int(version or 0)
+    except Exception as e:
+        logger.error("Document catalog version lookup failed: %s", e)
+        return 0
+    finally:
+        if own_session:
+            db.close()
+
+
+def mark_documents_indexed(
+    document_ids: Iterable[str], index_version: int, db: Optional[Session] = None
+) -> None:
+    """Record that the given documents are part of index ``index_version``."""
+    ids = [u for u in (_as_uuid(i) for i in document_ids) if u is not None]
+    if not ids:
+        return
+
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        db.query(DocumentTable).filter(DocumentTable.id.in_(ids)).update(
+            {
+                DocumentTable.index_version: index_version,
+                DocumentTable.ingestion_status: IngestionStatus.ingested,
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error("Failed to mark documents indexed: %s", e)
+    finally:
+        if own_session:
+            db.close()
+
+
+def set_ingestion_status(
+    document_ids: Iterable[str],
+    status: IngestionStatus,
+    job_id: Optional[str] = None,
+    db: Optional[Session] = None,
+) -> None:
+    ids = [u for u in (_as_uuid(i) for i in document_ids) if u is not None]
+    if not ids:
+        return
+
+    values = {DocumentTable.ingestion_status: status}
+    if job_id is not None:
+        values[DocumentTable.ingestion_job_id] = job_id
+
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        db.query(DocumentTable).filter(DocumentTable.id.in_(ids)).update(
+            values, synchronize_session=False
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error("Failed to update ingestion status: %s", e)
+    finally:
+        if own_session:
+            db.close()
+
+
+def list_unfinished_documents(db: Optional[Session] = None) -> List[Dict[str, Any]]:
+    """Catalog rows still waiting for ingestion (pending or ingesting).
+
+    Rows without an owner predate the catalog and are not ingestion work.
+    """
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        docs = (
+            db.query(DocumentTable)
+            .filter(
+                DocumentTable.ingestion_status.in_(
+                    [IngestionStatus.pending, IngestionStatus.ingesting]
+                ),
+                DocumentTable.user_id.isnot(None),
+                DocumentTable.temp_project_id.isnot(None),
+            )
+            .order_by(DocumentTable.created_at)
+            .all()
+        )
+        return [document_to_dict(d) for d in docs]
+    except Exception as e:
+        logger.error("Document catalog lookup failed: %s", e)
+        return []
+    finally:
+        if own_session:
+            db.close()
+
+
+def set_parse_status(
+    document_ids: Iterable[str], status: ParseStatus, db: Optional[Session] = None
+) -> None:
+    ids = [u for u in (_as_uuid(i) for i in document_ids) if u is not None]
+    if not ids:
+        return
+
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        db.query(DocumentTable).filter(DocumentTable.id.in_(ids)).update(
+            {DocumentTable.parse_status: status}, synchronize_session=False
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error("Failed to update parse status: %s", e)
+    finally:
+        if own_session:
+            db.close()
@@ -1,6 +1,6 @@
 import os
+import asyncio
 import traceback
-import boto3
 import pandas as pd
 import io, os, tempfile, json
 from pathlib import Path
@@ -11,7 +11,9 @@ from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_s
 from llama_index.embeddings.openai import OpenAIEmbedding
 import openai
 from dotenv import load_dotenv, find_dotenv
-from utils.aws_utils import AwsUtlis
+from utils.storage import get_storage, ObjectNotFound
+from utils.executors import run_in
+from utils.document_catalog import find_project_documents
 
 env_path = find_dotenv()  # walks up until it finds .env
 loaded = load_dotenv(env_path)
@@ -22,9 +24,6 @@ FILE_BUCKET = os.getenv("BUCKET_NAME", "deep-research-docs")
 # Index bucket – where the Excel index is stored
 INDEX_BUCKET = os.getenv("EXCEL_BUCKET_NAME", "excel-file-indexes")
 
-# Create an S3 client for Excel utils operations (you can also share the client if you wish).
-s3_client = AwsUtlis.get_s3_client()
-
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 openai.api_key = OPENAI_API_KEY
 
@@ -32,30 +31,17 @@ openai.api_key = OPENAI_API_KEY
 # =============================================================================
 # EXCEL FILE HANDLING WITH LLAMA INDEX
 # =============================================================================
-def list_s3_excel_files(
+async def list_s3_excel_files(
     user_id: str, project_id: str, bucket: str = FILE_BUCKET
 ) -> List[Dict[str, Any]]:
-    prefix = f"{user_id}/{project_id}/"
-    resp = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix, Delimiter="/")
-    excel_files = []
-    for content in resp.get("Contents", []):
-        key = content["Key"]
-        if key.lower().endswith((".xls", ".xlsx")):
-            head = s3_client.head_object(Bucket=bucket, Key=key)
-            metadata = head.get("Metadata", {})
-            excel_files.append(
-                {
-                    "file_name": os.path.basename(key),
-                    "file_path": key,
-                    "user_id": metadata.get("user_id", ""),
-                    "project_id": metadata.get("project_id", ""),
-                }
-            )
-    return excel_files
+    """Excel files for a project, looked up in the document catalog."""
+    return await find_project_documents(
+        user_id, project_id, bucket, extensions=(".xls", ".xlsx")
+    )
 
 
-def has_excel_files(user_id: str, project_id: str) -> bool:
-    files = list_s3_excel_files(user_id, project_id)
+async def has_excel_files(user_id: str, project_id: str) -> bool:
+    files = await list_s3_excel_files(user_id, project_id)
     return len(files) > 0
 
 
@@ -64,37 +50,89 @@ def get_s3_index_path(user_id: str, project_id: str) -> str:
     return f"indexes/{user_id}/{project_id}/excel_index/"
 
 
-def download_index_from_s3(
-    local_path: str, user_id: str, project_id: str, bucket: str = INDEX_BUCKET
+# Written next to the persisted index; lists its files and the source ETags it was built from
+INDEX_MANIFEST = "manifest.json"
+
+
+def source_signature(excel_files: List[Dict[str, Any]]) -> Dict[str, str]:
+    """Map of file path -> ETag (or content hash) identifying the index inputs."""
+    return {
+        f["file_path"]: f.get("etag") or f.get("content_hash") or ""
+        for f in excel_files
+    }
+
+
+async def download_index_from_s3(
+    local_path: str,
+    user_id: str,
+    project_id: str,
+    bucket: str = INDEX_BUCKET,
+    expected_sources: Optional[Dict[str, str]] = None,
 ) -> bool:
-    """Download index files from S3 if they exist."""
+    """Download index files from S3 if they exist.
+
+    The manifest names every persisted file, so no prefix listing is needed.
+    When `expected_sources` is given the index is only used if it was built from
+    exactly those files, which invalidates it as soon as the catalog changes.
+    """
     s3_path = get_s3_index_path(user_id, project_id)
+    storage = get_storage()
     try:
-        objects = s3_client.list_objects_v2(Bucket=bucket, Prefix=s3_path)
-        if not objects.get("Contents"):
+        try:
+            manifest = json.loads(await storage.read(bucket, s3_path + INDEX_MANIFEST))
+        except ObjectNotFound:
+            return False
+
+        if expected_sources is not None and manifest.get("sources") != expected_sources:
+            print("[DEBUG] Excel index is stale; source files changed")
             return False
 
-        for obj in objects["Contents"]:
-            local_file = os.path.join(local_path, os.path.relpath(obj["Key"], s3_path))
-            os.makedirs(os.path.dirname(local_file), exist_ok=True)
-            s3_client.download_file(bucket, obj["Key"], local_file)
-            print("[DEBUG] ")
-        return True
+        files = manifest.get("files", [])
+        await asyncio.gather(
+            *[
+                storage.download(
+                    bucket, s3_path + rel_path, os.path.join(local_path, rel_path)
+                )
+                for rel_path in files
+            ]
+        )
+        return bool(files)
     except Exception as e:
         print(f"[DEBUG] Index download failed: {str(e)}")
         return False
 
 
-def upload_index_to_s3(
-    local_path: str, user_id: str, project_id: str, bucket: str = INDEX_BUCKET
+async def upload_index_to_s3(
+    local_path: str,
+    user_id: str,
+    project_id: str,
+    bucket: str = INDEX_BUCKET,
+    sources: Optional[Dict[str, str]] = None,
 ):
-    """Upload entire index directory to S3."""
+    """Upload entire index directory to S3, followed by its manifest."""
     s3_path = get_s3_index_path(user_id, project_id)
+    storage = get_storage()
+    rel_paths = []
     for root, _, files in os.walk(local_path):
         for file in files:
             local_file = os.path.join(root, file)
-            s3_key = os.path.join(s3_path, os.path.relpath(local_file, local_path))
-            s3_client.upload_file(local_file, bucket, s3_key)
+            rel_paths.append(os.path.relpath(local_file, local_path))
+    await asyncio.gather(
+        *[
+            storage.upload_file(
+                os.path.join(local_path, rel_path), bucket, s3_path + rel_path
+            )
+            for rel_path in rel_paths
+        ]
+    )
+
+    # Written last so a partially uploaded index is never picked up
+    await storage.write(
+        bucket,
+        s3_path + INDEX_MANIFEST,
+        json.dumps({"files": rel_paths, "sources": sources or {}}).encode(),
+        content_type="application/json",
+    )
 
 
 def parse_excel_file(file_bytes: bytes, file_name: str) -> List[Document]:
@@ -145,24 +183,44 @@ def parse_excel_file(file_bytes: bytes, file_name: str) -> List[Document]:
     return documents
 
 
-def build_or_load_excel_index(
+def _build_index(all_docs: List[Document], storage_context, persist_dir: str):
+    node_parser = JSONNodeParser()
+    nodes = node_parser.get_nodes_from_documents(all_docs)
+    embedding_model = OpenAIEmbedding(model="text-embedding-3-small")
+    index = VectorStoreIndex(
+        nodes=nodes, storage_context=storage_context, embed_model=embedding_model
+    )
+    # Persist index locally.
+    index.storage_context.persist(persist_dir=persist_dir)
+    return index
+
+
+async def build_or_load_excel_index(
     user_id: str, project_id: str
 ) -> Optional[VectorStoreIndex]:
-    excel_files = list_s3_excel_files(user_id, project_id, bucket=FILE_BUCKET)
+    excel_files = await list_s3_excel_files(user_id, project_id, FILE_BUCKET)
     if not excel_files:
         return None
+    sources = source_signature(excel_files)
 
     with tempfile.TemporaryDirectory() as temp_dir:
         persist_dir = Path(temp_dir) / "excel_index"
         storage_context = StorageContext.from_defaults()
 
         # Try loading the index from the index bucket.
-        if download_index_from_s3(
-            str(persist_dir), user_id, project_id, bucket=INDEX_BUCKET
+        if await download_index_from_s3(
+            str(persist_dir),
+            user_id,
+            project_id,
+            bucket=INDEX_BUCKET,
+            expected_sources=sources,
         ):
             try:
-                index = load_index_from_storage(
-                    storage_context, persist_dir=str(persist_dir)
+                index = await run_in(
+                    "cpu",
+                    load_index_from_storage,
+                    storage_context,
+                    persist_dir=str(persist_dir),
                 )
                 print("[DEBUG] Loaded existing Excel index from S3")
                 return index
@@ -171,35 +229,37 @@ def build_or_load_excel_index(
 
         # Build a new index if not found.
         print("[DEBUG] Building new Excel index")
-        all_docs = []
-        for file_info in excel_files:
+
+        async def _parse(file_info: Dict[str, Any]) -> List[Document]:
             try:
-                obj = s3_client.get_object(
-                    Bucket=FILE_BUCKET, Key=file_info["file_path"]
+                file_bytes = await get_storage().read(
+                    FILE_BUCKET, file_info["file_path"]
+                )
+                return await run_in(
+                    "cpu", parse_excel_file, file_bytes, file_info["file_name"]
                 )
-                file_bytes = obj["Body"].read()
-                docs = parse_excel_file(file_bytes, file_info["file_name"])
-                all_docs.extend(docs)
             except Exception as e:
                 print(f"[ERROR] Failed to process {file_info['file_name']}: {str(e)}")
+                return []
+
+        parsed = await asyncio.gather(*[_parse(f) for f in excel_files])
+        all_docs = [doc for docs in parsed for doc in docs]
 
         if not all_docs:
             return None
 
-        node_parser = JSONNodeParser()
-        nodes = node_parser.get_nodes_from_documents(all_docs)
-        embedding_model = OpenAIEmbedding(model="text-embedding-3-small")
-        index = VectorStoreIndex(
-            nodes=nodes, storage_context=storage_context, embed_model=embedding_model
+        index = await run_in(
+            "cpu", _build_index, all_docs, storage_context, str(persist_dir)
         )
 
-        # Persist index locally.
-        index.storage_context.persist(persist_dir=str(persist_dir))
-
         # Upload the index to the INDEX_BUCKET.
         try:
-            upload_index_to_s3(
-                str(persist_dir), user_id, project_id, bucket=INDEX_BUCKET
+            await upload_index_to_s3(
+                str(persist_dir),
+                user_id,
+                project_id,
+                bucket=INDEX_BUCKET,
+                sources=sources,
             )
             print("[DEBUG] Uploaded new Excel index to S3")
         except Exception as e:
@@ -208,7 +268,16 @@ def build_or_load_excel_index(
         return index
 
 
-def extract_excel_index(user_id: str, project_id: str) -> Optional[VectorStoreIndex]:
+def _load_persisted_index(persist_dir: str) -> VectorStoreIndex:
+    # Load the storage context from the persisted directory
+    storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
+    # Now load the index using the storage context
+    return load_index_from_storage(storage_context)
+
+
+async def extract_excel_index(
+    user_id: str, project_id: str
+) -> Optional[VectorStoreIndex]:
     """
     Downloads an existing Excel index from the index bucket into a temporary directory
     and returns the loaded VectorStoreIndex object. Returns None if no index is found.
@@ -216,18 +285,18 @@ def extract_excel_index(user_id: str, project_id: str) -> Optional[VectorStoreIn
     with tempfile.TemporaryDirectory() as temp_dir:
         persist_dir = Path(temp_dir) / "excel_index"
         os.makedirs(persist_dir, exist_ok=True)
-
-        if download_index_from_s3(
-            str(persist_dir), user_id, project_id, bucket=INDEX_BUCKET
+        excel_files = await list_s3_excel_files(user_id, project_id)
+        sources = source_signature(excel_files)
+
+        if await download_index_from_s3(
+            str(persist_dir),
+            user_id,
+            project_id,
+            bucket=INDEX_BUCKET,
+            expected_sources=sources,
         ):
             try:
-                # Load the storage context from the persisted directory
-                storage_context = StorageContext.from_defaults(
-                    persist_dir=str(persist_dir)
-                )
-
-                # Now load the index using the storage context
-                index = load_index_from_storage(storage_context)
+                index = await run_in("cpu", _load_persisted_index, str(persist_dir))
                 print(
                     f"[DEBUG] Successfully loaded Excel index with {len(index.docstore.docs)} documents"
                 )
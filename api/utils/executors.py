@@ -0,0 +1,192 @@
+"""Named thread pools for blocking work, one per workload class.
+
+``asyncio.to_thread`` puts every blocking call on the loop's single default
+executor, so a burst of slow calls (e.g. throttled Bedrock requests) holds
+up unrelated quick ones. Work is routed instead to a pool sized for its
+class:
+
+- ``llm``: model invocations (Bedrock, OpenAI, OpenRouter)
+- ``search``: knowledge-base retrieval and ingestion jobs, web search, Excel
+  query engines
+- ``storage``: S3 transfers and metadata calls
+- ``cpu``: parsing and hashing
+
+CPU-bound pure-Python work that would hold the GIL (PDF page extraction)
+goes to a separate process pool through ``run_in_process``. Small database
+bookkeeping calls stay on the default executor.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import functools
+import contextvars
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from utils.metrics import register_metrics_source
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_SIZES = {
+    "llm": int(os.getenv("LLM_EXECUTOR_WORKERS", "16")),
+    "search": int(os.getenv("SEARCH_EXECUTOR_WORKERS", "16")),
+    "storage": int(os.getenv("STORAGE_EXECUTOR_WORKERS", "32")),
+    "cpu": int(os.getenv("CPU_EXECUTOR_WORKERS", str(os.cpu_count() or 2))),
+}
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", str(max(1, (os.cpu_count() or 2) - 1))))
+
+
+class WorkloadExecutor:
+    """Bounded thread pool that records queue depth and wait times."""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"{name}-worker"
+        )
+        self._lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "queued": 0,
+            "running": 0,
+            "peak_queued": 0,
+            "wait_seconds": 0.0,
+            "run_seconds": 0.0,
+        }
+
+    def _wrap(self, fn: Callable, enqueued_at: float) -> Callable:
+        def call():
+            started = time.monotonic()
+            with self._lock:
+                self._stats["queued"] -= 1
+                self._stats["running"] += 1
+                self._stats["wait_seconds"] += started - enqueued_at
+            ok = False
+            try:
+                result = fn()
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self._stats["running"] -= 1
+                    self._stats["completed" if ok else "failed"] += 1
+                    self._stats["run_seconds"] += time.monotonic() - started
+
+        return call
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run ``fn(*args, **kwargs)`` on this pool, like ``asyncio.to_thread``
+        (context variables are carried over). Cancelling the caller drops the
+        call if it has not started yet."""
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        call = functools.partial(ctx.run, fn, *args, **kwargs)
+        with self._lock:
+            self._stats["submitted"] += 1
+            self._stats["queued"] += 1
+            self._stats["peak_queued"] = max(
+                self._stats["peak_queued"], self._stats["queued"]
+            )
+        future = self._pool.submit(self._wrap(call, time.monotonic()))
+        try:
+            return await asyncio.wrap_future(future, loop=loop)
+        except asyncio.CancelledError:
+            # A call still in the queue is dropped; one already running
+            # finishes on its thread
+            if future.cancel():
+                with self._lock:
+                    self._stats["queued"] -= 1
+                    self._stats["cancelled"] += 1
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            done = self._stats["completed"] + self._stats["failed"]
+            return {
+                **self._stats,
+                "max_workers": self.max_workers,
+                "avg_wait_seconds": (
+                    round(self._stats["wait_seconds"] / done, 4) if done else 0.0
+                ),
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+executors: Dict[str, WorkloadExecutor] = {
+    name: WorkloadExecutor(name, size) for name, size in EXECUTOR_SIZES.items()
+}
+
+
+async def run_in(pool: str, fn: Callable, *args, **kwargs) -> Any:
+    """Run a blocking callable on the named pool (``llm``, ``search``,
+    ``storage`` or ``cpu``)."""
+    return await executors[pool].run(fn, *args, **kwargs)
+
+
+# ------------------------------------------------------------------------
+# PROCESS POOL
+# ------------------------------------------------------------------------
+_process_pool: ProcessPoolExecutor = None
+_process_lock = threading.Lock()
+_process_stats = {"submitted": 0, "in_flight": 0, "peak_in_flight": 0, "failed": 0}
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    # Created on first use; spawned (not forked) so workers never inherit the
+    # server's threads, event loop or open connections
+    global _process_pool
+    with _process_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PARSE_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+async def run_in_process(fn: Callable, *args) -> Any:
+    """Run a picklable module-level function in the parsing process pool."""
+    loop = asyncio.get_running_loop()
+    pool = _get_process_pool()
+    with _process_lock:
+        _process_stats["submitted"] += 1
+        _process_stats["in_flight"] += 1
+        _process_stats["peak_in_flight"] = max(
+            _process_stats["peak_in_flight"], _process_stats["in_flight"]
+        )
+    try:
+        return await loop.run_in_executor(pool, functools.partial(fn, *args))
+    except Exception:
+        with _process_lock:
+            _process_stats["failed"] += 1
+        raise
+    finally:
+        with _process_lock:
+            _process_stats["in_flight"] -= 1
+
+
+def shutdown_executors() -> None:
+    for executor in executors.values():
+        executor.shutdown()
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _executor_metrics() -> Dict[str, Any]:
+    snapshot = {name: ex.stats() for name, ex in executors.items()}
+    with _process_lock:
+        snapshot["parse_processes"] = {**_process_stats, "max_workers": PARSE_PROCESSES}
+    return snapshot
+
+
+register_metrics_source("executors", _executor_metrics)
@@ -0,0 +1,134 @@
+"""Process-wide registry of compiled LangGraph graphs.
+
+Compiling a ``StateGraph`` validates the whole topology and builds its
+channels, which is wasted work when it happens on every request. Graph
+modules register a builder under a name; the registry compiles each graph
+once (eagerly through ``warm()`` at startup, otherwise on first use) and
+hands the same compiled graph to every request.
+
+A name can have several variants, e.g. a graph built for another model or
+configuration. ``activate`` compiles the variant if needed and then points
+the name at it, so requests switch over without compiling anything
+themselves and runs already in progress finish on the graph they started
+with.
+"""
+
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from utils.metrics import register_metrics_source
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VARIANT = "default"
+
+
+class GraphRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._builders: Dict[Tuple[str, str], Callable[[], Any]] = {}
+        self._compiled: Dict[Tuple[str, str], Any] = {}
+        self._active: Dict[str, str] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def _graph_stats(self, name: str) -> Dict[str, Any]:
+        return self._stats.setdefault(
+            name,
+            {
+                "compiles": 0,
+                "compile_seconds": 0.0,
+                "requests": 0,
+                "lookup_seconds": 0.0,
+                "swaps": 0,
+            },
+        )
+
+    def register(
+        self, name: str, builder: Callable[[], Any], variant: str = DEFAULT_VARIANT
+    ) -> None:
+        """Register a builder returning a compiled graph. Re-registering a
+        variant discards its compiled graph."""
+        with self._lock:
+            self._builders[(name, variant)] = builder
+            self._compiled.pop((name, variant), None)
+            self._active.setdefault(name, variant)
+            self._graph_stats(name)
+
+    def _compile(self, name: str, variant: str) -> Any:
+        # Called with the lock held, so a graph is only ever compiled once
+        key = (name, variant)
+        graph = self._compiled.get(key)
+        if graph is not None:
+            return graph
+        builder = self._builders.get(key)
+        if builder is None:
+            raise KeyError(f"No graph registered as {name!r} ({variant})")
+        started = time.perf_counter()
+        graph = builder()
+        elapsed = time.perf_counter() - started
+        self._compiled[key] = graph
+        stats = self._graph_stats(name)
+        stats["compiles"] += 1
+        stats["compile_seconds"] += elapsed
+        logger.info("Compiled graph %s (%s) in %.3fs", name, variant, elapsed)
+        return graph
+
+    def get(self, name: str, variant: Optional[str] = None) -> Any:
+        """The compiled graph for ``name`` (its active variant by default)."""
+        started = time.perf_counter()
+        with self._lock:
+            graph = self._compile(name, variant or self._active.get(name, DEFAULT_VARIANT))
+            stats = self._graph_stats(name)
+            stats["requests"] += 1
+            stats["lookup_seconds"] += time.perf_counter() - started
+        return graph
+
+    def activate(self, name: str, variant: str) -> None:
+        """Hot-swap ``name`` to another registered variant."""
+        with self._lock:
+            self._compile(name, variant)
+            if self._active.get(name) != variant:
+                self._active[name] = variant
+                self._graph_stats(name)["swaps"] += 1
+        logger.info("Graph %s now serving variant %s", name, variant)
+
+    def replace(self, name: str, graph: Any, variant: str = DEFAULT_VARIANT) -> None:
+        """Install an already compiled graph as ``variant`` of ``name``."""
+        with self._lock:
+            self._compiled[(name, variant)] = graph
+            self._builders.setdefault((name, variant), lambda: graph)
+            self._active.setdefault(name, variant)
+            self._graph_stats(name)
+
+    def warm(self) -> None:
+        """Compile every registered graph that is not compiled yet."""
+        with self._lock:
+            keys = list(self._builders)
+        for name, variant in keys:
+            try:
+                with self._lock:
+                    self._compile(name, variant)
+            except Exception:
+                logger.exception("Failed to compile graph %s (%s)", name, variant)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = {}
+            for name, stats in self._stats.items():
+                requests = stats["requests"]
+                snapshot[name] = {
+                    **stats,
+                    "active_variant": self._active.get(name),
+                    "variants": sorted(v for n, v in self._builders if n == name),
+                    "avg_lookup_seconds": (
+                        round(stats["lookup_seconds"] / requests, 6) if requests else 0.0
+                    ),
+                }
+            return snapshot
+
+
+graph_registry = GraphRegistry()
+
+register_metrics_source("graphs", graph_registry.stats)
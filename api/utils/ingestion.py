@@ -0,0 +1,363 @@
+"""Knowledge-base ingestion coordinator.
+
+Bedrock ingestion jobs always sync the whole data source, so starting one
+per uploaded file only means stopping the job started a moment earlier.
+The coordinator instead collects documents from every upload, waits for a
+quiet period, and starts a single job for the whole batch. Only one job
+runs at a time; documents arriving while it runs go into the next batch.
+
+The pending batch lives in memory, so on startup ``recover`` re-schedules
+catalog rows a previous process left pending and watches the jobs it had
+started.
+
+The status tracker polls running jobs in the background (with backoff),
+records the outcome in the catalog and keeps per-project readiness, so the
+research pipelines can wait for a project's files to become searchable.
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import botocore
+from dotenv import load_dotenv, find_dotenv
+from utils.aws_utils import AwsUtlis
+from utils.executors import run_in
+from utils.retrieval_cache import retrieval_cache
+from utils.document_catalog import (
+    list_project_documents,
+    list_unfinished_documents,
+    mark_documents_indexed,
+    project_index_version,
+    set_ingestion_status,
+)
+from db_models.documents import IngestionStatus
+
+env_path = find_dotenv()  # walks up until it finds .env
+loaded = load_dotenv(env_path)
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_BASE_ID = os.getenv("KNOWLEDGE_BASE_ID")
+DATA_SOURCE_ID = os.getenv("DATA_SOURCE_ID")
+
+# Quiet period after the last upload before a job is started
+INGESTION_DEBOUNCE_SECONDS = float(os.getenv("INGESTION_DEBOUNCE_SECONDS", "5"))
+# Upper bound on how long a continuous burst of uploads can postpone a job
+INGESTION_MAX_DELAY_SECONDS = float(os.getenv("INGESTION_MAX_DELAY_SECONDS", "30"))
+INGESTION_POLL_SECONDS = float(os.getenv("INGESTION_POLL_SECONDS", "2"))
+INGESTION_MAX_POLL_SECONDS = float(os.getenv("INGESTION_MAX_POLL_SECONDS", "30"))
+# Consecutive failed status lookups (throttling, network) before a job is
+# given up on
+INGESTION_POLL_MAX_ERRORS = int(os.getenv("INGESTION_POLL_MAX_ERRORS", "5"))
+
+RUNNING_STATUSES = {"STARTING", "IN_PROGRESS", "STOPPING"}
+
+
+ProjectKey = Tuple[str, str]  # (user_id, project_id)
+
+
+class IngestionStatusTracker:
+    """Follows ingestion jobs to completion and answers "are this project's
+    files searchable yet?"."""
+
+    def __init__(
+        self,
+        poll_seconds: float = INGESTION_POLL_SECONDS,
+        max_poll_seconds: float = INGESTION_MAX_POLL_SECONDS,
+    ):
+        self.poll_seconds = poll_seconds
+        self.max_poll_seconds = max_poll_seconds
+        self.jobs: Dict[str, dict] = {}
+        self._watchers: Dict[str, asyncio.Task] = {}
+        self._ready: Dict[ProjectKey, bool] = {}
+        self._changed: Dict[ProjectKey, asyncio.Event] = {}
+
+    # ---- jobs ----
+    def watch(self, job_id: str, documents: Dict[str, ProjectKey]) -> asyncio.Task:
+        """Poll ``job_id`` in the background and record its outcome."""
+        job = self.jobs.setdefault(
+            job_id, {"status": "STARTING", "documents": {}, "started_at": time.time()}
+        )
+        job["documents"].update(documents)
+        for owner in documents.values():
+            self._set_ready(owner, False)
+        if job_id not in self._watchers:
+            self._watchers[job_id] = asyncio.create_task(self._complete_job(job_id))
+        return self._watchers[job_id]
+
+    async def wait_for_job(self, job_id: str) -> str:
+        """Wait until ``job_id`` leaves the running states and return its status."""
+        task = self._watchers.get(job_id) or self.watch(job_id, {})
+        return await asyncio.shield(task)
+
+    async def _complete_job(self, job_id: str) -> str:
+        try:
+            status = await self._poll_job(job_id)
+            job = self.jobs[job_id]
+            job["status"] = status
+            job["finished_at"] = time.time()
+
+            batch = job["documents"]
+            if status != "COMPLETE":
+                if batch:
+                    logger.error("Ingestion job %s ended with status %s", job_id, status)
+                await asyncio.to_thread(
+                    set_ingestion_status, list(batch), IngestionStatus.failed
+                )
+            else:
+                by_project: Dict[ProjectKey, List[str]] = {}
+                for doc_id, owner in batch.items():
+                    by_project.setdefault(owner, []).append(doc_id)
+                for (user_id, project_id), doc_ids in by_project.items():
+                    version = await asyncio.to_thread(
+                        project_index_version, user_id, project_id
+                    )
+                    await asyncio.to_thread(mark_documents_indexed, doc_ids, version + 1)
+                    retrieval_cache.invalidate_project(user_id, project_id, version + 1)
+
+            for owner in set(batch.values()):
+                await self.refresh_project(*owner)
+            return status
+        finally:
+            self._watchers.pop(job_id, None)
+
+    async def _poll_job(self, job_id: str) -> str:
+        delay = self.poll_seconds
+        errors = 0
+        while True:
+            try:
+                resp = await run_in(
+                    "search",
+                    AwsUtlis.get_bedrock_agent().get_ingestion_job,
+                    knowledgeBaseId=KNOWLEDGE_BASE_ID,
+                    dataSourceId=DATA_SOURCE_ID,
+                    ingestionJobId=job_id,
+                )
+                status = resp["ingestionJob"]["status"]
+            except (
+                botocore.exceptions.ClientError,
+                botocore.exceptions.BotoCoreError,
+            ) as e:
+                # Throttling and connection errors say nothing about the job
+                errors += 1
+                if errors >= INGESTION_POLL_MAX_ERRORS:
+                    logger.error(
+                        "Giving up on ingestion job %s after %d errors: %s",
+                        job_id,
+                        errors,
+                        e,
+                    )
+                    return "UNKNOWN"
+                logger.warning("Could not fetch ingestion job %s: %s", job_id, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_poll_seconds)
+                continue
+            errors = 0
+            self.jobs[job_id]["status"] = status
+            if status not in RUNNING_STATUSES:
+                return status
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_seconds)
+
+    # ---- projects ----
+    def _set_ready(self, owner: ProjectKey, ready: bool) -> None:
+        self._ready[owner] = ready
+        event = self._changed.pop(owner, None)
+        if event is not None:
+            event.set()
+
+    def mark_pending(self, user_id: str, project_id: str) -> None:
+        self._set_ready((str(user_id), str(project_id)), False)
+
+    def readiness(self, user_id: str, project_id: str) -> Optional[bool]:
+        """Last known readiness (None if the project was never checked)."""
+        return self._ready.get((str(user_id), str(project_id)))
+
+    async def refresh_project(self, user_id: str, project_id: str) -> bool:
+        """Re-read the project's ingestion state from the catalog.
+
+        Jobs recorded by another process (or before a restart) are picked up
+        and watched from here.
+        """
+        owner = (str(user_id), str(project_id))
+        docs = await asyncio.to_thread(list_project_documents, *owner)
+        waiting = [
+            d
+            for d in docs
+            if d["ingestion_status"]
+            in (IngestionStatus.pending.value, IngestionStatus.ingesting.value)
+        ]
+        for doc in waiting:
+            job_id = doc.get("ingestion_job_id")
+            if job_id and job_id not in self._watchers:
+                self.watch(job_id, {doc["id"]: owner})
+        ready = not waiting
+        self._set_ready(owner, ready)
+        return ready
+
+    async def wait_until_ready(
+        self, user_id: str, project_id: str, timeout: float
+    ) -> bool:
+        """Wait up to ``timeout`` seconds for every project document to be
+        ingested. Returns False if some are still pending when time runs out."""
+        owner = (str(user_id), str(project_id))
+        deadline = time.monotonic() + timeout
+        delay = self.poll_seconds
+        while True:
+            if await self.refresh_project(*owner):
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            event = self._changed.setdefault(owner, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), min(delay, remaining))
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, self.max_poll_seconds)
+
+
+ingestion_tracker = IngestionStatusTracker()
+
+
+class IngestionCoordinator:
+    """Batches catalog documents into as few ingestion jobs as possible."""
+
+    def __init__(
+        self,
+        debounce_seconds: float = INGESTION_DEBOUNCE_SECONDS,
+        max_delay_seconds: float = INGESTION_MAX_DELAY_SECONDS,
+    ):
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        # document id -> (user_id, project_id)
+        self._pending: Dict[str, Tuple[str, str]] = {}
+        self._first_pending_at: Optional[float] = None
+        self._last_pending_at: Optional[float] = None
+        self._runner: Optional[asyncio.Task] = None
+        self.active_job_id: Optional[str] = None
+
+    def schedule(self, document_ids: List[str], user_id: str, project_id: str) -> None:
+        """Queue documents for the next ingestion job. Must be called on the event loop."""
+        if not document_ids:
+            return
+        now = time.monotonic()
+        for doc_id in document_ids:
+            self._pending[str(doc_id)] = (str(user_id), str(project_id))
+        ingestion_tracker.mark_pending(user_id, project_id)
+        self._first_pending_at = self._first_pending_at or now
+        self._last_pending_at = now
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    async def recover(self) -> None:
+        """Pick up documents left unfinished by a previous process.
+
+        Documents whose job was started are watched until it ends; the
+        rest were only in the lost in-memory batch and are scheduled again.
+        """
+        docs = await asyncio.to_thread(list_unfinished_documents)
+        by_project: Dict[ProjectKey, List[str]] = {}
+        for doc in docs:
+            owner = (doc["user_id"], doc["project_id"])
+            if not all(owner):
+                continue
+            job_id = doc.get("ingestion_job_id")
+            if doc["ingestion_status"] == IngestionStatus.ingesting.value and job_id:
+                ingestion_tracker.watch(job_id, {doc["id"]: owner})
+            else:
+                by_project.setdefault(owner, []).append(doc["id"])
+        for (user_id, project_id), doc_ids in by_project.items():
+            self.schedule(doc_ids, user_id, project_id)
+        if docs:
+            logger.info("Recovered %d documents awaiting ingestion", len(docs))
+
+    async def _run(self) -> None:
+        while self._pending:
+            await self._wait_for_quiet_period()
+            if self.active_job_id:
+                try:
+                    await ingestion_tracker.wait_for_job(self.active_job_id)
+                except Exception as e:
+                    # The next job is started regardless; the pending batch stays
+                    logger.error(
+                        "Waiting for ingestion job %s failed: %s", self.active_job_id, e
+                    )
+                self.active_job_id = None
+            batch, self._pending = self._pending, {}
+            self._first_pending_at = self._last_pending_at = None
+            try:
+                await self._start_job(batch)
+            except Exception as e:
+                logger.error("Failed to start ingestion job: %s", e, exc_info=True)
+                await asyncio.to_thread(
+                    set_ingestion_status, list(batch), IngestionStatus.failed
+                )
+
+    async def _wait_for_quiet_period(self) -> None:
+        while True:
+            now = time.monotonic()
+            quiet_at = self._last_pending_at + self.debounce_seconds
+            deadline = self._first_pending_at + self.max_delay_seconds
+            wake_at = min(quiet_at, deadline)
+            if now >= wake_at:
+                return
+            await asyncio.sleep(wake_at - now)
+
+    async def _start_job(self, batch: Dict[str, Tuple[str, str]]) -> None:
+        for attempt in range(1, 4):
+            try:
+                resp = await run_in(
+                    "search",
+                    AwsUtlis.get_bedrock_agent().start_ingestion_job,
+                    knowledgeBaseId=KNOWLEDGE_BASE_ID,
+                    dataSourceId=DATA_SOURCE_ID,
+                    clientToken=str(uuid.uuid4()),
+                    description=f"ingesting {len(batch)} uploaded documents",
+                )
+                break
+            except botocore.exceptions.ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                if code == "ConflictException":
+                    # Started by another worker process; let it finish first
+                    running = await run_in("search", self._find_running_job)
+                    if running:
+                        await ingestion_tracker.wait_for_job(running)
+                        continue
+                if attempt == 3:
+                    raise
+                logger.warning("Ingestion job attempt %d failed: %s", attempt, e)
+                await asyncio.sleep(2**attempt)
+        else:
+            raise RuntimeError("Ingestion job could not be started after retries")
+
+        job_id = resp["ingestionJob"]["ingestionJobId"]
+        self.active_job_id = job_id
+        logger.debug("Started ingestion job %s for %d documents", job_id, len(batch))
+        await asyncio.to_thread(
+            set_ingestion_status, list(batch), IngestionStatus.ingesting, job_id
+        )
+        ingestion_tracker.watch(job_id, batch)
+
+    def _find_running_job(self) -> Optional[str]:
+        resp = AwsUtlis.get_bedrock_agent().list_ingestion_jobs(
+            knowledgeBaseId=KNOWLEDGE_BASE_ID,
+            dataSourceId=DATA_SOURCE_ID,
+            filters=[
+                {
+                    "attribute": "STATUS",
+                    "operator": "EQ",
+                    "values": ["STARTING", "IN_PROGRESS"],
+                }
+            ],
+            maxResults=1,
+        )
+        summaries = resp.get("ingestionJobSummaries", [])
+        return summaries[0]["ingestionJobId"] if summaries else None
+
+
+ingestion_coordinator = IngestionCoordinator()
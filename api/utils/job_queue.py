@@ -0,0 +1,355 @@
+"""Durable background job queue backed by ``jobs_table``.
+
+Request handlers enqueue long-running work (report generation, Excel
+indexing) and return straight away; a pool of in-process workers claims
+queued rows, runs the registered handler and stores the result. Because the
+queue lives in the database, queued jobs survive restarts and jobs held by a
+worker that died are picked up again once their heartbeat goes stale.
+
+Handlers report progress with ``report_progress`` from anywhere inside the
+job (including graph nodes), without having the job object passed down.
+"""
+
+import os
+import uuid
+import asyncio
+import logging
+import contextvars
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from db.db_session import SessionLocal
+from db_models.jobs import JobTable, JobStatus
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "5"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+
+JobHandler = Callable[[Dict[str, Any], "JobContext"], Awaitable[Any]]
+_handlers: Dict[str, JobHandler] = {}
+
+_current_job: contextvars.ContextVar[Optional["JobContext"]] = contextvars.ContextVar(
+    "current_job", default=None
+)
+
+
+class JobContext:
+    """Progress holder for the job a worker is running."""
+
+    def __init__(self, job_id: str, user_id: Optional[str]):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.progress = 0
+        self.message: Optional[str] = None
+
+    def set_progress(self, percent: float, message: Optional[str] = None) -> None:
+        self.progress = max(self.progress, min(100, int(percent)))
+        if message is not None:
+            self.message = message
+
+
+def report_progress(percent: float, message: Optional[str] = None) -> None:
+    """Record progress for the current job; a no-op outside of a job."""
+    ctx = _current_job.get()
+    if ctx is not None:
+        ctx.set_progress(percent, message)
+
+
+def register_job_handler(kind: str):
+    """Decorator registering ``async def handler(payload, ctx)`` for ``kind``."""
+
+    def decorator(fn: JobHandler) -> JobHandler:
+        _handlers[kind] = fn
+        return fn
+
+    return decorator
+
+
+def enqueue_job(
+    db: Session,
+    kind: str,
+    payload: Dict[str, Any],
+    user_id: Optional[str] = None,
+    dedupe_key: Optional[str] = None,
+) -> JobTable:
+    if kind not in _handlers:
+        raise ValueError(f"No handler registered for job kind: {kind}")
+    job = JobTable(user_id=user_id, kind=kind, payload=payload, dedupe_key=dedupe_key)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    job_worker_pool.notify()
+    return job
+
+
+def find_job(
+    db: Session,
+    kind: str,
+    dedupe_key: str,
+    user_id: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+) -> Optional[JobTable]:
+    """Latest job of ``kind`` enqueued with ``dedupe_key`` that is still
+    queued or running, or with ``created_after``, any job created since then
+    that has not failed."""
+    query = db.query(JobTable).filter(
+        JobTable.kind == kind, JobTable.dedupe_key == dedupe_key
+    )
+    if user_id is not None:
+        query = query.filter(JobTable.user_id == user_id)
+    if created_after is None:
+        query = query.filter(
+            JobTable.status.in_([JobStatus.queued, JobStatus.running])
+        )
+    else:
+        query = query.filter(
+            JobTable.status != JobStatus.failed, JobTable.created_at >= created_after
+        )
+    return query.order_by(JobTable.created_at.desc()).first()
+
+
+def count_active_jobs(db: Session, kind: str, user_id: str) -> int:
+    """Jobs of ``kind`` that ``user_id`` has queued or running."""
+    return (
+        db.query(JobTable)
+        .filter(
+            JobTable.kind == kind,
+            JobTable.user_id == user_id,
+            JobTable.status.in_([JobStatus.queued, JobStatus.running]),
+        )
+        .count()
+    )
+
+
+def job_to_dict(job: JobTable, include_result: bool = False) -> Dict[str, Any]:
+    data = {
+        "id": str(job.id),
+        "kind": job.kind,
+        "status": job.status.value,
+        "progress": job.progress,
+        "message": job.message,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if include_result:
+        data["result"] = job.result
+    return data
+
+
+# ------------------------------------------------------------------------
+# DB helpers (blocking; run off the event loop)
+# ------------------------------------------------------------------------
+def _claim_next_job() -> Optional[tuple]:
+    """Atomically move the oldest runnable job to ``running``."""
+    db = SessionLocal()
+    try:
+        stale_before = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        candidates = (
+            db.query(JobTable.id)
+            .filter(
+                or_(
+                    JobTable.status == JobStatus.queued,
+                    (JobTable.status == JobStatus.running)
+                    & (JobTable.heartbeat_at < stale_before),
+                ),
+                JobTable.attempts < JOB_MAX_ATTEMPTS,
+            )
+            .order_by(JobTable.created_at)
+            .limit(5)
+            .all()
+        )
+        for (job_id,) in candidates:
+            now = datetime.utcnow()
+            # Only one worker can win the conditional update
+            claimed = (
+                db.query(JobTable)
+                .filter(
+                    JobTable.id == job_id,
+                    or_(
+                        JobTable.status == JobStatus.queued,
+                        (JobTable.status == JobStatus.running)
+                        & (JobTable.heartbeat_at < stale_before),
+                    ),
+                    JobTable.attempts < JOB_MAX_ATTEMPTS,
+                )
+                .update(
+                    {
+                        JobTable.status: JobStatus.running,
+                        JobTable.started_at: now,
+                        JobTable.heartbeat_at: now,
+                        JobTable.attempts: JobTable.attempts + 1,
+                    },
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            if claimed:
+                job = db.query(JobTable).filter(JobTable.id == job_id).first()
+                return (
+                    str(job.id),
+                    job.kind,
+                    job.payload or {},
+                    str(job.user_id) if job.user_id else None,
+                )
+        return None
+    finally:
+        db.close()
+
+
+def _fail_exhausted_jobs() -> None:
+    """Give up on stale running jobs that used all their attempts."""
+    db = SessionLocal()
+    try:
+        stale_before = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        db.query(JobTable).filter(
+            JobTable.status == JobStatus.running,
+            JobTable.heartbeat_at < stale_before,
+            JobTable.attempts >= JOB_MAX_ATTEMPTS,
+        ).update(
+            {
+                JobTable.status: JobStatus.failed,
+                JobTable.error: "Worker stopped before the job finished",
+                JobTable.finished_at: datetime.utcnow(),
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _update_job(job_id: str, **values) -> None:
+    db = SessionLocal()
+    try:
+        db.query(JobTable).filter(JobTable.id == uuid.UUID(job_id)).update(
+            {getattr(JobTable, k): v for k, v in values.items()},
+            synchronize_session=False,
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+# ------------------------------------------------------------------------
+# WORKER POOL
+# ------------------------------------------------------------------------
+class JobWorkerPool:
+    def __init__(self, size: int = JOB_WORKERS, poll_seconds: float = JOB_POLL_SECONDS):
+        self.size = size
+        self.poll_seconds = poll_seconds
+        self._workers: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.size)
+        ]
+        logger.info("Started %d job workers", self.size)
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def notify(self) -> None:
+        """Wake idle workers after a job was enqueued in this process; safe
+        to call from worker threads (``enqueue_job`` run off the loop)."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is None or running is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _worker(self, worker_idx: int) -> None:
+        while True:
+            try:
+                claimed = await asyncio.to_thread(_claim_next_job)
+            except Exception as e:
+                logger.error("Job worker %d failed to claim a job: %s", worker_idx, e)
+                claimed = None
+
+            if claimed is None:
+                if worker_idx == 0:
+                    try:
+                        await asyncio.to_thread(_fail_exhausted_jobs)
+                    except Exception as e:
+                        logger.error("Failing exhausted jobs failed: %s", e)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run_job(*claimed)
+
+    async def _run_job(
+        self, job_id: str, kind: str, payload: Dict[str, Any], user_id: Optional[str]
+    ) -> None:
+        ctx = JobContext(job_id, user_id)
+        token = _current_job.set(ctx)
+        heartbeat = asyncio.create_task(self._heartbeat(ctx))
+        logger.debug("Running job %s (%s)", job_id, kind)
+        try:
+            handler = _handlers.get(kind)
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind: {kind}")
+            result = await handler(payload, ctx)
+            heartbeat.cancel()
+            await asyncio.to_thread(
+                _update_job,
+                job_id,
+                status=JobStatus.succeeded,
+                progress=100,
+                message=ctx.message,
+                result=result,
+                finished_at=datetime.utcnow(),
+            )
+        except asyncio.CancelledError:
+            heartbeat.cancel()
+            raise
+        except Exception as e:
+            heartbeat.cancel()
+            logger.error("Job %s (%s) failed: %s", job_id, kind, e, exc_info=True)
+            await asyncio.to_thread(
+                _update_job,
+                job_id,
+                status=JobStatus.failed,
+                error=str(e),
+                finished_at=datetime.utcnow(),
+            )
+        finally:
+            _current_job.reset(token)
+
+    async def _heartbeat(self, ctx: JobContext) -> None:
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                await asyncio.to_thread(
+                    _update_job,
+                    ctx.job_id,
+                    progress=ctx.progress,
+                    message=ctx.message,
+                    heartbeat_at=datetime.utcnow(),
+                )
+            except Exception as e:
+                logger.warning("Heartbeat for job %s failed: %s", ctx.job_id, e)
+
+
+job_worker_pool = JobWorkerPool()
@@ -1,21 +1,19 @@
 import os
+import time
+import logging
+import threading
 import boto3
 import botocore
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, List, Tuple
 from dotenv import load_dotenv, find_dotenv
 from utils.aws_utils import AwsUtlis
+from utils.retrieval_cache import retrieval_cache
+from utils.metrics import register_metrics_source
 
 env_path = find_dotenv()  # walks up until it finds .env
 loaded = load_dotenv(env_path)
 
-# =============================================================================
-# ENV / AWS CONFIG
-# =============================================================================
-s3_client = AwsUtlis.get_s3_client()
-
-bedrock_client = AwsUtlis.get_bedrock_agent()
-
-bedrock_runtime = AwsUtlis.get_bedrock_agent_runtime()
+logger = logging.getLogger(__name__)
 
 # =============================================================================
 # BEDROCK / KB (Re-added as per original)
@@ -62,29 +60,124 @@ current time - $current_time$
 Answer:"""
 
 
-def get_presigned_url_from_source_uri(source_uri: str, expiration: int = 3600) -> str:
-    if not source_uri.startswith("s3://"):
-        return source_uri
-    without_prefix = source_uri.replace("s3://", "")
-    parts = without_prefix.split("/", 1)
+# =============================================================================
+# PRESIGNED URLS
+# =============================================================================
+# Citations store the s3:// source URI; links are signed when a report is read.
+PRESIGN_EXPIRY_SECONDS = int(os.getenv("PRESIGN_EXPIRY_SECONDS", "3600"))
+# A cached URL is reused only while it has at least this long left to live
+PRESIGN_MIN_REMAINING_SECONDS = int(os.getenv("PRESIGN_MIN_REMAINING_SECONDS", "600"))
+PRESIGN_CACHE_MAX_ENTRIES = int(os.getenv("PRESIGN_CACHE_MAX_ENTRIES", "5000"))
+
+_presign_cache: Dict[str, Tuple[str, float]] = {}  # uri -> (url, expires_at)
+_presign_lock = threading.Lock()
+_presign_stats = {"hits": 0, "signed": 0, "errors": 0}
+
+
+def _split_s3_uri(source_uri: str):
+    if not source_uri or not source_uri.startswith("s3://"):
+        return None
+    parts = source_uri[len("s3://") :].split("/", 1)
     if len(parts) != 2:
-        return source_uri
-    bucket, key = parts
-    try:
-        url = s3_client.generate_presigned_url(
-            "get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=expiration
-        )
-        return url
-    except Exception as e:
-        print(f"[DEBUG] Error generating presigned URL: {e}")
-        return source_uri
+        return None
+    return parts
 
 
-def query_kb(
-    input_text: str, kb_id: str, user_id: str, project_id: str, model_arn: str
+def presign_source_uris(source_uris: Iterable[str]) -> Dict[str, str]:
+    """Presigned GET URLs for a batch of s3:// URIs (each URI signed once).
+
+    Anything that is not an s3:// URI maps to itself.
+    """
+    now = time.time()
+    urls: Dict[str, str] = {}
+    to_sign = []
+    with _presign_lock:
+        for uri in dict.fromkeys(source_uris):
+            cached = _presign_cache.get(uri)
+            if cached and cached[1] - now > PRESIGN_MIN_REMAINING_SECONDS:
+                urls[uri] = cached[0]
+                _presign_stats["hits"] += 1
+            else:
+                to_sign.append(uri)
+
+    signed = {}
+    for uri in to_sign:
+        parts = _split_s3_uri(uri)
+        if parts is None:
+            urls[uri] = uri
+            continue
+        bucket, key = parts
+        try:
+            signed[uri] = AwsUtlis.get_s3_client().generate_presigned_url(
+                "get_object",
+                Params={"Bucket": bucket, "Key": key},
+                ExpiresIn=PRESIGN_EXPIRY_SECONDS,
+            )
+        except Exception as e:
+            logger.error("Error generating presigned URL: %s", e)
+            _presign_stats["errors"] += 1
+            urls[uri] = uri
+
+    with _presign_lock:
+        expires_at = now + PRESIGN_EXPIRY_SECONDS
+        for uri, url in signed.items():
+            _presign_cache[uri] = (url, expires_at)
+        _presign_stats["signed"] += len(signed)
+        if len(_presign_cache) > PRESIGN_CACHE_MAX_ENTRIES:
+            # Drop URLs that are no longer handed out, then the oldest ones
+            for uri in [
+                u
+                for u, (_, exp) in _presign_cache.items()
+                if exp - now <= PRESIGN_MIN_REMAINING_SECONDS
+            ]:
+                del _presign_cache[uri]
+            while len(_presign_cache) > PRESIGN_CACHE_MAX_ENTRIES:
+                del _presign_cache[next(iter(_presign_cache))]
+    urls.update(signed)
+    return urls
+
+
+def get_presigned_url_from_source_uri(source_uri: str) -> str:
+    return presign_source_uris([source_uri]).get(source_uri, source_uri)
+
+
+def presign_citations(citations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Copy of serialized citations with ``url`` set for every KB citation.
+
+    Older reports stored a (now expired) URL instead of ``source_uri``; those
+    entries are returned unchanged.
+    """
+    if not citations:
+        return citations or []
+    uris = [
+        c["source_uri"]
+        for c in citations
+        if isinstance(c, dict) and c.get("type") == "kb" and c.get("source_uri")
+    ]
+    if not uris:
+        return citations
+    urls = presign_source_uris(uris)
+    return [
+        {**c, "url": urls.get(c["source_uri"], c["source_uri"])}
+        if isinstance(c, dict) and c.get("type") == "kb" and c.get("source_uri")
+        else c
+        for c in citations
+    ]
+
+
+def _presign_metrics() -> Dict[str, Any]:
+    with _presign_lock:
+        return {**_presign_stats, "entries": len(_presign_cache)}
+
+
+register_metrics_source("presigned_urls", _presign_metrics)
+
+
+def build_vector_search_config(
+    user_id: str, project_id: str, number_of_results: int = 5
 ) -> Dict[str, Any]:
-    print(f"[DEBUG] query_kb with text={input_text}")
-    vector_search_config = {"numberOfResults": 5}
+    """Vector search settings restricted to the user's (and project's) documents."""
+    vector_search_config = {"numberOfResults": number_of_results}
     filters = []
     if user_id:
         filters.append({"equals": {"key": "user_id", "value": str(user_id)}})
@@ -95,8 +188,81 @@ def query_kb(
             vector_search_config["filter"] = filters[0]
         else:
             vector_search_config["filter"] = {"andAll": filters}
+    return vector_search_config
+
+
+def _retrieve(
+    input_text: str,
+    kb_id: str,
+    user_id: str,
+    project_id: str,
+    number_of_results: int,
+) -> List[Dict[str, Any]]:
+    resp = AwsUtlis.get_bedrock_agent_runtime().retrieve(
+        knowledgeBaseId=kb_id,
+        retrievalQuery={"text": input_text},
+        retrievalConfiguration={
+            "vectorSearchConfiguration": build_vector_search_config(
+                user_id, project_id, number_of_results
+            )
+        },
+    )
+    chunks = []
+    for result in resp.get("retrievalResults", []):
+        metadata = result.get("metadata", {}) or {}
+        source_uri = metadata.get("x-amz-bedrock-kb-source-uri") or (
+            result.get("location", {}).get("s3Location", {}).get("uri", "")
+        )
+        chunks.append(
+            {
+                "text": result.get("content", {}).get("text", ""),
+                "score": result.get("score"),
+                "source_uri": source_uri,
+                "file_name": os.path.basename(source_uri),
+                "page": metadata.get("x-amz-bedrock-kb-document-page-number"),
+                "metadata": metadata,
+            }
+        )
+    return chunks
+
+
+def retrieve_kb(
+    input_text: str,
+    kb_id: str,
+    user_id: str,
+    project_id: str,
+    number_of_results: int = 5,
+    use_cache: bool = True,
+) -> List[Dict[str, Any]]:
+    """Retrieve-only KB search: ranked chunks with metadata, no generation.
+
+    Callers feed the chunks into their own synthesis step, so a query costs a
+    vector lookup instead of a query-rewrite plus generation pass. Results
+    are cached per project until its next ingestion completes.
+    """
+    logger.debug("retrieve_kb with text=%s", input_text)
+
+    def fetch():
+        return _retrieve(input_text, kb_id, user_id, project_id, number_of_results)
+
+    try:
+        if not use_cache:
+            return fetch()
+        return retrieval_cache.get_or_fetch(
+            user_id, project_id, input_text, number_of_results, fetch
+        )
+    except botocore.exceptions.ClientError as e:
+        logger.error("retrieve_kb() client error: %s", e)
+        return []
+
+
+def query_kb(
+    input_text: str, kb_id: str, user_id: str, project_id: str, model_arn: str
+) -> Dict[str, Any]:
+    logger.debug("query_kb with text=%s", input_text)
+    vector_search_config = build_vector_search_config(user_id, project_id)
     try:
-        resp = bedrock_runtime.retrieve_and_generate(
+        resp = AwsUtlis.get_bedrock_agent_runtime().retrieve_and_generate(
             input={"text": input_text},
             retrieveAndGenerateConfiguration={
                 "knowledgeBaseConfiguration": {
@@ -119,5 +285,5 @@ def query_kb(
         )
         return resp
     except botocore.exceptions.ClientError as e:
-        print(f"[DEBUG] query_kb() client error: {e}")
+        logger.error("query_kb() client error: %s", e)
         return {}
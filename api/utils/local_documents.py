@@ -0,0 +1,113 @@
+"""Direct parsing of project documents that are not searchable in the KB yet.
+
+Used as a fallback while a project's ingestion job is still running: the
+not-yet-ingested files are downloaded, their text extracted locally and
+split into chunks, and queries are answered with a simple term-overlap
+ranking over those chunks.
+"""
+
+import io
+import os
+import re
+import asyncio
+import logging
+from typing import Any, Dict, List
+
+import fitz  # PyMuPDF
+from dotenv import load_dotenv, find_dotenv
+from utils.storage import get_storage
+from utils.executors import run_in
+from utils.document_catalog import list_project_documents
+from db_models.documents import IngestionStatus
+
+env_path = find_dotenv()  # walks up until it finds .env
+loaded = load_dotenv(env_path)
+
+logger = logging.getLogger(__name__)
+
+BUCKET_NAME = os.getenv("BUCKET_NAME", "deep-research-docs")
+CHUNK_CHARS = 1500
+TEXT_EXTENSIONS = (".txt", ".md", ".csv", ".json", ".html", ".htm")
+MAX_LOCAL_FILES = int(os.getenv("LOCAL_FALLBACK_MAX_FILES", "10"))
+
+_WORD_RE = re.compile(r"[a-z0-9]{3,}")
+
+
+def _chunk(text: str, file_name: str, source_uri: str, page=None) -> List[Dict[str, Any]]:
+    text = text.strip()
+    return [
+        {
+            "text": text[i : i + CHUNK_CHARS],
+            "file_name": file_name,
+            "source_uri": source_uri,
+            "page": page,
+        }
+        for i in range(0, len(text), CHUNK_CHARS)
+    ]
+
+
+def _extract_chunks(doc: Dict[str, Any], body: bytes) -> List[Dict[str, Any]]:
+    key = doc["file_path"]
+    source_uri = f"s3://{doc.get('bucket') or BUCKET_NAME}/{key}"
+    if key.lower().endswith(".pdf"):
+        chunks = []
+        with fitz.open(stream=io.BytesIO(body), filetype="pdf") as pdf:
+            for page_no, page in enumerate(pdf, start=1):
+                chunks.extend(_chunk(page.get_text(), doc["file_name"], source_uri, page_no))
+        return chunks
+    return _chunk(body.decode("utf-8", errors="ignore"), doc["file_name"], source_uri)
+
+
+async def _load_chunks(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if not doc["file_path"].lower().endswith((".pdf",) + TEXT_EXTENSIONS):
+        return []
+    body = await get_storage().read(doc.get("bucket") or BUCKET_NAME, doc["file_path"])
+    return await run_in("cpu", _extract_chunks, doc, body)
+
+
+async def load_unindexed_document_chunks(
+    user_id: str, project_id: str
+) -> List[Dict[str, Any]]:
+    """Text chunks for the project's files whose ingestion has not completed."""
+    docs = await asyncio.to_thread(
+        list_project_documents, user_id, project_id, BUCKET_NAME
+    )
+    waiting = [
+        d
+        for d in docs
+        if d["ingestion_status"] != IngestionStatus.ingested.value
+    ][:MAX_LOCAL_FILES]
+    if not waiting:
+        return []
+
+    results = await asyncio.gather(
+        *[_load_chunks(d) for d in waiting],
+        return_exceptions=True,
+    )
+    chunks: List[Dict[str, Any]] = []
+    for doc, res in zip(waiting, results):
+        if isinstance(res, Exception):
+            logger.error("Local parsing failed for %s: %s", doc["file_path"], res)
+            continue
+        chunks.extend(res)
+    logger.debug(
+        "Loaded %d local chunks from %d un-ingested files", len(chunks), len(waiting)
+    )
+    return chunks
+
+
+def search_local_chunks(
+    chunks: List[Dict[str, Any]], query: str, top_k: int = 5
+) -> List[Dict[str, Any]]:
+    """Rank chunks by how many distinct query terms they contain."""
+    terms = set(_WORD_RE.findall(query.lower()))
+    if not terms or not chunks:
+        return []
+    scored = []
+    for chunk in chunks:
+        words = set(_WORD_RE.findall(chunk["text"].lower()))
+        score = len(terms & words)
+        if score:
+            scored.append((score, chunk))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [c for _, c in scored[:top_k]]
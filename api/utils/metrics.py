@@ -0,0 +1,27 @@
+"""Process-wide registry of runtime statistics.
+
+Components (caches, pools, routers...) register a callable returning a
+JSON-serialisable dict; ``/api/metrics`` reports all of them together.
+"""
+
+import logging
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+_sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_metrics_source(name: str, fn: Callable[[], Dict[str, Any]]) -> None:
+    _sources[name] = fn
+
+
+def collect_metrics() -> Dict[str, Any]:
+    snapshot: Dict[str, Any] = {}
+    for name, fn in _sources.items():
+        try:
+            snapshot[name] = fn()
+        except Exception as e:
+            logger.warning("Metrics source %s failed: %s", name, e)
+            snapshot[name] = {"error": str(e)}
+    return snapshot
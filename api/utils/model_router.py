@@ -0,0 +1,266 @@
+"""Per-node model routing with latency budgets.
+
+Graph nodes ask the router for a model by node name instead of importing a
+fixed client. Each node has an ordered list of models and an optional p95
+latency budget; the first model whose recent p95 latency for that node is
+within budget is used, so a slow or degraded provider is skipped until its
+samples age out of the window. Latency, errors, token usage and the model
+chosen are recorded per node and model and exposed as the ``model_routes``
+metrics source.
+
+Routes are set in code next to the nodes and can be overridden with the
+``MODEL_ROUTES`` environment variable, e.g.::
+
+    {"researcher.write_section": {"models": ["claude-sonnet", "claude-haiku"],
+                                  "p95_budget_seconds": 45}}
+
+Models are registered with a factory and created on first use. All models
+of one route must take the same kind of messages (``"wrapper"`` for the
+Bedrock / OpenRouter wrappers, ``"langchain"`` for LangChain chat models).
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from utils.metrics import register_metrics_source
+from utils.admission import admission
+
+logger = logging.getLogger(__name__)
+
+# Latency samples older than this are ignored, so a skipped model is tried
+# again once its slow calls have aged out
+MODEL_LATENCY_WINDOW_SECONDS = float(os.getenv("MODEL_LATENCY_WINDOW_SECONDS", "300"))
+MODEL_LATENCY_MAX_SAMPLES = int(os.getenv("MODEL_LATENCY_MAX_SAMPLES", "100"))
+# Fewer samples than this never trigger a fallback
+MODEL_LATENCY_MIN_SAMPLES = int(os.getenv("MODEL_LATENCY_MIN_SAMPLES", "5"))
+
+
+def _load_overrides() -> Dict[str, Dict[str, Any]]:
+    raw = os.getenv("MODEL_ROUTES")
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.error("Ignoring invalid MODEL_ROUTES: %s", e)
+        return {}
+
+
+_active_route: contextvars.ContextVar[Optional["Route"]] = contextvars.ContextVar(
+    "active_route", default=None
+)
+
+
+def note_model_usage(input_tokens: int = 0, output_tokens: int = 0) -> None:
+    """Called by the wrappers with the usage of a response; attributed to
+    the route the call runs under, if any."""
+    route = _active_route.get()
+    if route is not None:
+        route.add_usage(input_tokens, output_tokens)
+
+
+class Route:
+    """One routed call: ``llm`` is the chosen client, ``model`` its name."""
+
+    def __init__(self, router: "ModelRouter", node: str, model: str, llm: Any):
+        self._router = router
+        self.node = node
+        self.model = model
+        self.llm = llm
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+        self._started = 0.0
+        self._token = None
+
+    def add_usage(self, input_tokens: int = 0, output_tokens: int = 0) -> None:
+        with self._lock:
+            self.input_tokens += input_tokens or 0
+            self.output_tokens += output_tokens or 0
+
+    def add_langchain_usage(self, message: Any) -> None:
+        """Add usage from a LangChain ``AIMessage`` (``usage_metadata``)."""
+        usage = getattr(message, "usage_metadata", None) or {}
+        self.add_usage(usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+
+    async def __aenter__(self) -> "Route":
+        self._started = time.monotonic()
+        self._token = _active_route.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        _active_route.reset(self._token)
+        self._router._record(
+            self.node,
+            self.model,
+            time.monotonic() - self._started,
+            exc_type is None,
+            self.input_tokens,
+            self.output_tokens,
+        )
+        return False
+
+
+class ModelRouter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._factories: Dict[str, Tuple[str, Callable[[], Any]]] = {}
+        self._models: Dict[str, Any] = {}
+        self._routes: Dict[str, Tuple[List[str], Optional[float]]] = {}
+        self._overrides = _load_overrides()
+        self._latency: Dict[Tuple[str, str], Deque[Tuple[float, float]]] = {}
+        self._stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    # ――― configuration ―――
+    def register_model(
+        self, name: str, factory: Callable[[], Any], kind: str = "wrapper"
+    ) -> None:
+        with self._lock:
+            self._factories[name] = (kind, factory)
+            self._models.pop(name, None)
+
+    def configure(
+        self,
+        node: str,
+        models: List[str],
+        p95_budget_seconds: Optional[float] = None,
+    ) -> None:
+        """Set the models (preferred first) and latency budget for a node;
+        ``MODEL_ROUTES`` entries take precedence."""
+        override = self._overrides.get(node)
+        if override:
+            models = override.get("models", models)
+            p95_budget_seconds = override.get("p95_budget_seconds", p95_budget_seconds)
+        with self._lock:
+            unknown = [m for m in models if m not in self._factories]
+            if unknown:
+                raise ValueError(f"Route {node!r} uses unregistered models {unknown}")
+            kinds = {self._factories[m][0] for m in models}
+            if len(kinds) > 1:
+                raise ValueError(f"Route {node!r} mixes model kinds {sorted(kinds)}")
+            self._routes[node] = (list(models), p95_budget_seconds)
+
+    # ――― selection ―――
+    def _client(self, name: str) -> Any:
+        # Called with the lock held
+        if name not in self._models:
+            self._models[name] = self._factories[name][1]()
+        return self._models[name]
+
+    def _p95(self, node: str, model: str, now: float) -> Optional[float]:
+        samples = self._latency.get((node, model))
+        if not samples:
+            return None
+        while samples and now - samples[0][0] > MODEL_LATENCY_WINDOW_SECONDS:
+            samples.popleft()
+        if len(samples) < MODEL_LATENCY_MIN_SAMPLES:
+            return None
+        ordered = sorted(seconds for _, seconds in samples)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def select(self, node: str) -> Tuple[str, Any]:
+        """The model name and client to use for ``node`` right now."""
+        with self._lock:
+            if node not in self._routes:
+                raise KeyError(f"No model route configured for {node!r}")
+            models, budget = self._routes[node]
+            chosen = models[0]
+            if budget is not None and len(models) > 1:
+                now = time.monotonic()
+                p95s = {m: self._p95(node, m, now) for m in models}
+                within = [m for m in models if p95s[m] is None or p95s[m] <= budget]
+                if within:
+                    chosen = within[0]
+                else:
+                    # Everything is over budget: take the fastest
+                    chosen = min(models, key=lambda m: p95s[m])
+                if chosen != models[0]:
+                    logger.info(
+                        "Routing %s to %s (p95 of %s is %.1fs, budget %.1fs)",
+                        node,
+                        chosen,
+                        models[0],
+                        p95s[models[0]],
+                        budget,
+                    )
+            stats = self._model_stats(node, chosen)
+            stats["selected"] += 1
+            if chosen != models[0]:
+                stats["fallback_selections"] += 1
+            return chosen, self._client(chosen)
+
+    def route(self, node: str) -> Route:
+        """``async with router.route(node) as r: await r.llm.ainvoke(...)``
+        records latency, success and token usage of the call."""
+        model, llm = self.select(node)
+        return Route(self, node, model, llm)
+
+    # ――― accounting ―――
+    def _model_stats(self, node: str, model: str) -> Dict[str, Any]:
+        return self._stats.setdefault(
+            (node, model),
+            {
+                "selected": 0,
+                "fallback_selections": 0,
+                "calls": 0,
+                "errors": 0,
+                "seconds": 0.0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+            },
+        )
+
+    def _record(
+        self,
+        node: str,
+        model: str,
+        seconds: float,
+        ok: bool,
+        input_tokens: int,
+        output_tokens: int,
+    ) -> None:
+        with self._lock:
+            self._latency.setdefault(
+                (node, model), deque(maxlen=MODEL_LATENCY_MAX_SAMPLES)
+            ).append((time.monotonic(), seconds))
+            stats = self._model_stats(node, model)
+            stats["calls"] += 1
+            stats["errors"] += 0 if ok else 1
+            stats["seconds"] += seconds
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+        # Feeds the global token budget of admission control
+        admission.note_tokens(input_tokens + output_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            snapshot: Dict[str, Any] = {}
+            for node, (models, budget) in self._routes.items():
+                per_model = {}
+                for model in models:
+                    stats = dict(self._model_stats(node, model))
+                    calls = stats["calls"]
+                    stats["avg_seconds"] = (
+                        round(stats["seconds"] / calls, 3) if calls else 0.0
+                    )
+                    p95 = self._p95(node, model, now)
+                    stats["p95_seconds"] = round(p95, 3) if p95 is not None else None
+                    per_model[model] = stats
+                snapshot[node] = {
+                    "models": models,
+                    "p95_budget_seconds": budget,
+                    "by_model": per_model,
+                }
+            return snapshot
+
+
+model_router = ModelRouter()
+
+register_metrics_source("model_routes", model_router.stats)
@@ -0,0 +1,148 @@
+"""Page-level PDF text extraction with PyMuPDF.
+
+These functions run in the parsing process pool (see
+``utils.executors.run_in_process``), so this module only depends on
+PyMuPDF. Text is rendered as Markdown: lines that match the document's
+bookmarks or are set noticeably larger than body text become ``# `` /
+``## `` headings (the format ``parse_pdf_structure`` reads). Each page also
+gets a quality verdict deciding whether it has to be re-parsed remotely.
+
+Page numbers are 0-based throughout.
+"""
+
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import fitz  # PyMuPDF
+
+# Pages with less text than this that contain images are treated as scans
+MIN_PAGE_CHARS = 80
+# Share of replacement / private-use characters above which text is unusable
+MAX_GARBLED_RATIO = 0.05
+# A heading font has to be at least this much larger than body text
+HEADING_MIN_RATIO = 1.15
+MAX_HEADING_CHARS = 120
+# Font statistics are gathered from at most this many pages
+PROFILE_SAMPLE_PAGES = 50
+
+_SPACE_RE = re.compile(r"\s+")
+_GARBLED_RE = re.compile("[\ufffd\ue000-\uf8ff]")
+
+
+def _norm(text: str) -> str:
+    return _SPACE_RE.sub(" ", text).strip().lower()
+
+
+def _line_text_and_size(line: Dict[str, Any]):
+    spans = [s for s in line.get("spans", []) if s["text"].strip()]
+    if not spans:
+        return "", 0.0
+    text = _SPACE_RE.sub(" ", "".join(s["text"] for s in line["spans"])).strip()
+    return text, max(round(s["size"], 1) for s in spans)
+
+
+def font_profile(pdf_bytes: bytes) -> Dict[str, Any]:
+    """Body font size, heading font sizes and bookmarks of a PDF."""
+    sizes: Counter = Counter()
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        page_count = doc.page_count
+        step = max(1, page_count // PROFILE_SAMPLE_PAGES)
+        for page_no in range(0, page_count, step):
+            for block in doc[page_no].get_text("dict")["blocks"]:
+                for line in block.get("lines", []):
+                    text, size = _line_text_and_size(line)
+                    if text:
+                        sizes[size] += len(text)
+        toc = doc.get_toc(simple=True)
+
+    body_size = sizes.most_common(1)[0][0] if sizes else 0.0
+    heading_sizes = sorted(
+        (s for s in sizes if body_size and s >= body_size * HEADING_MIN_RATIO),
+        reverse=True,
+    )[:2]
+    return {
+        "page_count": page_count,
+        "body_size": body_size,
+        "heading_sizes": heading_sizes,
+        # (0-based page, normalised title) -> heading level
+        "toc": {
+            (page - 1, _norm(title)): min(level, 2)
+            for level, title, page in toc
+            if page >= 1 and title.strip()
+        },
+    }
+
+
+def _heading_level(
+    text: str, size: float, page_no: int, profile: Dict[str, Any]
+) -> int:
+    if len(text) > MAX_HEADING_CHARS:
+        return 0
+    level = profile["toc"].get((page_no, _norm(text)))
+    if level:
+        return level
+    for level, heading_size in enumerate(profile["heading_sizes"], start=1):
+        if size >= heading_size:
+            return level
+    return 0
+
+
+def _page_verdict(page, text: str, detect_tables: bool) -> Optional[str]:
+    """Why the page needs remote parsing, or None if local text is good."""
+    chars = len(text.strip())
+    if chars < MIN_PAGE_CHARS and page.get_images(full=False):
+        return "scanned"
+    if chars and len(_GARBLED_RE.findall(text)) / chars > MAX_GARBLED_RATIO:
+        return "garbled"
+    if detect_tables:
+        try:
+            if page.find_tables().tables:
+                return "tables"
+        except Exception:
+            pass
+    return None
+
+
+def extract_pages(
+    pdf_bytes: bytes,
+    page_numbers: List[int],
+    profile: Dict[str, Any],
+    detect_tables: bool = True,
+) -> List[Dict[str, Any]]:
+    """Markdown and a quality verdict for each requested page."""
+    results = []
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        for page_no in page_numbers:
+            page = doc[page_no]
+            out: List[str] = []
+            plain: List[str] = []
+            for block in page.get_text("dict")["blocks"]:
+                if block.get("type") != 0:
+                    continue
+                prev_level = 0
+                for line in block.get("lines", []):
+                    text, size = _line_text_and_size(line)
+                    if not text:
+                        continue
+                    plain.append(text)
+                    level = _heading_level(text, size, page_no, profile)
+                    if level and level == prev_level and out:
+                        # Heading wrapped over several lines
+                        out[-1] = f"{out[-1]} {text}"
+                    elif level:
+                        out.append(f"{'#' * level} {text}")
+                    else:
+                        out.append(text)
+                    prev_level = level
+                out.append("")
+            reason = _page_verdict(page, "\n".join(plain), detect_tables)
+            results.append(
+                {
+                    "page": page_no,
+                    "markdown": "\n".join(out).strip(),
+                    "needs_fallback": reason is not None,
+                    "reason": reason,
+                }
+            )
+    return results
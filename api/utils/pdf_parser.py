@@ -1,10 +1,16 @@
-import tempfile  # For handling PDF downloads
-from typing import List, Dict
+import tempfile  # For handling LlamaParse uploads
+from collections import OrderedDict
+from typing import Any, List, Dict, Optional, Tuple
 import os
-from llama_parse import LlamaParse  # For PDF parsing
-import boto3
+import json
+import asyncio
+import logging
+from llama_parse import LlamaParse  # Remote fallback for hard pages
 from dotenv import load_dotenv, find_dotenv
-from utils.aws_utils import AwsUtlis
+from utils.storage import get_storage, ObjectNotFound
+from utils.executors import run_in_process
+from utils.document_catalog import find_project_documents
+from utils.pdf_pages import font_profile, extract_pages
 
 env_path = find_dotenv()  # walks up until it finds .env
 loaded = load_dotenv(env_path)
@@ -12,49 +18,241 @@ loaded = load_dotenv(env_path)
 BUCKET_NAME = os.getenv("OUTLINE_BUCKET_NAME", "outline-helper")
 LLAMA_CLOUD_API_KEY = os.getenv("LLAMA_CLOUD_API_KEY")
 
-s3_client = AwsUtlis.get_s3_client()
+# Seeded by hand rather than uploaded through the API, so it has no catalog rows
+DEFAULT_OUTLINE_OWNER = ("default", "outline")
 
+# Pages handed to one process-pool task
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# Pages with tables are re-parsed remotely for a proper layout
+PDF_ESCALATE_TABLES = os.getenv("PDF_ESCALATE_TABLES", "true").lower() == "true"
+LLAMAPARSE_CONCURRENCY = int(os.getenv("LLAMAPARSE_CONCURRENCY", "4"))
 
-async def extract_pdf_from_s3(user_id: str, project_id: str) -> str:
-    """
-    Download and extract text from one or more PDF files in S3 for the given user and project.
+# Parsed artifacts are stored next to the source as
+# "<key>.parsed/<etag>.json"; bump the version when the extractor output changes
+PARSED_ARTIFACT_VERSION = 1
+PARSED_CACHE_SIZE = int(os.getenv("PARSED_PDF_CACHE_SIZE", "64"))
 
-    This function lists all objects under the prefix `user_id/project_id/` and picks those
-    whose keys end with ".pdf" (case-insensitive). It then downloads each file, uses the PDF parser
-    (e.g. LlamaParse) to extract text, and concatenates the results.
+logger = logging.getLogger(__name__)
+_llamaparse_slots = asyncio.Semaphore(LLAMAPARSE_CONCURRENCY)
 
-    Returns:
-        A single string with all extracted texts. If no PDF is found or an error occurs, returns an empty string.
+# (key, etag) -> artifact, most recently used last
+_parsed_cache: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+_parsing: Dict[Tuple[str, str], asyncio.Task] = {}
+_default_outline: Optional[asyncio.Task] = None
+
+
+async def list_pdf_documents(user_id: str, project_id: str) -> List[Dict[str, Any]]:
+    """PDF files (``file_path`` and ``etag``) for a project, looked up in the
+    document catalog.
+
+    The seeded default outline is not cataloged and is listed from storage.
     """
-    prefix = f"{user_id}/{project_id}/"
-    extracted_texts: List[str] = []
+    if (user_id, project_id) == DEFAULT_OUTLINE_OWNER:
+        keys = await get_storage().list_keys(BUCKET_NAME, f"{user_id}/{project_id}/")
+        return [
+            {"file_path": key, "etag": None}
+            for key in keys
+            if key.lower().endswith(".pdf")
+        ]
+    return await find_project_documents(
+        user_id, project_id, BUCKET_NAME, extensions=(".pdf",)
+    )
+
+
+async def _llamaparse(
+    pdf_bytes: bytes, pages: Optional[List[int]] = None
+) -> Optional[List[str]]:
+    """Markdown for ``pages`` (0-based; all pages if None) from LlamaParse."""
+    if not LLAMA_CLOUD_API_KEY:
+        return None
+    kwargs = {"target_pages": ",".join(str(p) for p in pages)} if pages else {}
+    async with _llamaparse_slots:
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+            tmp.write(pdf_bytes)
+            tmp.flush()
+            parser = LlamaParse(
+                api_key=LLAMA_CLOUD_API_KEY, result_type="markdown", **kwargs
+            )
+            documents = await parser.aload_data(tmp.name)
+    return [doc.text for doc in documents]
+
 
+async def extract_pdf_markdown(pdf_bytes: bytes, name: str = "") -> str:
+    """Tiered extraction: PyMuPDF locally, LlamaParse only for pages that
+    fail the quality check (scans, garbled text, tables)."""
     try:
-        response = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=prefix)
-        contents = response.get("Contents", [])
-        # Filter keys that end with .pdf (case insensitive)
-        pdf_keys = [
-            obj["Key"] for obj in contents if obj["Key"].lower().endswith(".pdf")
+        profile = await run_in_process(font_profile, pdf_bytes)
+    except Exception as e:
+        logger.warning("Local PDF parsing failed for %s (%s); using LlamaParse", name, e)
+        texts = await _llamaparse(pdf_bytes)
+        return "\n".join(texts or [])
+
+    page_count = profile["page_count"]
+    batches = [
+        list(range(start, min(start + PDF_PAGES_PER_TASK, page_count)))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    ]
+    results = await asyncio.gather(
+        *[
+            run_in_process(
+                extract_pages, pdf_bytes, batch, profile, PDF_ESCALATE_TABLES
+            )
+            for batch in batches
         ]
+    )
+    pages = [page for batch in results for page in batch]
+
+    escalate = [p["page"] for p in pages if p["needs_fallback"]]
+    if escalate:
+        logger.debug(
+            "%s: re-parsing %d/%d pages with LlamaParse", name, len(escalate), page_count
+        )
+        try:
+            texts = await _llamaparse(
+                pdf_bytes, None if len(escalate) == page_count else escalate
+            )
+        except Exception as e:
+            logger.error("LlamaParse fallback failed for %s: %s", name, e)
+            texts = None
+        if texts is not None:
+            if len(texts) == len(escalate):
+                replacements = dict(zip(escalate, texts))
+            else:
+                # Pages came back merged; keep them at the first escalated page
+                replacements = {p: "" for p in escalate}
+                replacements[escalate[0]] = "\n".join(texts)
+            for page in pages:
+                if page["page"] in replacements:
+                    page["markdown"] = replacements[page["page"]]
+
+    return "\n\n".join(p["markdown"] for p in pages if p["markdown"])
+
+
+# ------------------------------------------------------------------------
+# PARSED ARTIFACTS
+# ------------------------------------------------------------------------
+def _artifact_key(key: str, etag: str) -> str:
+    return f"{key}.parsed/{etag}.json"
+
+
+def _remember(cache_key: Tuple[str, str], artifact: Dict[str, Any]) -> None:
+    _parsed_cache[cache_key] = artifact
+    _parsed_cache.move_to_end(cache_key)
+    while len(_parsed_cache) > PARSED_CACHE_SIZE:
+        _parsed_cache.popitem(last=False)
+
+
+async def _load_or_parse(key: str, etag: str) -> Dict[str, Any]:
+    storage = get_storage()
+    artifact_key = _artifact_key(key, etag)
+    try:
+        artifact = json.loads(await storage.read(BUCKET_NAME, artifact_key))
+        if artifact.get("version") == PARSED_ARTIFACT_VERSION:
+            return artifact
+    except ObjectNotFound:
+        pass
+
+    markdown = await extract_pdf_markdown(await storage.read(BUCKET_NAME, key), key)
+    artifact = {
+        "version": PARSED_ARTIFACT_VERSION,
+        "etag": etag,
+        "markdown": markdown,
+        "sections": parse_pdf_structure(markdown),
+    }
+    await storage.write(
+        BUCKET_NAME,
+        artifact_key,
+        json.dumps(artifact).encode(),
+        content_type="application/json",
+    )
+    return artifact
+
+
+async def get_parsed_pdf(key: str, etag: Optional[str] = None) -> Dict[str, Any]:
+    """Markdown and ``parse_pdf_structure`` sections for an outline PDF.
+
+    Served from the in-process LRU, then from the artifact stored next to the
+    object for its current ETag; the PDF is only parsed when neither exists.
+    Concurrent requests for the same file share one parse.
+    """
+    if not etag:
+        head = await get_storage().head(BUCKET_NAME, key)
+        if head is None:
+            raise ObjectNotFound(f"{BUCKET_NAME}/{key}")
+        etag = head.get("ETag", "").strip('"')
+    cache_key = (key, etag)
+    if cache_key in _parsed_cache:
+        _parsed_cache.move_to_end(cache_key)
+        return _parsed_cache[cache_key]
+
+    task = _parsing.get(cache_key)
+    if task is None:
+        task = _parsing[cache_key] = asyncio.create_task(_load_or_parse(key, etag))
+        task.add_done_callback(lambda _: _parsing.pop(cache_key, None))
+    artifact = await asyncio.shield(task)
+    _remember(cache_key, artifact)
+    return artifact
+
+
+async def _load_project_artifacts(
+    user_id: str, project_id: str
+) -> List[Dict[str, Any]]:
+    docs = await list_pdf_documents(user_id, project_id)
+    if not docs:
+        logger.debug("No PDF files found for %s/%s", user_id, project_id)
+        return []
+    results = await asyncio.gather(
+        *[get_parsed_pdf(d["file_path"], d.get("etag")) for d in docs],
+        return_exceptions=True,
+    )
+    artifacts = []
+    for doc, res in zip(docs, results):
+        if isinstance(res, Exception):
+            logger.error("PDF extraction failed for %s: %s", doc["file_path"], res)
+            continue
+        artifacts.append(res)
+    return artifacts
+
+
+async def load_outline_sections(user_id: str, project_id: str) -> List[Dict[str, str]]:
+    """Outline sections from all of a project's PDFs."""
+    if (user_id, project_id) == DEFAULT_OUTLINE_OWNER:
+        return await load_default_outline_sections()
+    artifacts = await _load_project_artifacts(user_id, project_id)
+    return [sec for a in artifacts for sec in a["sections"]]
 
-        if not pdf_keys:
-            print(f"[DEBUG] No PDF files found in prefix {prefix}")
-            return ""
 
-        for key in pdf_keys:
-            print(f"[DEBUG] Processing PDF file: {key}")
-            with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
-                s3_client.download_file(BUCKET_NAME, key, tmp.name)
-                # Use your PDF parser (assuming LlamaParse is imported properly)
-                parser = LlamaParse(api_key=LLAMA_CLOUD_API_KEY, result_type="markdown")
-                documents = parser.load_data(tmp.name)
-                file_text = "\n".join(doc.text for doc in documents)
-                extracted_texts.append(file_text)
+async def load_default_outline_sections() -> List[Dict[str, str]]:
+    """Sections of the seeded default outline, loaded once per process."""
+    global _default_outline
 
-        return "\n".join(extracted_texts)
+    async def _load():
+        artifacts = await _load_project_artifacts(*DEFAULT_OUTLINE_OWNER)
+        return [sec for a in artifacts for sec in a["sections"]]
 
+    if _default_outline is None or (
+        _default_outline.done() and _default_outline.exception() is not None
+    ):
+        _default_outline = asyncio.create_task(_load())
+    return await asyncio.shield(_default_outline)
+
+
+async def extract_pdf_from_s3(user_id: str, project_id: str) -> str:
+    """
+    Extracted Markdown of one or more PDF files in S3 for the given user and project.
+
+    This function looks up the project's PDF files in the document catalog (see
+    `list_pdf_documents`) and returns their parsed Markdown (see
+    `get_parsed_pdf`), concatenated.
+
+    Returns:
+        A single string with all extracted texts. If no PDF is found or an error occurs, returns an empty string.
+    """
+    try:
+        artifacts = await _load_project_artifacts(user_id, project_id)
+        return "\n".join(a["markdown"] for a in artifacts)
     except Exception as e:
-        print(f"[ERROR] PDF extraction failed: {e}")
+        logger.error("PDF extraction failed: %s", e)
         return ""
 
 
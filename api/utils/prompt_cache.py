@@ -0,0 +1,202 @@
+"""Cache-friendly prompt construction.
+
+Providers cache prompts by prefix: OpenAI does it automatically for long
+prefixes, Bedrock Claude at explicit ``cache_control`` points. A prompt
+only hits the cache if everything before the varying part is byte-for-byte
+identical, so ``CachedPrompt`` keeps three parts in a fixed order:
+
+- ``system``: the role text, identical for every call of a node
+- ``shared``: instructions shared by every section of one report (topic,
+  report-type guidance, output requirements)
+- ``specific``: the section title, sub-points, context and so on
+
+Bedrock only accepts cache points on some Claude models and only caches a
+prefix of a minimum length, so ``bedrock_cache_points`` drops the points a
+request's model cannot use before it is sent (see ``PROMPT_CACHE_MODELS``).
+
+Cached-token counts reported back by the providers are collected per
+prompt name and exposed as the ``prompt_cache`` metrics source.
+"""
+
+import os
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from utils.metrics import register_metrics_source
+
+# Explicit cache points can be switched off altogether
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() == "true"
+
+# Bedrock models (matched by substring of the model id / profile ARN) that
+# support prompt caching, with the shortest prefix in tokens they will cache.
+# Other models, Claude 3 Haiku and 3.5 Sonnet among them, get no cache points.
+PROMPT_CACHE_MODELS = {
+    "claude-3-7-sonnet": 1024,
+    "claude-sonnet-4": 1024,
+    "claude-opus-4": 1024,
+    "claude-3-5-haiku": 2048,
+}
+# Rough characters per token, for the minimum-length check
+CHARS_PER_TOKEN = 4
+
+_CACHE_POINT = {"type": "ephemeral"}
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {}
+
+# Name of the prompt being sent, so wrappers can attribute the usage they
+# read from responses (carried into executor threads by ``run_in``)
+_current_prompt: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "current_prompt", default=None
+)
+
+
+def current_prompt_name() -> Optional[str]:
+    return _current_prompt.get()
+
+
+@dataclass(frozen=True)
+class CachedPrompt:
+    name: str  # used to group usage statistics
+    system: str
+    shared: str
+    specific: str
+
+    def for_bedrock(self) -> List[Dict[str, Any]]:
+        """Messages for ``ClaudeWrapper`` with cache points after the system
+        text and after the shared instructions (kept or dropped per model by
+        ``bedrock_cache_points``)."""
+        if not PROMPT_CACHE_ENABLED:
+            return [
+                {"role": "system", "content": self.system},
+                {"role": "user", "content": f"{self.shared}\n\n{self.specific}"},
+            ]
+        return [
+            {
+                "role": "system",
+                "content": [
+                    {"type": "text", "text": self.system, "cache_control": _CACHE_POINT}
+                ],
+            },
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": self.shared, "cache_control": _CACHE_POINT},
+                    {"type": "text", "text": self.specific},
+                ],
+            },
+        ]
+
+    @contextmanager
+    def scope(self) -> Iterator[None]:
+        """Attribute usage reported by the wrappers inside the block to this prompt."""
+        token = _current_prompt.set(self.name)
+        try:
+            yield
+        finally:
+            _current_prompt.reset(token)
+
+    def for_langchain(self) -> list:
+        """Messages for LangChain chat models (prefix caching is implicit)."""
+        return [
+            SystemMessage(content=self.system),
+            HumanMessage(content=f"{self.shared}\n\n{self.specific}"),
+        ]
+
+
+def min_cache_tokens(model_id: str) -> Optional[int]:
+    """Shortest cacheable prefix for a Bedrock model, None if the model does
+    not support cache points (or caching is off)."""
+    if not PROMPT_CACHE_ENABLED:
+        return None
+    for fragment, tokens in PROMPT_CACHE_MODELS.items():
+        if fragment in model_id:
+            return tokens
+    return None
+
+
+def bedrock_cache_points(
+    messages: List[Mapping[str, Any]], model_id: str
+) -> List[Dict[str, Any]]:
+    """``messages`` with only the cache points ``model_id`` can use.
+
+    A point is kept when the model supports caching and the prompt up to it
+    is long enough to be cached; messages left without a point are sent as
+    plain text, exactly as with caching disabled.
+    """
+    min_tokens = min_cache_tokens(model_id)
+    prefix_chars = 0
+    prepared: List[Dict[str, Any]] = []
+    for message in messages:
+        content = message["content"]
+        if not isinstance(content, list):
+            prefix_chars += len(content)
+            prepared.append(dict(message))
+            continue
+        blocks = []
+        for block in content:
+            prefix_chars += len(block.get("text", ""))
+            block = dict(block)
+            if "cache_control" in block and (
+                min_tokens is None or prefix_chars // CHARS_PER_TOKEN < min_tokens
+            ):
+                del block["cache_control"]
+            blocks.append(block)
+        if not any("cache_control" in b for b in blocks):
+            blocks = "\n\n".join(b.get("text", "") for b in blocks)
+        prepared.append({**message, "content": blocks})
+    return prepared
+
+
+def record_prompt_usage(
+    name: str,
+    input_tokens: int,
+    cache_read_tokens: int = 0,
+    cache_write_tokens: int = 0,
+) -> None:
+    """``input_tokens`` is the whole prompt, cached parts included."""
+    with _stats_lock:
+        stats = _stats.setdefault(
+            name,
+            {"calls": 0, "input_tokens": 0, "cache_read_tokens": 0, "cache_write_tokens": 0},
+        )
+        stats["calls"] += 1
+        stats["input_tokens"] += input_tokens or 0
+        stats["cache_read_tokens"] += cache_read_tokens or 0
+        stats["cache_write_tokens"] += cache_write_tokens or 0
+
+
+def record_langchain_usage(name: str, message: Any) -> None:
+    """Record usage from a LangChain ``AIMessage`` (``usage_metadata``)."""
+    usage: Optional[Mapping[str, Any]] = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    details = usage.get("input_token_details") or {}
+    record_prompt_usage(
+        name,
+        usage.get("input_tokens", 0),
+        details.get("cache_read", 0),
+        details.get("cache_creation", 0),
+    )
+
+
+def _prompt_cache_metrics() -> Dict[str, Any]:
+    with _stats_lock:
+        snapshot = {}
+        for name, stats in _stats.items():
+            total = stats["input_tokens"]
+            snapshot[name] = {
+                **stats,
+                "cache_hit_ratio": (
+                    round(stats["cache_read_tokens"] / total, 4) if total else 0.0
+                ),
+            }
+        return snapshot
+
+
+register_metrics_source("prompt_cache", _prompt_cache_metrics)
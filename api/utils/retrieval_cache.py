@@ -0,0 +1,154 @@
+"""Per-project cache for knowledge-base retrieval results.
+
+Sections, reports and update runs for the same project ask many of the same
+questions. Entries are keyed by the normalised query, the user/project
+filter, the result count and the project's index version; once an ingestion
+job for the project completes the version moves on and the project's old
+entries are dropped.
+"""
+
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.document_catalog import project_index_version
+from utils.metrics import register_metrics_source
+
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "3600"))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "2000"))
+# How long a project's index version is trusted before re-reading the catalog
+# (covers ingestion completed by another worker process)
+RETRIEVAL_CACHE_VERSION_SECONDS = float(
+    os.getenv("RETRIEVAL_CACHE_VERSION_SECONDS", "30")
+)
+
+_SPACE_RE = re.compile(r"\s+")
+
+ProjectKey = Tuple[str, str]
+
+
+def normalize_query(text: str) -> str:
+    return _SPACE_RE.sub(" ", text or "").strip().strip("?.!").lower()
+
+
+class RetrievalCache:
+    def __init__(
+        self,
+        ttl_seconds: float = RETRIEVAL_CACHE_TTL_SECONDS,
+        max_entries: int = RETRIEVAL_CACHE_MAX_ENTRIES,
+        version_seconds: float = RETRIEVAL_CACHE_VERSION_SECONDS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.version_seconds = version_seconds
+        self._entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        # (user_id, project_id) -> (index_version, checked_at)
+        self._versions: Dict[ProjectKey, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evicted": 0,
+            "invalidated": 0,
+            "saved_seconds": 0.0,
+            "fetch_seconds": 0.0,
+        }
+
+    def _project_version(self, owner: ProjectKey) -> int:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(owner)
+        if cached and now - cached[1] < self.version_seconds:
+            return cached[0]
+        version = project_index_version(*owner)
+        with self._lock:
+            if cached and cached[0] != version:
+                self._drop_project(owner)
+            self._versions[owner] = (version, now)
+        return version
+
+    def _drop_project(self, owner: ProjectKey) -> None:
+        stale = [k for k in self._entries if k[:2] == owner]
+        for k in stale:
+            del self._entries[k]
+        self._stats["invalidated"] += len(stale)
+
+    def get_or_fetch(
+        self,
+        user_id: str,
+        project_id: str,
+        query: str,
+        top_k: int,
+        fetch: Callable[[], List[Dict[str, Any]]],
+    ) -> List[Dict[str, Any]]:
+        """Return cached chunks for the query, calling ``fetch`` on a miss.
+
+        ``fetch`` may raise; failures are not cached.
+        """
+        owner = (str(user_id or ""), str(project_id or ""))
+        version = self._project_version(owner)
+        key = owner + (version, top_k, normalize_query(query))
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry["stored_at"] < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    self._stats["saved_seconds"] += entry["fetch_seconds"]
+                    return entry["chunks"]
+                del self._entries[key]
+                self._stats["expired"] += 1
+            self._stats["misses"] += 1
+
+        started = time.monotonic()
+        chunks = fetch()
+        elapsed = time.monotonic() - started
+
+        with self._lock:
+            self._stats["fetch_seconds"] += elapsed
+            self._entries[key] = {
+                "chunks": chunks,
+                "stored_at": time.monotonic(),
+                "fetch_seconds": elapsed,
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evicted"] += 1
+        return chunks
+
+    def invalidate_project(
+        self, user_id: str, project_id: str, index_version: Optional[int] = None
+    ) -> None:
+        """Drop a project's entries, e.g. after an ingestion job completed."""
+        owner = (str(user_id), str(project_id))
+        with self._lock:
+            self._drop_project(owner)
+            if index_version is None:
+                self._versions.pop(owner, None)
+            else:
+                self._versions[owner] = (index_version, time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            misses = self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "avg_fetch_seconds": (
+                    round(self._stats["fetch_seconds"] / misses, 4) if misses else 0.0
+                ),
+                "ttl_seconds": self.ttl_seconds,
+                "max_entries": self.max_entries,
+            }
+
+
+retrieval_cache = RetrievalCache()
+register_metrics_source("retrieval_cache", retrieval_cache.stats)
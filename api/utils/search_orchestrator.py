@@ -0,0 +1,367 @@
+"""Hedged, failover web search across Tavily, SerpAPI and Perplexity.
+
+``web_search(query, providers)`` asks the providers in order of preference:
+
+- the first healthy provider is called; if it has not answered within its
+  recent p90 latency, the next provider is started as a hedge
+- a provider that fails or returns nothing hands over to the next one
+  immediately
+- consecutive errors open a per-provider circuit breaker; the provider is
+  skipped until the cool-down has passed, then lets a single trial request
+  through (other searches keep skipping it while the trial is in flight);
+  the breaker closes if the trial succeeds and re-opens if it fails
+- the first non-empty answer wins; answers from other providers still in
+  flight are merged in (deduplicated by URL) if they arrive within
+  ``WEB_SEARCH_MERGE_GRACE_SECONDS``
+
+The whole search is bounded by ``WEB_SEARCH_TIMEOUT_SECONDS`` and by the
+request deadline (see ``utils.deadline``). Hits are
+normalised to ``{"title", "url", "snippet", "content", "provider"}``.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from utils.executors import run_in
+from utils.deadline import call_timeout
+from utils.metrics import register_metrics_source
+from utils.websearch_utils import (
+    PERPLEXITY_API_KEY,
+    SERPAPI_API_KEY,
+    TAVILY_API_KEY,
+    call_perplexity_api,
+    serpapi_search,
+    tavily_search,
+)
+
+logger = logging.getLogger(__name__)
+
+# Provider order used when the caller does not pass one
+DEFAULT_PROVIDERS = [
+    p.strip()
+    for p in os.getenv("WEB_SEARCH_PROVIDERS", "tavily,serpapi,perplexity").split(",")
+    if p.strip()
+]
+WEB_SEARCH_TIMEOUT_SECONDS = float(os.getenv("WEB_SEARCH_TIMEOUT_SECONDS", "20"))
+# Hedge delay until a provider has enough latency samples for its p90
+WEB_SEARCH_HEDGE_SECONDS = float(os.getenv("WEB_SEARCH_HEDGE_SECONDS", "4"))
+WEB_SEARCH_MERGE_GRACE_SECONDS = float(os.getenv("WEB_SEARCH_MERGE_GRACE_SECONDS", "0.5"))
+WEB_SEARCH_LATENCY_SAMPLES = 50
+WEB_SEARCH_MIN_SAMPLES = 5
+WEB_SEARCH_BREAKER_FAILURES = int(os.getenv("WEB_SEARCH_BREAKER_FAILURES", "5"))
+WEB_SEARCH_BREAKER_COOLDOWN = float(os.getenv("WEB_SEARCH_BREAKER_COOLDOWN", "60"))
+# A trial that never reports back (dropped before it ran) stops blocking
+# the next one after this long
+WEB_SEARCH_TRIAL_TIMEOUT = WEB_SEARCH_TIMEOUT_SECONDS
+
+_TRACKING_PARAMS = ("utm_", "gclid", "fbclid")
+
+
+# ------------------------------------------------------------------------
+# PROVIDERS
+# ------------------------------------------------------------------------
+def _tavily(query: str, max_results: int, full_content: bool) -> List[Dict[str, Any]]:
+    res = tavily_search(query, full_content, max_results)
+    return [
+        {
+            "title": item.get("title", ""),
+            "url": item.get("url", ""),
+            "snippet": item.get("content", ""),
+            "content": (full_content and item.get("raw_content"))
+            or item.get("content", ""),
+        }
+        for item in res.get("results", [])
+    ]
+
+
+def _serpapi(query: str, max_results: int, full_content: bool) -> List[Dict[str, Any]]:
+    return [
+        {**hit, "content": hit["snippet"]}
+        for hit in serpapi_search(query, max_results)
+    ]
+
+
+def _perplexity(
+    query: str, max_results: int, full_content: bool
+) -> List[Dict[str, Any]]:
+    res = call_perplexity_api(query, PERPLEXITY_API_KEY, max_results)
+    if not res.get("success"):
+        raise RuntimeError(res.get("error", "Perplexity request failed"))
+    answer = res.get("content", "")
+    if not answer:
+        return []
+    sources = (res.get("raw_response") or {}).get("citations") or []
+    return [
+        {
+            "title": f"Perplexity: {query}",
+            "url": sources[0] if sources else "",
+            "snippet": answer[:500],
+            "content": answer,
+        }
+    ]
+
+
+PROVIDERS: Dict[str, Callable[[str, int, bool], List[Dict[str, Any]]]] = {
+    "tavily": _tavily,
+    "serpapi": _serpapi,
+    "perplexity": _perplexity,
+}
+_CONFIGURED = {
+    "tavily": bool(TAVILY_API_KEY),
+    "serpapi": bool(SERPAPI_API_KEY),
+    "perplexity": bool(PERPLEXITY_API_KEY),
+}
+
+
+# ------------------------------------------------------------------------
+# HEALTH
+# ------------------------------------------------------------------------
+class ProviderHealth:
+    """Recent latency and circuit-breaker state of one provider."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._latency: Deque[float] = deque(maxlen=WEB_SEARCH_LATENCY_SAMPLES)
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._trial_started: Optional[float] = None
+        self._stats = {
+            "calls": 0,
+            "failures": 0,
+            "empty": 0,
+            "hedges": 0,
+            "wins": 0,
+            "breaker_trips": 0,
+            "trials": 0,
+        }
+
+    def _tripped(self) -> bool:
+        return self._consecutive_failures >= WEB_SEARCH_BREAKER_FAILURES
+
+    def _trial_in_flight(self, now: float) -> bool:
+        return (
+            self._trial_started is not None
+            and now - self._trial_started < WEB_SEARCH_TRIAL_TIMEOUT
+        )
+
+    def available(self) -> bool:
+        """Whether a request could be sent now (without claiming it)."""
+        with self._lock:
+            if not self._tripped():
+                return True
+            now = time.monotonic()
+            return now >= self._open_until and not self._trial_in_flight(now)
+
+    def acquire(self) -> bool:
+        """Claim a request to this provider; when the breaker is half-open
+        only the first caller gets the trial."""
+        with self._lock:
+            if not self._tripped():
+                return True
+            now = time.monotonic()
+            if now < self._open_until or self._trial_in_flight(now):
+                return False
+            self._trial_started = now
+            self._stats["trials"] += 1
+            return True
+
+    def hedge_delay(self) -> float:
+        with self._lock:
+            if len(self._latency) < WEB_SEARCH_MIN_SAMPLES:
+                return WEB_SEARCH_HEDGE_SECONDS
+            ordered = sorted(self._latency)
+            return ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))]
+
+    def record(self, seconds: float, ok: bool, empty: bool = False) -> None:
+        with self._lock:
+            self._stats["calls"] += 1
+            self._trial_started = None
+            if ok:
+                self._latency.append(seconds)
+                self._consecutive_failures = 0
+                self._stats["empty"] += empty
+                return
+            self._stats["failures"] += 1
+            self._consecutive_failures += 1
+            # Also re-opens straight away when the trial after a cool-down fails
+            if self._consecutive_failures >= WEB_SEARCH_BREAKER_FAILURES:
+                self._open_until = time.monotonic() + WEB_SEARCH_BREAKER_COOLDOWN
+                self._stats["breaker_trips"] += 1
+                logger.warning(
+                    "Web search provider %s disabled for %.0fs after %d failures",
+                    self.name,
+                    WEB_SEARCH_BREAKER_COOLDOWN,
+                    self._consecutive_failures,
+                )
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            ordered = sorted(self._latency)
+            return {
+                **self._stats,
+                "configured": _CONFIGURED.get(self.name, False),
+                "breaker_open": self._tripped() and now < self._open_until,
+                "trial_in_flight": self._tripped() and self._trial_in_flight(now),
+                "p90_seconds": (
+                    round(ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))], 3)
+                    if ordered
+                    else None
+                ),
+            }
+
+
+_health: Dict[str, ProviderHealth] = {name: ProviderHealth(name) for name in PROVIDERS}
+
+
+def _timed(name: str, query: str, max_results: int, full_content: bool):
+    # Runs on the search pool; recorded here so that requests abandoned by a
+    # faster hedge still feed the latency and breaker statistics
+    started = time.monotonic()
+    try:
+        hits = PROVIDERS[name](query, max_results, full_content)
+    except Exception:
+        _health[name].record(time.monotonic() - started, ok=False)
+        raise
+    _health[name].record(time.monotonic() - started, ok=True, empty=not hits)
+    return [{**hit, "provider": name} for hit in hits]
+
+
+# ------------------------------------------------------------------------
+# MERGING
+# ------------------------------------------------------------------------
+def _url_key(url: str) -> str:
+    parts = urlsplit(url.strip())
+    query = urlencode(
+        [
+            (k, v)
+            for k, v in parse_qsl(parts.query)
+            if not k.lower().startswith(_TRACKING_PARAMS)
+        ]
+    )
+    host = parts.netloc.lower().removeprefix("www.")
+    return urlunsplit(("", host, parts.path.rstrip("/"), query, ""))
+
+
+def merge_hits(result_sets: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Concatenate hit lists in order, dropping duplicate URLs (or titles
+    for hits without one) and keeping the longest content of duplicates."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for hits in result_sets:
+        for hit in hits:
+            key = _url_key(hit["url"]) if hit.get("url") else hit.get("title", "").lower()
+            seen = merged.get(key)
+            if seen is None:
+                merged[key] = dict(hit)
+            elif len(hit.get("content") or "") > len(seen.get("content") or ""):
+                seen["content"] = hit["content"]
+    return list(merged.values())
+
+
+# ------------------------------------------------------------------------
+# ORCHESTRATION
+# ------------------------------------------------------------------------
+def _collect(done, running, finished, query: str) -> None:
+    for task in done:
+        name = running.pop(task)
+        if task.exception() is not None:
+            logger.error("%s search failed for %r: %s", name, query, task.exception())
+        elif task.result():
+            finished.append(task.result())
+
+
+async def web_search(
+    query: str,
+    providers: Optional[List[str]] = None,
+    max_results: int = 3,
+    full_content: bool = False,
+) -> List[Dict[str, Any]]:
+    """Search ``query`` with the given providers (preferred first)."""
+    candidates = [
+        p
+        for p in (providers or DEFAULT_PROVIDERS)
+        if p in PROVIDERS and _CONFIGURED[p] and _health[p].available()
+    ]
+    if not candidates:
+        logger.warning("No web search provider available for %r", query)
+        return []
+
+    # Never past the request's own deadline
+    deadline = asyncio.get_running_loop().time() + call_timeout(
+        WEB_SEARCH_TIMEOUT_SECONDS
+    )
+    waiting = list(candidates)
+    running: Dict[asyncio.Future, str] = {}
+    finished: List[List[Dict[str, Any]]] = []
+
+    def launch(hedge: bool) -> None:
+        # Skips providers whose half-open trial was taken by another search
+        while waiting:
+            name = waiting.pop(0)
+            if not _health[name].acquire():
+                continue
+            if hedge:
+                _health[name].count("hedges")
+            task = asyncio.ensure_future(
+                run_in("search", _timed, name, query, max_results, full_content)
+            )
+            running[task] = name
+            return
+
+    launch(hedge=False)
+    if not running:
+        logger.warning("No web search provider available for %r", query)
+        return []
+    try:
+        while running:
+            now = asyncio.get_running_loop().time()
+            if now >= deadline:
+                logger.warning("Web search timed out for %r", query)
+                break
+            # Wait for the newest request's p90 before hedging with the next
+            newest = list(running.values())[-1]
+            timeout = deadline - now
+            if waiting:
+                timeout = min(timeout, _health[newest].hedge_delay())
+            done, _ = await asyncio.wait(
+                running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                if waiting:
+                    launch(hedge=True)
+                continue
+            _collect(done, running, finished, query)
+            if finished:
+                _health[finished[0][0]["provider"]].count("wins")
+                if running and WEB_SEARCH_MERGE_GRACE_SECONDS > 0:
+                    done, _ = await asyncio.wait(
+                        running, timeout=WEB_SEARCH_MERGE_GRACE_SECONDS
+                    )
+                    _collect(done, running, finished, query)
+                break
+            # Failed or empty: fail over without waiting for the hedge delay
+            if waiting and not running:
+                launch(hedge=True)
+    finally:
+        for task in running:
+            task.cancel()
+
+    return merge_hits(finished)
+
+
+def _search_metrics() -> Dict[str, Any]:
+    return {name: health.stats() for name, health in _health.items()}
+
+
+register_metrics_source("web_search", _search_metrics)
@@ -0,0 +1,146 @@
+"""Coalescing of identical concurrent requests.
+
+``SingleFlight.do(key, fn)`` runs ``fn()`` once per key: a second caller
+with the same key while the first is still running waits for the same task
+and gets the same result (or exception). The work is shielded from any one
+caller going away and is only cancelled when every caller waiting for it
+has gone.
+
+With ``keep_for`` the result of a successful run is also replayed to callers
+arriving within that many seconds after it finished, which is what an
+``Idempotency-Key`` needs. A ``fingerprint`` of the request can be given so
+that a key reused for a different request is rejected instead of answered
+with the wrong result.
+
+Flights are held per process; the ``single_flight`` metrics source reports
+how many callers were coalesced.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from utils.metrics import register_metrics_source
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlightConflict(ValueError):
+    """A key was reused for a request with a different fingerprint."""
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Future, fingerprint: Optional[str]):
+        self.task = task
+        self.fingerprint = fingerprint
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        # Only touched from the event loop; the lock guards the stats read by
+        # the metrics endpoint
+        self._flights: Dict[str, _Flight] = {}
+        self._recent: Dict[str, Tuple[float, Optional[str], Any]] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "started": 0,
+            "joined": 0,
+            "replayed": 0,
+            "conflicts": 0,
+            "abandoned": 0,
+        }
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def _check(self, key: str, known: Optional[str], fingerprint: Optional[str]):
+        if known is not None and fingerprint is not None and known != fingerprint:
+            self._count("conflicts")
+            raise SingleFlightConflict(f"Key {key!r} was used for a different request")
+
+    def _replay(self, key: str, fingerprint: Optional[str]) -> Tuple[bool, Any]:
+        now = time.monotonic()
+        for k in [k for k, (expires, _, _) in self._recent.items() if expires <= now]:
+            del self._recent[k]
+        if key not in self._recent:
+            return False, None
+        _, known, result = self._recent[key]
+        self._check(key, known, fingerprint)
+        self._count("replayed")
+        return True, result
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        keep_for: float = 0.0,
+        fingerprint: Optional[str] = None,
+    ) -> Any:
+        """Result of ``fn()``, shared with every concurrent caller of ``key``."""
+        replayed, result = self._replay(key, fingerprint)
+        if replayed:
+            return result
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()), fingerprint)
+            self._flights[key] = flight
+            flight.task.add_done_callback(
+                lambda task: self._finish(key, flight, keep_for)
+            )
+            self._count("started")
+        else:
+            self._check(key, flight.fingerprint, fingerprint)
+            self._count("joined")
+            logger.info("Joining in-flight %s %s", self.name, key)
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Every caller has gone: nobody will read the result
+                self._count("abandoned")
+                flight.task.cancel()
+
+    def _finish(self, key: str, flight: _Flight, keep_for: float) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        task = flight.task
+        if keep_for > 0 and not task.cancelled() and task.exception() is None:
+            self._recent[key] = (
+                time.monotonic() + keep_for,
+                flight.fingerprint,
+                task.result(),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "in_flight": len(self._flights),
+                "kept_results": len(self._recent),
+            }
+
+
+_registry: Dict[str, SingleFlight] = {}
+
+
+def single_flight(name: str) -> SingleFlight:
+    """The process-wide ``SingleFlight`` called ``name``."""
+    if name not in _registry:
+        _registry[name] = SingleFlight(name)
+    return _registry[name]
+
+
+def _single_flight_metrics() -> Dict[str, Any]:
+    return {name: flight.stats() for name, flight in _registry.items()}
+
+
+register_metrics_source("single_flight", _single_flight_metrics)
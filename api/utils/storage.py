@@ -0,0 +1,417 @@
+"""Asyncio-native object storage.
+
+All S3 traffic goes through ``get_storage()`` so no handler blocks the event
+loop on a transfer: blocking boto3 calls run on the ``storage`` executor,
+large downloads are split into concurrent ranged GETs and large uploads use
+multipart transfers. ``LocalStorage`` keeps the same interface on the local
+filesystem (``STORAGE_BACKEND=local``) for tests and offline benchmarking.
+
+``head`` returns S3-shaped metadata (``ContentLength``, ``ETag``,
+``ContentType``, ``Metadata``) for both backends.
+"""
+
+import os
+import io
+import json
+import asyncio
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, AsyncIterator, BinaryIO, Dict, List, Optional
+
+import botocore
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from dotenv import load_dotenv, find_dotenv
+from utils.aws_utils import AwsUtlis
+from utils.executors import run_in
+
+env_path = find_dotenv()  # walks up until it finds .env
+loaded = load_dotenv(env_path)
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3")
+LOCAL_STORAGE_ROOT = os.getenv("LOCAL_STORAGE_ROOT", ".storage")
+
+# Objects above this size are transferred in parts
+MULTIPART_THRESHOLD = int(os.getenv("STORAGE_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+PART_SIZE = int(os.getenv("STORAGE_PART_SIZE", str(8 * 1024 * 1024)))
+PART_CONCURRENCY = int(os.getenv("STORAGE_PART_CONCURRENCY", "8"))
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+NOT_FOUND_CODES = {"NoSuchKey", "404", "NotFound"}
+
+
+class StorageError(Exception):
+    pass
+
+
+class ObjectNotFound(StorageError, FileNotFoundError):
+    pass
+
+
+class ObjectStorage(ABC):
+    """Interface shared by the storage backends."""
+
+    @abstractmethod
+    async def read(self, bucket: str, key: str) -> bytes: ...
+
+    @abstractmethod
+    def stream(
+        self, bucket: str, key: str, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]: ...
+
+    @abstractmethod
+    async def download(self, bucket: str, key: str, path: str) -> None: ...
+
+    @abstractmethod
+    async def write(
+        self,
+        bucket: str,
+        key: str,
+        data: bytes,
+        content_type: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> None: ...
+
+    @abstractmethod
+    async def upload_fileobj(
+        self,
+        fileobj: BinaryIO,
+        bucket: str,
+        key: str,
+        content_type: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> None: ...
+
+    async def upload_file(self, path: str, bucket: str, key: str) -> None:
+        fh = await run_in("storage", open, path, "rb")
+        try:
+            await self.upload_fileobj(fh, bucket, key)
+        finally:
+            fh.close()
+
+    @abstractmethod
+    async def head(self, bucket: str, key: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def list_keys(self, bucket: str, prefix: str) -> List[str]: ...
+
+
+def _allocate(path: str, size: int) -> BinaryIO:
+    """Open ``path`` for writing, pre-sized to ``size`` bytes."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fh = open(path, "wb")
+    try:
+        fh.truncate(size)
+    except OSError:
+        fh.close()
+        raise
+    return fh
+
+
+def _write_file(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    Path(path).write_bytes(data)
+
+
+# ------------------------------------------------------------------------
+# S3
+# ------------------------------------------------------------------------
+class S3Storage(ObjectStorage):
+    def __init__(self):
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD,
+            multipart_chunksize=PART_SIZE,
+            max_concurrency=PART_CONCURRENCY,
+        )
+
+    @staticmethod
+    def _client():
+        return AwsUtlis.get_s3_client()
+
+    async def _call(self, bucket: str, key: str, fn, *args, **kwargs):
+        try:
+            return await run_in("storage", fn, *args, **kwargs)
+        except botocore.exceptions.ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code in NOT_FOUND_CODES:
+                raise ObjectNotFound(f"s3://{bucket}/{key}") from e
+            raise StorageError(f"s3://{bucket}/{key}: {e}") from e
+        except S3UploadFailedError as e:
+            raise StorageError(f"s3://{bucket}/{key}: {e}") from e
+
+    async def read(self, bucket: str, key: str) -> bytes:
+        def _get():
+            return self._client().get_object(Bucket=bucket, Key=key)["Body"].read()
+
+        return await self._call(bucket, key, _get)
+
+    async def stream(
+        self, bucket: str, key: str, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        resp = await self._call(
+            bucket, key, self._client().get_object, Bucket=bucket, Key=key
+        )
+        body = resp["Body"]
+        try:
+            while True:
+                chunk = await run_in("storage", body.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def _read_range(self, bucket: str, key: str, start: int, end: int) -> bytes:
+        def _get():
+            return (
+                self._client()
+                .get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")["Body"]
+                .read()
+            )
+
+        return await self._call(bucket, key, _get)
+
+    async def download(self, bucket: str, key: str, path: str) -> None:
+        """Download to ``path``; large objects as concurrent ranged GETs."""
+        head = await self.head(bucket, key)
+        if head is None:
+            raise ObjectNotFound(f"s3://{bucket}/{key}")
+        size = head["ContentLength"]
+        if size <= MULTIPART_THRESHOLD:
+            data = await self.read(bucket, key)
+            await run_in("storage", _write_file, path, data)
+            return
+
+        semaphore = asyncio.Semaphore(PART_CONCURRENCY)
+        fh = await run_in("storage", _allocate, path, size)
+        fd = fh.fileno()
+
+        async def _part(start: int):
+            end = min(start + PART_SIZE, size) - 1
+            async with semaphore:
+                data = await self._read_range(bucket, key, start, end)
+                await run_in("storage", os.pwrite, fd, data, start)
+
+        try:
+            await asyncio.gather(*[_part(s) for s in range(0, size, PART_SIZE)])
+        finally:
+            await run_in("storage", fh.close)
+
+    async def write(
+        self,
+        bucket: str,
+        key: str,
+        data: bytes,
+        content_type: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> None:
+        if len(data) > MULTIPART_THRESHOLD:
+            await self.upload_fileobj(
+                io.BytesIO(data), bucket, key, content_type, metadata
+            )
+            return
+        kwargs: Dict[str, Any] = {"Bucket": bucket, "Key": key, "Body": data}
+        if content_type:
+            kwargs["ContentType"] = content_type
+        if metadata:
+            kwargs["Metadata"] = metadata
+        await self._call(bucket, key, self._client().put_object, **kwargs)
+
+    async def upload_fileobj(
+        self,
+        fileobj: BinaryIO,
+        bucket: str,
+        key: str,
+        content_type: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """Upload a file object; multipart (parts in parallel) above the threshold."""
+        extra: Dict[str, Any] = {}
+        if content_type:
+            extra["ContentType"] = content_type
+        if metadata:
+            extra["Metadata"] = metadata
+        await self._call(
+            bucket,
+            key,
+            self._client().upload_fileobj,
+            fileobj,
+            bucket,
+            key,
+            ExtraArgs=extra or None,
+            Config=self.transfer_config,
+        )
+
+    async def upload_file(self, path: str, bucket: str, key: str) -> None:
+        await self._call(
+            bucket,
+            key,
+            self._client().upload_file,
+            path,
+            bucket,
+            key,
+            Config=self.transfer_config,
+        )
+
+    async def head(self, bucket: str, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            return await self._call(
+                bucket, key, self._client().head_object, Bucket=bucket, Key=key
+            )
+        except ObjectNotFound:
+            return None
+
+    async def list_keys(self, bucket: str, prefix: str) -> List[str]:
+        def _list():
+            paginator = self._client().get_paginator("list_objects_v2")
+            return [
+                obj["Key"]
+                for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+                for obj in page.get("Contents", [])
+            ]
+
+        return await self._call(bucket, prefix, _list)
+
+
+# ------------------------------------------------------------------------
+# LOCAL FILESYSTEM
+# ------------------------------------------------------------------------
+class LocalStorage(ObjectStorage):
+    """Buckets are directories under ``root``; content type and metadata are
+    kept in a ``.<name>.meta.json`` file next to each object."""
+
+    META_SUFFIX = ".meta.json"
+
+    def __init__(self, root: str = LOCAL_STORAGE_ROOT):
+        self.root = Path(root)
+
+    def _path(self, bucket: str, key: str) -> Path:
+        path = (self.root / bucket / key).resolve()
+        if not str(path).startswith(str((self.root / bucket).resolve())):
+            raise StorageError(f"Invalid key: {key}")
+        return path
+
+    def _meta_path(self, path: Path) -> Path:
+        return path.with_name(f".{path.name}{self.META_SUFFIX}")
+
+    async def _io(self, bucket: str, key: str, fn, *args):
+        try:
+            return await run_in("storage", fn, *args)
+        except FileNotFoundError as e:
+            raise ObjectNotFound(f"{bucket}/{key}") from e
+        except OSError as e:
+            raise StorageError(f"{bucket}/{key}: {e}") from e
+
+    async def read(self, bucket: str, key: str) -> bytes:
+        return await self._io(bucket, key, self._path(bucket, key).read_bytes)
+
+    async def stream(
+        self, bucket: str, key: str, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        fh = await self._io(bucket, key, open, self._path(bucket, key), "rb")
+        try:
+            while True:
+                chunk = await run_in("storage", fh.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            fh.close()
+
+    async def download(self, bucket: str, key: str, path: str) -> None:
+        data = await self.read(bucket, key)
+        await run_in("storage", _write_file, path, data)
+
+    def _write_sync(
+        self, path: Path, fileobj: BinaryIO, content_type, metadata
+    ) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as out:
+            for chunk in iter(lambda: fileobj.read(STREAM_CHUNK_SIZE), b""):
+                out.write(chunk)
+        self._meta_path(path).write_text(
+            json.dumps({"ContentType": content_type, "Metadata": metadata or {}})
+        )
+
+    async def write(
+        self,
+        bucket: str,
+        key: str,
+        data: bytes,
+        content_type: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> None:
+        await self.upload_fileobj(io.BytesIO(data), bucket, key, content_type, metadata)
+
+    async def upload_fileobj(
+        self,
+        fileobj: BinaryIO,
+        bucket: str,
+        key: str,
+        content_type: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> None:
+        await self._io(
+            bucket,
+            key,
+            self._write_sync,
+            self._path(bucket, key),
+            fileobj,
+            content_type,
+            metadata,
+        )
+
+    def _head_sync(self, path: Path) -> Optional[Dict[str, Any]]:
+        if not path.is_file():
+            return None
+        digest = hashlib.md5()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(STREAM_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        meta_path = self._meta_path(path)
+        meta = json.loads(meta_path.read_text()) if meta_path.is_file() else {}
+        return {
+            "ContentLength": path.stat().st_size,
+            "ETag": f'"{digest.hexdigest()}"',
+            "ContentType": meta.get("ContentType"),
+            "Metadata": meta.get("Metadata", {}),
+        }
+
+    async def head(self, bucket: str, key: str) -> Optional[Dict[str, Any]]:
+        return await self._io(bucket, key, self._head_sync, self._path(bucket, key))
+
+    def _list_sync(self, bucket: str, prefix: str) -> List[str]:
+        base = self.root / bucket
+        if not base.is_dir():
+            return []
+        keys = []
+        for path in base.rglob("*"):
+            if path.is_file() and not (
+                path.name.startswith(".") and path.name.endswith(self.META_SUFFIX)
+            ):
+                key = path.relative_to(base).as_posix()
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    async def list_keys(self, bucket: str, prefix: str) -> List[str]:
+        return await self._io(bucket, prefix, self._list_sync, bucket, prefix)
+
+
+_storage: Optional[ObjectStorage] = None
+
+
+def get_storage() -> ObjectStorage:
+    """The process-wide storage backend selected by ``STORAGE_BACKEND``."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "local":
+            logger.info("Using local storage under %s", LOCAL_STORAGE_ROOT)
+            _storage = LocalStorage()
+        else:
+            _storage = S3Storage()
+    return _storage
@@ -0,0 +1,197 @@
+"""Schema-enforced structured output for the Bedrock and OpenRouter wrappers.
+
+``with_structured_output(Schema)`` on the wrappers returns a
+``StructuredCaller`` whose ``invoke`` / ``ainvoke`` return a validated
+instance of the pydantic model. Each wrapper asks the model for the schema
+in the strongest way its API supports (forced tool use, JSON-schema
+response format, or schema instructions in the prompt); the reply is then
+parsed here. Near-miss JSON — code fences, reasoning preambles, trailing
+commas, smart quotes, Python literals, truncated closing brackets — is
+repaired in place instead of re-asking the model.
+"""
+
+import re
+import json
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from utils.executors import run_in
+from utils.metrics import register_metrics_source
+
+logger = logging.getLogger(__name__)
+
+_THINK_RE = re.compile(r"<think>[\s\S]*?</think>", re.IGNORECASE)
+_FENCE_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)```", re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_PY_LITERAL_RE = re.compile(r"\b(True|False|None)\b")
+
+_stats_lock = threading.Lock()
+_stats = {"parsed": 0, "repaired": 0, "failed": 0}
+
+
+class StructuredOutputError(ValueError):
+    """The model reply could not be turned into the requested schema."""
+
+    def __init__(self, message: str, raw: Any = None):
+        super().__init__(message)
+        self.raw = raw
+
+
+def _count(outcome: str) -> None:
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+# ------------------------------------------------------------------------
+# SCHEMA HELPERS
+# ------------------------------------------------------------------------
+def tool_definition(schema: Type[BaseModel]) -> Tuple[str, str, Dict[str, Any]]:
+    """Name, description and JSON schema used to request ``schema``."""
+    description = (schema.__doc__ or "").strip() or f"Return a {schema.__name__}."
+    return schema.__name__, description, schema.model_json_schema()
+
+
+def json_instructions(schema: Type[BaseModel]) -> str:
+    """Prompt suffix for models without tool use or a JSON response mode."""
+    return (
+        "\n\nRespond with only a JSON object, without code fences or commentary, "
+        "that validates against this JSON schema:\n"
+        + json.dumps(schema.model_json_schema())
+    )
+
+
+# ------------------------------------------------------------------------
+# PARSING AND REPAIR
+# ------------------------------------------------------------------------
+def _json_span(text: str) -> str:
+    """The first JSON object/array in ``text``; unterminated strings and
+    brackets at the end (a cut-off reply) are closed."""
+    start = min(
+        (i for i in (text.find("{"), text.find("[")) if i != -1), default=-1
+    )
+    if start == -1:
+        return text
+    stack: List[str] = []
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return text[start : i + 1]
+    tail = '"' if in_string else ""
+    return text[start:] + tail + "".join(reversed(stack))
+
+
+def _repairs(text: str):
+    """Progressively more invasive rewrites of a near-miss JSON reply."""
+    text = _THINK_RE.sub("", text).strip()
+    fenced = _FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    text = _json_span(text)
+    yield text
+    text = _TRAILING_COMMA_RE.sub(r"\1", text)
+    yield text
+    text = text.replace("“", '"').replace("”", '"')
+    text = _PY_LITERAL_RE.sub(lambda m: _PY_LITERALS[m.group(1)], text)
+    yield _TRAILING_COMMA_RE.sub(r"\1", text)
+
+
+def _load_json(raw: str) -> Tuple[Any, bool]:
+    try:
+        return json.loads(raw), False
+    except json.JSONDecodeError:
+        pass
+    for candidate in _repairs(raw):
+        try:
+            return json.loads(candidate), True
+        except json.JSONDecodeError:
+            continue
+    raise StructuredOutputError("Reply is not valid JSON", raw)
+
+
+def _fit(value: Any, schema: Type[BaseModel]) -> Any:
+    # A bare array for a model with a single list field, e.g. {"questions": [...]}
+    fields = schema.model_fields
+    if isinstance(value, list) and len(fields) == 1:
+        return {next(iter(fields)): value}
+    # Some models wrap the object in the tool / schema name
+    if isinstance(value, dict) and set(value) == {schema.__name__}:
+        return value[schema.__name__]
+    return value
+
+
+def parse_structured(raw: Any, schema: Type[BaseModel]) -> BaseModel:
+    """Validate a model reply (JSON text or already decoded tool input)
+    against ``schema``, repairing near-miss JSON on the way."""
+    repaired = False
+    try:
+        if isinstance(raw, str):
+            value, repaired = _load_json(raw)
+        elif raw is None:
+            raise StructuredOutputError("Model returned no output", raw)
+        else:
+            value = raw
+        result = schema.model_validate(_fit(value, schema))
+    except ValidationError as e:
+        _count("failed")
+        raise StructuredOutputError(
+            f"Reply does not match {schema.__name__}: {e}", raw
+        ) from e
+    except StructuredOutputError:
+        _count("failed")
+        raise
+    _count("repaired" if repaired else "parsed")
+    return result
+
+
+# ------------------------------------------------------------------------
+# CALLER
+# ------------------------------------------------------------------------
+class StructuredCaller:
+    """What the wrappers' ``with_structured_output`` returns.
+
+    ``generate(messages)`` performs the blocking model call and returns the
+    raw reply (text, or the decoded arguments of a forced tool call).
+    """
+
+    def __init__(
+        self,
+        schema: Type[BaseModel],
+        generate: Callable[[List[Mapping[str, str]]], Any],
+        method: Optional[str] = None,
+    ):
+        self.schema = schema
+        self.method = method
+        self._generate = generate
+
+    def invoke(self, messages: List[Mapping[str, str]]) -> BaseModel:
+        return parse_structured(self._generate(messages), self.schema)
+
+    async def ainvoke(self, messages: List[Mapping[str, str]]) -> BaseModel:
+        return await run_in("llm", self.invoke, messages)
+
+
+def _structured_metrics() -> Dict[str, Any]:
+    with _stats_lock:
+        return dict(_stats)
+
+
+register_metrics_source("structured_output", _structured_metrics)
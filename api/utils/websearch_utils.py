@@ -5,6 +5,7 @@ import textwrap, aiohttp
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv, find_dotenv
 from tavily import TavilyClient
+from utils.deadline import call_timeout
 
 env_path = find_dotenv()  # walks up until it finds .env
 loaded = load_dotenv(env_path)
@@ -26,7 +27,8 @@ def tavily_search(
     return client.search(
         query,
         max_results=max_results,
-        include_raw_content=fetch_full_page
+        include_raw_content=fetch_full_page,
+        timeout=call_timeout(60),
     )
 
 def call_tavily_api(query: str) -> List[Dict[str, str]]:
@@ -63,35 +65,39 @@ def call_tavily_api(query: str) -> List[Dict[str, str]]:
     return results
 
 
-def call_serpapi(query: str) -> List[Dict[str, str]]:
+def serpapi_search(query: str, num: int = 5) -> List[Dict[str, str]]:
+    """Single SerpAPI request; raises on HTTP or network errors."""
     import requests
 
-    print(f"[DEBUG] call_serpapi: {query}")
-    api_url = "https://serpapi.com/search"
     params = {
         "q": query,
         "api_key": SERPAPI_API_KEY,
         "engine": "google",
-        "num": 5,
+        "num": num,
         "hl": "en",
     }
+    response = requests.get(
+        "https://serpapi.com/search", params=params, timeout=call_timeout(10)
+    )
+    response.raise_for_status()
+    return [
+        {
+            "title": item.get("title", ""),
+            "url": item.get("link", ""),
+            "snippet": item.get("snippet", ""),
+        }
+        for item in response.json().get("organic_results", [])
+    ]
+
+
+def call_serpapi(query: str) -> List[Dict[str, str]]:
+    print(f"[DEBUG] call_serpapi: {query}")
     results = []
     for attempt in range(3):
         print(f"[DEBUG] SerpAPI attempt {attempt+1}")
         try:
-            response = requests.get(api_url, params=params, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                organic_results = data.get("organic_results", [])
-                for item in organic_results:
-                    results.append(
-                        {
-                            "title": item.get("title", ""),
-                            "url": item.get("link", ""),
-                            "snippet": item.get("snippet", ""),
-                        }
-                    )
-                break
+            results = serpapi_search(query)
+            break
         except Exception as e:
             print(f"[DEBUG] SerpAPI attempt {attempt+1} failed with error: {e}")
             if attempt < 2:
@@ -142,7 +148,7 @@ def call_perplexity_api(
             api_url,
             headers=headers,
             json=payload,
-            timeout=30,  # Increased timeout for deep research
+            timeout=call_timeout(30),  # Increased timeout for deep research
         )
 
         if response.status_code == 200:
@@ -1,9 +1,16 @@
+import time
 import asyncio
 import json
 from typing import Awaitable, Dict, List, Any
 from datetime import datetime
 import logging
+import jwt
 from apis.api_gpt_chat import get_ai_response
+from apis.api_get_current_user import ALGORITHM, SECRET_KEY
+from db.db_session import SessionLocal
+from db_models.users import User as DbUser
+from utils.cancellation import note_reclaimed
+from utils.admission import AdmissionRejected, admission
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -25,8 +32,65 @@ class CustomLogsHandler:
             await self.websocket.send_json(data)
 
 
+def _user_id_for_token(token: str) -> str | None:
+    try:
+        email = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except jwt.PyJWTError as e:
+        logger.warning(f"Ignoring invalid websocket token: {e}")
+        return None
+    if not email:
+        return None
+    db = SessionLocal()
+    try:
+        user = db.query(DbUser).filter(DbUser.email == email).first()
+        return str(user.id) if user else None
+    finally:
+        db.close()
+
+
+async def _admission_tenant(websocket) -> str:
+    """Who a chat socket is admitted as.
+
+    The client sends the user's bearer token (``?token=`` or an
+    ``Authorization`` header), so chat shares the per-user limits of the
+    user's research runs however many sockets they open. Sockets without a
+    valid token share a single anonymous tenant; the client address is not
+    used because behind the proxy every socket has the same one.
+    """
+    token = websocket.query_params.get("token")
+    auth = websocket.headers.get("authorization", "")
+    if not token and auth.lower().startswith("bearer "):
+        token = auth[7:]
+    if token:
+        try:
+            user_id = await asyncio.to_thread(_user_id_for_token, token)
+        except Exception as e:
+            logger.error(f"Websocket user lookup failed: {e}")
+            user_id = None
+        if user_id:
+            return user_id
+    return "anonymous"
+
+
+async def _stream_response(data: str, websocket, tenant: str) -> None:
+    try:
+        async with admission.admit(tenant, "chat"):
+            await get_ai_response(data, websocket)
+        await websocket.send_json({"type": "END", "output": "Task generated"})
+    except AdmissionRejected as e:
+        await websocket.send_json(
+            {"type": "error", "output": str(e), "retry_after": e.retry_after}
+        )
+    except Exception as e:
+        logger.error(f"AI response failed: {e}")
+
+
 async def handle_websocket_communication(websocket, manager):
+    # The response streams in its own task so that the socket keeps being
+    # read; a disconnect ends the loop and cancels the stream
     running_task: asyncio.Task | None = None
+    started = 0.0
+    tenant = await _admission_tenant(websocket)
     try:
         while True:
             try:
@@ -38,16 +102,16 @@ async def handle_websocket_communication(websocket, manager):
                     logger.warning(
                         f"Received request while task is already running. Request data preview: {data[: min(20, len(data))]}..."
                     )
-                    websocket.send_json(
+                    await websocket.send_json(
                         {
                             "types": "logs",
                             "output": "Task already running. Please wait.",
                         }
                     )
                 elif data.startswith("start"):
-                    await get_ai_response(data, websocket)
-                    await websocket.send_json(
-                        {"type": "END", "output": "Task generated"}
+                    started = time.monotonic()
+                    running_task = asyncio.create_task(
+                        _stream_response(data, websocket, tenant)
                     )
                 else:
                     print("Error: Unknown command or not enough parameters provided.")
@@ -57,3 +121,5 @@ async def handle_websocket_communication(websocket, manager):
     finally:
         if running_task and not running_task.done():
             running_task.cancel()
+            await asyncio.gather(running_task, return_exceptions=True)
+            note_reclaimed("websocket", time.monotonic() - started)
@@ -45,7 +45,9 @@ export const useWebSocket = (
     if (!socket && typeof window !== 'undefined') {
       const fullHost = API_BASE_URL;
       const host = fullHost.replace('http://', '').replace('https://', '');
-      const ws_uri = `${fullHost.includes('https') ? 'wss:' : 'ws:'}//${host}/ws`;
+      // Browsers cannot set headers on a WebSocket; the token identifies the user for admission
+      const token = localStorage.getItem('authToken');
+      const ws_uri = `${fullHost.includes('https') ? 'wss:' : 'ws:'}//${host}/ws${token ? `?token=${encodeURIComponent(token)}` : ''}`;
 
       const newSocket = new WebSocket(ws_uri);
       setSocket(newSocket);